@@ -67,35 +67,22 @@ class MultimodalRAGDemo:
         """데이터셋을 MongoDB에 수집"""
         logger.info(f"📤 {min(len(dataset), limit)}개 문서를 MongoDB에 수집 중...")
         
-        successful_ingests = 0
-        failed_ingests = 0
+        items = dataset[:limit]
+        result = self.ingestion.batch_ingest_multimodal(
+            texts=[item['text'] for item in items],
+            image_paths=[item['image_path'] for item in items],
+            metadata_list=[item['metadata'] for item in items]
+        )
         
-        for i, item in enumerate(dataset[:limit]):
-            try:
-                if i % 10 == 0:
-                    logger.info(f"진행률: {i}/{min(len(dataset), limit)}")
-                
-                # 이미지 파일 존재 확인
-                if not os.path.exists(item['image_path']):
-                    logger.warning(f"이미지 파일이 없습니다: {item['image_path']}")
-                    failed_ingests += 1
-                    continue
-                
-                # 멀티모달 문서로 수집
-                doc_id = self.ingestion.ingest_multimodal(
-                    text=item['text'],
-                    image_path=item['image_path'],
-                    metadata=item['metadata']
-                )
-                
-                successful_ingests += 1
-                
-            except Exception as e:
-                logger.error(f"문서 수집 실패 ({item['id']}): {e}")
-                failed_ingests += 1
-                continue
+        for error in result['errors']:
+            logger.error(f"문서 수집 실패 ({items[error['index']]['id']}): {error['error']}")
+        
+        failed_ingests = len(result['errors'])
+        successful_ingests = len(items) - failed_ingests
         
         logger.info(f"✅ 데이터 수집 완료: 성공 {successful_ingests}개, 실패 {failed_ingests}개")
+        # 인덱스 모드는 주기적으로 동기화하므로, 바로 검색할 수 있게 지금 따라잡음
+        self.retriever.sync_index()
         return successful_ingests > 0
     
     def demonstrate_text_search(self):
@@ -40,6 +40,8 @@ def main():
         doc_id = ingestion.ingest_text(sample["text"], sample["metadata"])
         text_ids.append(doc_id)
         logger.info(f"Ingested text document: {doc_id}")
+    # The index mode syncs on a timer; catch up now so the new documents are searchable
+    retriever.sync_index()
     
     # Example 2: Search by text
     logger.info("\n=== Example 2: Text Search ===")
@@ -72,6 +74,7 @@ def main():
             multimodal_metadata
         )
         logger.info(f"Ingested multimodal document: {multimodal_id}")
+        retriever.sync_index()
         
         # Search for similar multimodal content
         logger.info("\n=== Example 4: Multimodal Search ===")
@@ -104,6 +107,7 @@ def main():
     
     batch_ids = ingestion.batch_ingest_texts(batch_texts, batch_metadata)
     logger.info(f"Batch ingested {len(batch_ids)} documents")
+    retriever.sync_index()
     
     # Example 6: Filtered search
     logger.info("\n=== Example 6: Filtered Search ===")
@@ -0,0 +1,57 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+class BoundedExecutor:
+    # Thread pool for blocking work awaited from async handlers: at most `workers` calls run
+    # at once and at most `max_pending` more wait for a thread; anything beyond that is
+    # rejected with ExecutorBusy instead of queueing without bound
+    def __init__(self, name: str, workers: int, max_pending: int):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.in_flight = 0
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix=f"api-{name}")
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        # Only touched from the event loop thread, so the counters need no lock
+        if self.in_flight >= self.workers + self.max_pending:
+            self.rejected += 1
+            raise ExecutorBusy(f"{self.name} executor is saturated ({self.in_flight} calls in flight)")
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+def executor_from_env(name: str, default_workers: int, default_pending: int) -> BoundedExecutor:
+    # API_<NAME>_WORKERS / API_<NAME>_MAX_PENDING, e.g. API_INFERENCE_WORKERS
+    prefix = f"API_{name.upper()}"
+    workers = int(os.getenv(f"{prefix}_WORKERS", str(default_workers)))
+    max_pending = int(os.getenv(f"{prefix}_MAX_PENDING", str(default_pending)))
+    logger.info(f"{name} executor: {workers} workers, {max_pending} pending")
+    return BoundedExecutor(name, workers, max_pending)
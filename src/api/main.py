@@ -8,11 +8,19 @@ sys.path.append(str(project_root))
 
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 from typing import Optional, Dict, Any, List
-import shutil
+import asyncio
+import hashlib
 import logging
+import tempfile
+import threading
 
-from src.database.schemas import SearchQuery, ContentType
+import orjson
+
+from src.api.executors import BoundedExecutor, ExecutorBusy, executor_from_env
+from src.database.schemas import BatchSearchRequest, SearchQuery, SearchResult, ContentType
+from src.models.registry import get_registry, get_embedder
 from src.utils.data_ingestion import DataIngestion
 from src.utils.retrieval import MultimodalRetriever
 
@@ -20,22 +28,127 @@ from src.utils.retrieval import MultimodalRetriever
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Multimodal MongoDB RAG API", version="1.0.0")
+# Services are created at startup, not import; both share one embedder whose models
+# load lazily (or via the warmup thread when MODEL_WARMUP is on)
+ingestion_service: Optional[DataIngestion] = None
+retrieval_service: Optional[MultimodalRetriever] = None
+
+# Handlers never block the event loop: model forward passes run on the inference executor,
+# pymongo calls and upload writes on the db executor, each with its own concurrency limit
+inference_executor: Optional[BoundedExecutor] = None
+db_executor: Optional[BoundedExecutor] = None
+
+
+def _warmup_models():
+    try:
+        get_registry().warmup()
+    except Exception as e:
+        logger.error(f"Model warmup failed: {e}")
+
 
-# Initialize services
-ingestion_service = DataIngestion()
-retrieval_service = MultimodalRetriever()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global ingestion_service, retrieval_service, inference_executor, db_executor
+    inference_executor = executor_from_env("inference", 4, 64)
+    db_executor = executor_from_env("db", 16, 256)
+    embedder = get_embedder()
+    ingestion_service = DataIngestion(embedder=embedder)
+    retrieval_service = MultimodalRetriever(embedder=embedder)
+    if os.getenv('MODEL_WARMUP', 'true').lower() == 'true':
+        threading.Thread(target=_warmup_models, name="model-warmup", daemon=True).start()
+    yield
+    retrieval_service.close()
+    inference_executor.shutdown()
+    db_executor.shutdown()
 
-# Create upload directory
+
+class FastJSONResponse(JSONResponse):
+    # orjson straight from plain dicts; handlers that return one skip FastAPI's
+    # jsonable_encoder walk over the payload
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=str, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+app = FastAPI(
+    title="Multimodal MongoDB RAG API", version="1.0.0", lifespan=lifespan,
+    default_response_class=FastJSONResponse
+)
+
+
+@app.exception_handler(ExecutorBusy)
+async def executor_busy(request, exc: ExecutorBusy):
+    return JSONResponse({"detail": str(exc)}, status_code=503)
+
+# Originals of ingested images, stored under their content hash; query images stay in memory
 UPLOAD_DIR = Path("data/uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv('SEARCH_BATCH_MAX_QUERIES', '1024'))
+
 
 @app.get("/")
 async def root():
     return {"message": "Multimodal MongoDB RAG API", "status": "active"}
 
 
+@app.get("/ready")
+async def ready():
+    # 503 until the services exist and every model is loaded
+    status = get_registry().status()
+    status["services"] = ingestion_service is not None and retrieval_service is not None
+    status["ready"] = status["ready"] and status["services"]
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/stats")
+async def stats():
+    embedder = get_embedder()
+    return {
+        "retrieval": retrieval_service.stats(),
+        "ingestion": ingestion_service.stats(),
+        "embedding_batches": embedder.stats() if hasattr(embedder, "stats") else None,
+        "executors": {
+            executor.name: executor.stats() for executor in (inference_executor, db_executor)
+        }
+    }
+
+
+def _store_upload(data: bytes, filename: Optional[str]) -> str:
+    # Content-addressed: re-uploading the same image reuses the existing file, and the
+    # client's filename only contributes its extension
+    suffix = Path(filename or "").suffix.lower()
+    file_path = UPLOAD_DIR / f"{hashlib.sha256(data).hexdigest()}{suffix}"
+    if not file_path.exists():
+        # A private temp file per writer, unique across threads and uvicorn worker processes
+        with tempfile.NamedTemporaryFile(dir=file_path.parent, prefix=f".{file_path.name}.",
+                                         suffix=".tmp", delete=False) as buffer:
+            buffer.write(data)
+        # NamedTemporaryFile creates 0600; keep uploads readable like a plain open() would
+        os.chmod(buffer.name, 0o644)
+        os.replace(buffer.name, file_path)
+    return str(file_path)
+
+
+async def _search(query: SearchQuery) -> List[SearchResult]:
+    embedded = await inference_executor.run(retrieval_service.embed_query, query)
+    return await db_executor.run(retrieval_service.search, query, embedded)
+
+
+def _result_dicts(results: List[SearchResult]) -> List[Dict[str, Any]]:
+    # Response rows are read off the result objects, never re-validated or model_dump()ed
+    return [
+        {
+            "document_id": str(result.document.id),
+            "score": result.score,
+            "content_type": result.document.content_type,
+            "text_content": result.document.text_content,
+            "image_path": result.document.image_path,
+            "metadata": result.document.metadata
+        }
+        for result in results
+    ]
+
+
 @app.post("/ingest/text")
 async def ingest_text(
     text: str = Form(...),
@@ -43,8 +156,11 @@ async def ingest_text(
 ):
     try:
         metadata_dict = eval(metadata) if metadata else {}
-        doc_id = ingestion_service.ingest_text(text, metadata_dict)
+        embedding = await inference_executor.run(ingestion_service.embedder.embed_text, text)
+        doc_id = await db_executor.run(ingestion_service.ingest_text, text, metadata_dict, embedding)
         return {"document_id": doc_id, "status": "success"}
+    except ExecutorBusy:
+        raise
     except Exception as e:
         logger.error(f"Error ingesting text: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -56,15 +172,18 @@ async def ingest_image(
     metadata: Optional[str] = Form(None)
 ):
     try:
-        # Save uploaded file
-        file_path = UPLOAD_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
+        # Persist the original while the model embeds the in-memory copy
+        data = await file.read()
         metadata_dict = eval(metadata) if metadata else {}
-        doc_id = ingestion_service.ingest_image(str(file_path), metadata_dict)
+        file_path, embedding = await asyncio.gather(
+            db_executor.run(_store_upload, data, file.filename),
+            inference_executor.run(ingestion_service.embedder.embed_image, data)
+        )
+        doc_id = await db_executor.run(ingestion_service.ingest_image, file_path, metadata_dict, embedding)
         
-        return {"document_id": doc_id, "status": "success", "file_path": str(file_path)}
+        return {"document_id": doc_id, "status": "success", "file_path": file_path}
+    except ExecutorBusy:
+        raise
     except Exception as e:
         logger.error(f"Error ingesting image: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -77,15 +196,20 @@ async def ingest_multimodal(
     metadata: Optional[str] = Form(None)
 ):
     try:
-        # Save uploaded file
-        file_path = UPLOAD_DIR / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
+        # Persist the original while the model embeds the in-memory copy
+        data = await file.read()
         metadata_dict = eval(metadata) if metadata else {}
-        doc_id = ingestion_service.ingest_multimodal(text, str(file_path), metadata_dict)
+        file_path, embeddings = await asyncio.gather(
+            db_executor.run(_store_upload, data, file.filename),
+            inference_executor.run(ingestion_service.embedder.embed_document, text, data)
+        )
+        doc_id = await db_executor.run(
+            ingestion_service.ingest_multimodal, text, file_path, metadata_dict, embeddings
+        )
         
         return {"document_id": doc_id, "status": "success"}
+    except ExecutorBusy:
+        raise
     except Exception as e:
         logger.error(f"Error ingesting multimodal content: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -95,28 +219,67 @@ async def ingest_multimodal(
 async def search_by_text(
     query: str = Form(...),
     top_k: int = Form(10),
-    content_type: Optional[str] = Form(None)
+    content_type: Optional[str] = Form(None),
+    rerank: Optional[int] = Form(None)
 ):
     try:
         content_type_enum = ContentType(content_type) if content_type else None
-        results = retrieval_service.search_by_text(query, top_k, content_type_enum)
+        results = await _search(SearchQuery(
+            query_text=query, top_k=top_k, content_type=content_type_enum, rerank=rerank
+        ))
         
-        return {
+        return FastJSONResponse({
             "query": query,
+            "results": _result_dicts(results)
+        })
+    except ExecutorBusy:
+        raise
+    except Exception as e:
+        logger.error(f"Error in text search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/search/batch")
+async def search_batch(request: BatchSearchRequest):
+    if len(request.queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=413, detail=f"At most {SEARCH_BATCH_MAX_QUERIES} queries per batch"
+        )
+    try:
+        queries = [SearchQuery(**item.model_dump()) for item in request.queries]
+        embedded = await inference_executor.run(retrieval_service.embed_queries, queries)
+        results = await db_executor.run(retrieval_service.search_batch, queries, embedded)
+        
+        return FastJSONResponse({
             "results": [
-                {
-                    "document_id": str(result.document.id),
-                    "score": result.score,
-                    "content_type": result.document.content_type,
-                    "text_content": result.document.text_content,
-                    "image_path": result.document.image_path,
-                    "metadata": result.document.metadata
-                }
-                for result in results
+                {"query": query.query_text, "results": _result_dicts(query_results)}
+                for query, query_results in zip(queries, results)
             ]
-        }
+        })
+    except ExecutorBusy:
+        raise
     except Exception as e:
-        logger.error(f"Error in text search: {e}")
+        logger.error(f"Error in batch search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/search/recall")
+async def search_recall(request: BatchSearchRequest):
+    # recall@top_k of the configured index search against exact float32 search
+    if len(request.queries) > SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=413, detail=f"At most {SEARCH_BATCH_MAX_QUERIES} queries per batch"
+        )
+    try:
+        queries = [SearchQuery(**item.model_dump()) for item in request.queries]
+        embedded = await inference_executor.run(retrieval_service.embed_queries, queries)
+        return await db_executor.run(retrieval_service.recall, queries, embedded)
+    except ExecutorBusy:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error measuring recall: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -124,31 +287,24 @@ async def search_by_text(
 async def search_by_image(
     file: UploadFile = File(...),
     top_k: int = Form(10),
-    content_type: Optional[str] = Form(None)
+    content_type: Optional[str] = Form(None),
+    rerank: Optional[int] = Form(None)
 ):
     try:
-        # Save uploaded file
-        file_path = UPLOAD_DIR / f"query_{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Decoded straight from the request body; query images are never written to disk
+        image = await file.read()
         
         content_type_enum = ContentType(content_type) if content_type else None
-        results = retrieval_service.search_by_image(str(file_path), top_k, content_type_enum)
+        results = await _search(
+            SearchQuery(query_image=image, top_k=top_k, content_type=content_type_enum, rerank=rerank)
+        )
         
-        return {
-            "query_image": str(file_path),
-            "results": [
-                {
-                    "document_id": str(result.document.id),
-                    "score": result.score,
-                    "content_type": result.document.content_type,
-                    "text_content": result.document.text_content,
-                    "image_path": result.document.image_path,
-                    "metadata": result.document.metadata
-                }
-                for result in results
-            ]
-        }
+        return FastJSONResponse({
+            "query_image": file.filename,
+            "results": _result_dicts(results)
+        })
+    except ExecutorBusy:
+        raise
     except Exception as e:
         logger.error(f"Error in image search: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -158,31 +314,24 @@ async def search_by_image(
 async def search_multimodal(
     text: str = Form(...),
     file: UploadFile = File(...),
-    top_k: int = Form(10)
+    top_k: int = Form(10),
+    rerank: Optional[int] = Form(None)
 ):
     try:
-        # Save uploaded file
-        file_path = UPLOAD_DIR / f"query_{file.filename}"
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        image = await file.read()
         
-        results = retrieval_service.search_multimodal(text, str(file_path), top_k)
+        results = await _search(SearchQuery(
+            query_text=text, query_image=image, top_k=top_k, content_type=ContentType.MULTIMODAL,
+            rerank=rerank
+        ))
         
-        return {
+        return FastJSONResponse({
             "query_text": text,
-            "query_image": str(file_path),
-            "results": [
-                {
-                    "document_id": str(result.document.id),
-                    "score": result.score,
-                    "content_type": result.document.content_type,
-                    "text_content": result.document.text_content,
-                    "image_path": result.document.image_path,
-                    "metadata": result.document.metadata
-                }
-                for result in results
-            ]
-        }
+            "query_image": file.filename,
+            "results": _result_dicts(results)
+        })
+    except ExecutorBusy:
+        raise
     except Exception as e:
         logger.error(f"Error in multimodal search: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -198,32 +347,35 @@ async def hybrid_search(
     try:
         if not text and not file:
             raise ValueError("At least one of text or image must be provided")
+        if not 0 <= text_weight <= 1:
+            raise ValueError(f"text_weight must be between 0 and 1, got {text_weight}")
         
-        image_path = None
-        if file:
-            file_path = UPLOAD_DIR / f"query_{file.filename}"
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            image_path = str(file_path)
+        image = await file.read() if file else None
         
-        results = retrieval_service.hybrid_search(text, image_path, text_weight, top_k)
+        # Embed both sides up front so the retrieval half only touches the index and MongoDB
+        embeddings = {}
+        if text:
+            embeddings["text"] = await inference_executor.run(
+                retrieval_service.embed_query, SearchQuery(query_text=text)
+            )
+        if image:
+            embeddings["image"] = await inference_executor.run(
+                retrieval_service.embed_query, SearchQuery(query_image=image)
+            )
+        results = await db_executor.run(
+            retrieval_service.hybrid_search, text, image, text_weight, top_k, embeddings
+        )
         
-        return {
+        return FastJSONResponse({
             "query_text": text,
-            "query_image": image_path,
+            "query_image": file.filename if file else None,
             "text_weight": text_weight,
-            "results": [
-                {
-                    "document_id": str(result.document.id),
-                    "score": result.score,
-                    "content_type": result.document.content_type,
-                    "text_content": result.document.text_content,
-                    "image_path": result.document.image_path,
-                    "metadata": result.document.metadata
-                }
-                for result in results
-            ]
-        }
+            "results": _result_dicts(results)
+        })
+    except ExecutorBusy:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error in hybrid search: {e}")
         raise HTTPException(status_code=500, detail=str(e))
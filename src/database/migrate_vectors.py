@@ -0,0 +1,101 @@
+import argparse
+import logging
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pymongo import UpdateOne
+
+from .mongodb_client import MongoDBClient
+from .vector_codec import EMBEDDING_FIELDS, STORAGE_MODES, decode_vector, encode_embedding, is_packed
+
+logger = logging.getLogger(__name__)
+
+
+class VectorStorageMigration:
+    # Rewrites embedding fields in place, in _id order, checkpointing the last _id
+    # so an interrupted run resumes where it stopped
+    def __init__(self, collection_name: str = "multimodal_documents",
+                 target: str = "float32", batch_size: int = 500):
+        if target not in STORAGE_MODES:
+            raise ValueError(f"Unknown target storage: {target} (expected one of {STORAGE_MODES})")
+        self.db_client = MongoDBClient()
+        self.db_client.connect()
+        self.collection = self.db_client.get_collection(collection_name)
+        self.checkpoints = self.db_client.get_collection("migrations")
+        self.checkpoint_id = f"vector_storage:{collection_name}:{target}"
+        self.target = target
+        self.batch_size = batch_size
+
+    def _convert(self, value: Any) -> Optional[Any]:
+        # None when the value is already in the target format
+        if value is None:
+            return None
+        if self.target == "list":
+            return decode_vector(value).tolist() if is_packed(value) else None
+        if is_packed(value) and decode_vector(value).dtype.name == self.target:
+            return None
+        return encode_embedding(decode_vector(value), self.target)
+
+    def run(self, restart: bool = False) -> Dict[str, int]:
+        checkpoint = None if restart else self.checkpoints.find_one({"_id": self.checkpoint_id})
+        last_id = checkpoint["last_id"] if checkpoint else None
+        if last_id is not None:
+            logger.info(f"Resuming migration after _id {last_id}")
+
+        stats = {"scanned": 0, "updated": 0}
+        projection = {field: 1 for field in EMBEDDING_FIELDS}
+        while True:
+            mongo_query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            batch = list(
+                self.collection.find(mongo_query, projection).sort("_id", 1).limit(self.batch_size)
+            )
+            if not batch:
+                break
+
+            operations = []
+            for doc in batch:
+                updates = {}
+                for field in EMBEDDING_FIELDS:
+                    converted = self._convert(doc.get(field))
+                    if converted is not None:
+                        updates[field] = converted
+                if updates:
+                    operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": updates}))
+
+            if operations:
+                result = self.collection.bulk_write(operations, ordered=False)
+                stats["updated"] += result.modified_count
+            stats["scanned"] += len(batch)
+
+            last_id = batch[-1]["_id"]
+            self.checkpoints.update_one(
+                {"_id": self.checkpoint_id},
+                {"$set": {"last_id": last_id, "updated_at": datetime.utcnow(), **stats}},
+                upsert=True
+            )
+            logger.info(f"Migrated {stats['scanned']} documents ({stats['updated']} rewritten)")
+
+        self.checkpoints.update_one(
+            {"_id": self.checkpoint_id},
+            {"$set": {"completed_at": datetime.utcnow()}},
+            upsert=True
+        )
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert stored embeddings between list and packed Binary formats")
+    parser.add_argument("--target", choices=STORAGE_MODES, default="float32")
+    parser.add_argument("--collection", default="multimodal_documents")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    migration = VectorStorageMigration(args.collection, args.target, args.batch_size)
+    stats = migration.run(restart=args.restart)
+    logger.info(f"Migration complete: {stats}")
+
+
+if __name__ == "__main__":
+    main()
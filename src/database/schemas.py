@@ -1,8 +1,10 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from enum import Enum
 
+from .vector_codec import decode_vector, is_packed
+
 
 class ContentType(str, Enum):
     TEXT = "text"
@@ -23,6 +25,14 @@ class Document(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     
+    @field_validator("text_embedding", "image_embedding", "multimodal_embedding", mode="before")
+    @classmethod
+    def _unpack_embedding(cls, value):
+        # Embeddings may be stored as packed float32/float16 Binary
+        if is_packed(value):
+            return decode_vector(value).tolist()
+        return value
+    
     class Config:
         populate_by_name = True
         json_encoders = {
@@ -33,11 +43,30 @@ class Document(BaseModel):
 class SearchQuery(BaseModel):
     query_text: Optional[str] = None
     query_image_path: Optional[str] = None
+    # Encoded image bytes (e.g. an upload body), used instead of query_image_path
+    query_image: Optional[bytes] = None
     query_image_url: Optional[str] = None
     content_type: Optional[ContentType] = None
     top_k: int = 10
     threshold: Optional[float] = None
     metadata_filter: Optional[Dict[str, Any]] = None
+    # IVF lists probed per query when the approximate index is active
+    nprobe: Optional[int] = None
+    # Quantized index: top_k * rerank candidates rescored in float32 (default INDEX_RERANK)
+    rerank: Optional[int] = None
+
+
+class BatchSearchItem(BaseModel):
+    query_text: str
+    top_k: int = 10
+    content_type: Optional[ContentType] = None
+    metadata_filter: Optional[Dict[str, Any]] = None
+    threshold: Optional[float] = None
+    rerank: Optional[int] = None
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchItem]
 
 
 class SearchResult(BaseModel):
@@ -0,0 +1,57 @@
+import os
+import struct
+from typing import Any, List, Optional, Union
+
+import numpy as np
+from bson.binary import Binary, USER_DEFINED_SUBTYPE
+
+# Packed embedding layout: 4-byte header (format version, dtype code, dimension) followed
+# by the raw little-endian components
+HEADER = struct.Struct("<BBH")
+FORMAT_VERSION = 1
+
+DTYPE_CODES = {"float32": 1, "float16": 2}
+CODE_DTYPES = {code: np.dtype(name).newbyteorder("<") for name, code in DTYPE_CODES.items()}
+
+STORAGE_MODES = ("list", "float32", "float16")
+
+EMBEDDING_FIELDS = ("text_embedding", "image_embedding", "multimodal_embedding")
+
+
+def storage_mode_from_env() -> str:
+    mode = os.getenv('EMBEDDING_STORAGE', 'list').lower()
+    if mode not in STORAGE_MODES:
+        raise ValueError(f"Unknown EMBEDDING_STORAGE: {mode} (expected one of {STORAGE_MODES})")
+    return mode
+
+
+def encode_vector(vector: Union[np.ndarray, List[float]], dtype: str = "float32") -> Binary:
+    array = np.asarray(vector, dtype=CODE_DTYPES[DTYPE_CODES[dtype]]).ravel()
+    header = HEADER.pack(FORMAT_VERSION, DTYPE_CODES[dtype], len(array))
+    return Binary(header + array.tobytes(), USER_DEFINED_SUBTYPE)
+
+
+def is_packed(value: Any) -> bool:
+    return isinstance(value, (bytes, bytearray, memoryview))
+
+
+def decode_vector(value: Any) -> Optional[np.ndarray]:
+    # Packed values come back as a read-only view over the BSON bytes (no copy);
+    # legacy float lists are converted as before
+    if value is None:
+        return None
+    if is_packed(value):
+        version, code, dim = HEADER.unpack_from(value)
+        if version != FORMAT_VERSION or code not in CODE_DTYPES:
+            raise ValueError(f"Unsupported packed embedding header: version={version}, dtype={code}")
+        return np.frombuffer(value, dtype=CODE_DTYPES[code], count=dim, offset=HEADER.size)
+    return np.asarray(value, dtype=np.float32)
+
+
+def encode_embedding(vector: Union[np.ndarray, List[float], None], mode: str) -> Any:
+    # Value to store in Mongo for the configured EMBEDDING_STORAGE mode
+    if vector is None:
+        return None
+    if mode == "list":
+        return vector.tolist() if isinstance(vector, np.ndarray) else list(vector)
+    return encode_vector(vector, mode)
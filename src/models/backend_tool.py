@@ -0,0 +1,189 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import sys
+from typing import Dict, List
+
+import numpy as np
+
+from .backends import BACKENDS, onnx_file, onnx_model_dir
+from .registry import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+OPSET = 17
+
+SAMPLE_TEXTS = [
+    "a photo of a cat sitting on a sofa",
+    "서울 야경과 한강 다리",
+    "red sports car parked on a rainy street",
+    "a bowl of ramen with a soft boiled egg",
+    "diagram of a neural network architecture",
+    "children playing football in the park at sunset",
+]
+
+
+def export_clip(model_name: str, directory: str) -> None:
+    import torch
+    from transformers import CLIPModel, CLIPProcessor
+
+    model = CLIPModel.from_pretrained(model_name).eval()
+    processor = CLIPProcessor.from_pretrained(model_name)
+    processor.save_pretrained(directory)
+
+    class ImageTower(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model.get_image_features(pixel_values=pixel_values)
+
+    class TextTower(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+    size = processor.image_processor.crop_size["height"]
+    tokens = processor.tokenizer(SAMPLE_TEXTS[:2], return_tensors="pt", padding=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            ImageTower(), (torch.zeros(1, 3, size, size),), onnx_file(directory, "image", "onnx"),
+            input_names=["pixel_values"], output_names=["image_embeds"],
+            dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}}, opset_version=OPSET
+        )
+        torch.onnx.export(
+            TextTower(), (tokens["input_ids"], tokens["attention_mask"]), onnx_file(directory, "text", "onnx"),
+            input_names=["input_ids", "attention_mask"], output_names=["text_embeds"],
+            dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"},
+                          "text_embeds": {0: "batch"}},
+            opset_version=OPSET
+        )
+
+
+def export_text(model_name: str, directory: str) -> None:
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    model = SentenceTransformer(model_name, device="cpu").eval()
+    pooling = next(module for module in model if isinstance(module, Pooling))
+    if pooling.get_pooling_mode_str() != "mean":
+        raise ValueError(f"{model_name} uses {pooling.get_pooling_mode_str()} pooling; only mean is supported")
+    transformer = model[0]
+    transformer.tokenizer.save_pretrained(directory)
+    with open(os.path.join(directory, "text.json"), "w") as f:
+        json.dump({
+            "max_length": transformer.max_seq_length,
+            "normalize": any(isinstance(module, Normalize) for module in model),
+        }, f)
+
+    tokens = transformer.tokenizer(SAMPLE_TEXTS[:2], return_tensors="pt", padding=True)
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in tokens]
+
+    class Encoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = transformer.auto_model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    with torch.no_grad():
+        torch.onnx.export(
+            Encoder(), tuple(tokens[name] for name in input_names), onnx_file(directory, "text", "onnx"),
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names},
+                          "last_hidden_state": {0: "batch", 1: "sequence"}},
+            opset_version=OPSET
+        )
+
+
+def quantize(directory: str, tower: str) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    # int8 weights for MatMul/Gemm, activations quantized at run time
+    quantize_dynamic(onnx_file(directory, tower, "onnx"), onnx_file(directory, tower, "onnx-int8"),
+                     weight_type=QuantType.QInt8)
+
+
+def export(registry: ModelRegistry, int8: bool) -> None:
+    for name, exporter in (("clip", export_clip), ("text", export_text)):
+        model_name = registry.model_names[name]
+        directory = onnx_model_dir(model_name)
+        os.makedirs(directory, exist_ok=True)
+        exporter(model_name, directory)
+        towers = ("image", "text") if name == "clip" else ("text",)
+        if int8:
+            for tower in towers:
+                quantize(directory, tower)
+        logger.info(f"Exported {model_name} to {directory}")
+
+
+def _embed(registry: ModelRegistry, texts: List[str], images: List[str]) -> Dict[str, np.ndarray]:
+    from .embeddings import MultimodalEmbedder
+
+    embedder = MultimodalEmbedder(registry)
+    results = {"text_embedding": embedder.embed_text(texts)}
+    if images:
+        # Each image paired with a sample caption for the multimodal rows
+        document = embedder.embed_document((texts * len(images))[:len(images)], images)
+        results["image_embedding"] = document["image_embedding"]
+        results["multimodal_embedding"] = document["multimodal_embedding"]
+    return results
+
+
+def check(backend: str, texts: List[str], images: List[str], tolerance: float) -> bool:
+    # Embeds the same inputs through fp32 torch and `backend`; every row must keep a cosine
+    # similarity of at least `tolerance` with its fp32 counterpart
+    reference = ModelRegistry()
+    reference.backends = {name: "torch" for name in reference.backends}
+    candidate = ModelRegistry()
+    candidate.backends = {name: backend for name in candidate.backends}
+
+    expected = _embed(reference, texts, images)
+    actual = _embed(candidate, texts, images)
+    passed = True
+    for field, rows in expected.items():
+        a = rows / np.linalg.norm(rows, axis=1, keepdims=True)
+        b = actual[field] / np.linalg.norm(actual[field], axis=1, keepdims=True)
+        cosine = np.sum(a * b, axis=1)
+        ok = bool(cosine.min() >= tolerance)
+        passed = passed and ok
+        logger.info(f"{field:<22} rows={len(cosine):<4} min={cosine.min():.5f} mean={cosine.mean():.5f} "
+                    f"{'ok' if ok else 'FAIL'}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export CLIP/MiniLM to ONNX and check backends against fp32")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="write ONNX graphs to ONNX_MODEL_DIR")
+    export_parser.add_argument("--int8", action="store_true", help="also write dynamically quantized graphs")
+    check_parser = commands.add_parser("check", help="compare a backend's embeddings with fp32 torch")
+    check_parser.add_argument("backend", choices=[backend for backend in BACKENDS if backend != "torch"])
+    check_parser.add_argument("--images", default="data/images", help="directory of sample images")
+    check_parser.add_argument("--max-images", type=int, default=32)
+    check_parser.add_argument("--tolerance", type=float, default=0.99, help="minimum cosine similarity")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        export(ModelRegistry(), args.int8)
+        return
+    images = sorted(
+        path for pattern in ("*.jpg", "*.jpeg", "*.png") for path in glob.glob(os.path.join(args.images, pattern))
+    )[:args.max_images]
+    if not images:
+        logger.warning(f"No images in {args.images}; checking text embeddings only")
+    if not check(args.backend, SAMPLE_TEXTS, images, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# torch: eager fp32 (default); torch-int8: dynamic int8 Linear layers, CPU only;
+# onnx / onnx-int8: graphs written by `python -m src.models.backend_tool export`
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+
+def backend_from_env(kind: str) -> str:
+    # CLIP_BACKEND / TEXT_BACKEND, next to CLIP_MODEL_NAME / TEXT_MODEL_NAME
+    backend = os.getenv(f'{kind.upper()}_BACKEND', 'torch').lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"{kind.upper()}_BACKEND must be one of {', '.join(BACKENDS)}, got {backend!r}")
+    return backend
+
+
+def onnx_model_dir(model_name: str) -> str:
+    # ONNX_MODEL_DIR/<model name with / replaced>, e.g. models/onnx/openai__clip-vit-base-patch32
+    root = os.getenv('ONNX_MODEL_DIR', 'models/onnx')
+    return os.path.join(root, model_name.replace("/", "__"))
+
+
+def onnx_file(directory: str, tower: str, backend: str) -> str:
+    suffix = ".int8.onnx" if backend == "onnx-int8" else ".onnx"
+    return os.path.join(directory, tower + suffix)
+
+
+def _onnx_session(path: str):
+    import onnxruntime as ort
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run `python -m src.models.backend_tool export` first")
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # 0 lets ONNX Runtime use every core
+    options.intra_op_num_threads = int(os.getenv('ONNX_INTRA_OP_THREADS', '0'))
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+def _quantize_dynamic(model):
+    import torch
+
+    # Weights of every Linear layer stored as int8, activations quantized on the fly
+    return torch.ao.quantization.quantize_dynamic(
+        model.cpu().eval(), {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+class TorchClipBackend:
+    # Both CLIP towers as numpy in / numpy out; outputs are the unnormalized projections
+    # (get_image_features / get_text_features)
+    def __init__(self, model, device):
+        self.model = model.eval()
+        self.device = device
+
+    def image_features(self, pixel_values: np.ndarray) -> np.ndarray:
+        import torch
+        with torch.no_grad():
+            pixel_values = torch.from_numpy(pixel_values).to(self.device)
+            return self.model.get_image_features(pixel_values=pixel_values).cpu().numpy()
+
+    def text_features(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        import torch
+        with torch.no_grad():
+            return self.model.get_text_features(
+                input_ids=torch.from_numpy(input_ids).to(self.device),
+                attention_mask=torch.from_numpy(attention_mask).to(self.device)
+            ).cpu().numpy()
+
+
+class OnnxClipBackend:
+    def __init__(self, image_session, text_session):
+        self.image_session = image_session
+        self.text_session = text_session
+
+    def image_features(self, pixel_values: np.ndarray) -> np.ndarray:
+        return self.image_session.run(None, {"pixel_values": pixel_values.astype(np.float32)})[0]
+
+    def text_features(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        return self.text_session.run(None, {
+            "input_ids": input_ids.astype(np.int64),
+            "attention_mask": attention_mask.astype(np.int64),
+        })[0]
+
+
+class TorchTextBackend:
+    def __init__(self, model):
+        self.model = model
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, convert_to_numpy=True)
+
+
+class OnnxTextBackend:
+    # The sentence-transformer's transformer as a graph; pooling and normalization are
+    # done here the way the exported model's own modules did them (see text.json)
+    def __init__(self, session, tokenizer, config: Dict[str, Any]):
+        self.session = session
+        self.tokenizer = tokenizer
+        self.max_length = config["max_length"]
+        self.normalize = config["normalize"]
+        self._inputs = {node.name for node in session.get_inputs()}
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        tokens = self.tokenizer(texts, padding=True, truncation=True,
+                                max_length=self.max_length, return_tensors="np")
+        feed = {name: tokens[name].astype(np.int64) for name in self._inputs}
+        hidden = self.session.run(None, feed)[0]
+        # Mean over real tokens
+        mask = tokens["attention_mask"][..., None].astype(hidden.dtype)
+        embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.astype(np.float32)
+
+
+def load_clip(model_name: str, backend: str, device) -> Tuple[Any, Any]:
+    # (backend, CLIPProcessor); the processor only tokenizes and prepares pixels
+    from transformers import CLIPModel, CLIPProcessor
+
+    if backend in ("onnx", "onnx-int8"):
+        directory = onnx_model_dir(model_name)
+        clip = OnnxClipBackend(
+            _onnx_session(onnx_file(directory, "image", backend)),
+            _onnx_session(onnx_file(directory, "text", backend))
+        )
+        # Saved next to the graphs by the export, so serving needs no model download
+        return clip, CLIPProcessor.from_pretrained(directory)
+
+    model = CLIPModel.from_pretrained(model_name)
+    if backend == "torch-int8":
+        return TorchClipBackend(_quantize_dynamic(model), "cpu"), CLIPProcessor.from_pretrained(model_name)
+    return TorchClipBackend(model.to(device), device), CLIPProcessor.from_pretrained(model_name)
+
+
+def load_text(model_name: str, backend: str) -> Any:
+    if backend in ("onnx", "onnx-int8"):
+        from transformers import AutoTokenizer
+
+        directory = onnx_model_dir(model_name)
+        with open(os.path.join(directory, "text.json")) as f:
+            config = json.load(f)
+        return OnnxTextBackend(
+            _onnx_session(onnx_file(directory, "text", backend)), AutoTokenizer.from_pretrained(directory), config
+        )
+
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch-int8":
+        return TorchTextBackend(_quantize_dynamic(SentenceTransformer(model_name, device="cpu")))
+    return TorchTextBackend(SentenceTransformer(model_name))
+
+
+def model_id(model_name: str, backend: str) -> str:
+    # What produced an embedding: fp32 torch keeps the bare name so existing cache keys stay valid
+    return model_name if backend == "torch" else f"{model_name}:{backend}"
+
@@ -0,0 +1,160 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from .preprocessing import ImageSource, as_image_list
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    # Collects single items from concurrent callers and runs them through `run` as one batch,
+    # once max_batch_size items are waiting or max_wait has passed since the first one
+    def __init__(self, name: str, run: Callable[[List[Any]], np.ndarray],
+                 max_batch_size: int = 32, max_wait: float = 0.005):
+        self.name = name
+        self.run = run
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.items = 0
+        self._queue: "queue.SimpleQueue[Tuple[Any, Future]]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, items: List[Any]) -> List[Future]:
+        self._ensure_started()
+        futures = []
+        for item in items:
+            future = Future()
+            self._queue.put((item, future))
+            futures.append(future)
+        return futures
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"embed-batch-{self.name}", daemon=True)
+                self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[Tuple[Any, Future]]) -> None:
+        try:
+            embeddings = self.run([item for item, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # One bad input (e.g. an unreadable image) must not fail the other callers
+            for entry in batch:
+                self._run_batch([entry])
+            return
+        self.batches += 1
+        self.items += len(batch)
+        if isinstance(embeddings, dict):
+            # embed_document: one row of each embedding per item
+            embeddings = [{key: value[i] for key, value in embeddings.items()} for i in range(len(batch))]
+        for row, (_, future) in zip(embeddings, batch):
+            future.set_result(row)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
+
+
+class EmbeddingScheduler:
+    # Drop-in front for MultimodalEmbedder that merges concurrent embed_* calls into batched
+    # forward passes. Callers that already pass a full batch go straight to the model.
+    def __init__(self, embedder, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.embedder = embedder
+        self.max_batch_size = max_batch_size
+        max_wait = max_wait_ms / 1000.0
+        self._batchers = {
+            "text": MicroBatcher("text", embedder.embed_text, max_batch_size, max_wait),
+            "image": MicroBatcher("image", embedder.embed_image, max_batch_size, max_wait),
+            "multimodal": MicroBatcher(
+                "multimodal",
+                lambda pairs: embedder.embed_multimodal([t for t, _ in pairs], [i for _, i in pairs]),
+                max_batch_size, max_wait
+            ),
+            "document": MicroBatcher(
+                "document",
+                lambda pairs: embedder.embed_document([t for t, _ in pairs], [i for _, i in pairs]),
+                max_batch_size, max_wait
+            ),
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.embedder, name)
+
+    def _embed(self, kind: str, items: List[Any], direct: Callable[[], np.ndarray]) -> np.ndarray:
+        if not items or len(items) >= self.max_batch_size:
+            return direct()
+        futures = self._batchers[kind].submit(items)
+        return np.vstack([future.result() for future in futures])
+
+    def embed_text(self, texts: Union[str, List[str]]) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        return self._embed("text", texts, lambda: self.embedder.embed_text(texts))
+
+    def embed_image(self, images: Union[ImageSource, List[ImageSource]]) -> np.ndarray:
+        images = as_image_list(images)
+        return self._embed("image", images, lambda: self.embedder.embed_image(images))
+
+    def embed_multimodal(self, texts: Union[str, List[str]],
+                         images: Union[ImageSource, List[ImageSource]]) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        images = as_image_list(images)
+        return self._embed(
+            "multimodal", list(zip(texts, images)), lambda: self.embedder.embed_multimodal(texts, images)
+        )
+
+    def embed_document(self, texts: Union[str, List[str]],
+                       images: Union[ImageSource, List[ImageSource]]) -> Dict[str, np.ndarray]:
+        if isinstance(texts, str):
+            texts = [texts]
+        images = as_image_list(images)
+        pairs = list(zip(texts, images))
+        if not pairs or len(pairs) >= self.max_batch_size:
+            return self.embedder.embed_document(texts, images)
+        rows = [future.result() for future in self._batchers["document"].submit(pairs)]
+        return {key: np.vstack([row[key] for row in rows]) for key in rows[0]}
+
+    def stats(self) -> Dict[str, Any]:
+        return {kind: batcher.stats() for kind, batcher in self._batchers.items()}
+
+
+def scheduler_from_env(embedder):
+    # EMBED_BATCHING=false hands callers the bare embedder
+    if os.getenv('EMBED_BATCHING', 'true').lower() != 'true':
+        return embedder
+    return EmbeddingScheduler(
+        embedder,
+        max_batch_size=int(os.getenv('EMBED_BATCH_MAX_SIZE', '32')),
+        max_wait_ms=float(os.getenv('EMBED_BATCH_MAX_WAIT_MS', '5'))
+    )
@@ -0,0 +1,345 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+import numpy as np
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from ..database.vector_codec import decode_vector, encode_vector
+
+from .preprocessing import ImageSource, as_image_list
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    # Bounded LRU with a per-entry TTL; values are read-only embedding rows
+    def __init__(self, max_size: int = 1024, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        return self.get_many([key])[0]
+
+    def _get_locked(self, key: Hashable, now: float) -> Optional[np.ndarray]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            self._entries.move_to_end(key)
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+            self.evictions += 1
+        return None
+
+    def put(self, key: Hashable, value: np.ndarray) -> None:
+        value = np.array(value, dtype=np.float32)
+        value.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_many(self, keys: List[Hashable], count: bool = True) -> List[Optional[np.ndarray]]:
+        # count=False leaves hits/misses to the caller, see record()
+        now = time.monotonic()
+        with self._lock:
+            rows = [self._get_locked(key, now) for key in keys]
+            if count:
+                hits = sum(row is not None for row in rows)
+                self.hits += hits
+                self.misses += len(rows) - hits
+        return rows
+
+    def record(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def put_many(self, items: List[Tuple[Hashable, np.ndarray]]) -> None:
+        for key, value in items:
+            self.put(key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
+
+
+class PersistentEmbeddingCache:
+    # Embeddings by content hash in a MongoDB side collection, so they survive restarts and
+    # are shared by every ingesting process; same get/put contract as EmbeddingCache.
+    # Entries expire `ttl` seconds after they were written (MongoDB TTL index), so the
+    # collection does not keep every distinct input ever ingested; ttl <= 0 keeps them.
+    def __init__(self, collection, ttl: float = 30 * 24 * 3600.0):
+        self.collection = collection
+        self.ttl = ttl
+        if ttl > 0:
+            try:
+                self.collection.create_index("created_at", expireAfterSeconds=int(ttl))
+            except OperationFailure as e:
+                # An existing index with another expiry; collMod it or drop it to change the TTL
+                logger.warning(f"Keeping existing TTL index on {collection.name}: {e}")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _id(key: Hashable) -> str:
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: List[Hashable], count: bool = True) -> List[Optional[np.ndarray]]:
+        if not keys:
+            return []
+        ids = [self._id(key) for key in keys]
+        found = {
+            doc["_id"]: decode_vector(doc["vector"])
+            for doc in self.collection.find({"_id": {"$in": list(set(ids))}}, {"vector": 1})
+        }
+        rows = [found.get(doc_id) for doc_id in ids]
+        if count:
+            hits = sum(row is not None for row in rows)
+            self.record(hits, len(rows) - hits)
+        return rows
+
+    def record(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def put(self, key: Hashable, value: np.ndarray) -> None:
+        self.put_many([(key, value)])
+
+    def put_many(self, items: List[Tuple[Hashable, np.ndarray]]) -> None:
+        if not items:
+            return
+        now = datetime.utcnow()
+        # $setOnInsert: concurrent writers of the same content leave the first copy in place
+        self.collection.bulk_write([
+            UpdateOne(
+                {"_id": self._id(key)},
+                {"$setOnInsert": {"vector": encode_vector(value), "created_at": now}},
+                upsert=True
+            )
+            for key, value in items
+        ], ordered=False)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+        }
+
+
+def normalize_text(text: str) -> str:
+    # Whitespace and Unicode composition differences do not change what the query means
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def image_digest(image: ImageSource) -> str:
+    # Paths, bytes and file objects hash their encoded content, so the same upload
+    # maps to the same key however it arrives
+    hasher = hashlib.sha256()
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(block)
+    elif isinstance(image, (bytes, bytearray, memoryview)):
+        hasher.update(image)
+    elif hasattr(image, "read"):
+        start = image.tell()
+        for block in iter(lambda: image.read(1 << 20), b""):
+            hasher.update(block)
+        image.seek(start)
+    else:
+        hasher.update(f"{image.mode}:{image.size}".encode())
+        hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+
+class CachedEmbedder:
+    # Drop-in front for MultimodalEmbedder: embed_* return cached rows for repeated text or
+    # image content and send only the misses to the model, as one batch
+    def __init__(self, embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.embedder, name)
+
+    def _model_name(self, kind: str) -> str:
+        registry = getattr(self.embedder, "registry", None)
+        # Includes the backend: an int8 or ONNX embedding is not the fp32 one
+        return registry.model_id(kind) if registry is not None else kind
+
+    def _cached(self, keys: List[Hashable], compute: Callable[[List[int]], np.ndarray]) -> np.ndarray:
+        rows: List[Optional[np.ndarray]] = self.cache.get_many(keys)
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            computed = compute(missing)
+            self.cache.put_many([(keys[i], row) for i, row in zip(missing, computed)])
+            for i, row in zip(missing, computed):
+                rows[i] = row
+        return np.vstack(rows)
+
+    def field_keys(self, field: str, texts: List[Optional[str]],
+                   images: List[Optional[ImageSource]]) -> List[Hashable]:
+        # Cache keys of one embedding field, per (text, image) row
+        if field == "text_embedding":
+            model = self._model_name("text")
+            return [("text", model, normalize_text(text)) for text in texts]
+        model = self._model_name("clip")
+        if field == "image_embedding":
+            return [("image", model, image_digest(image)) for image in images]
+        return [
+            ("multimodal", model, normalize_text(text), image_digest(image))
+            for text, image in zip(texts, images)
+        ]
+
+    def row_keys(self, fields: Tuple[str, ...], texts: List[Optional[str]],
+                 images: List[Optional[ImageSource]]) -> List[Optional[Dict[str, Hashable]]]:
+        # Per row: the cache key of every field in `fields`, for lookup() and later store().
+        # Each image is read and hashed once, whatever the number of fields; rows whose image
+        # cannot be read get None and are left to the decode to report.
+        text_model, clip_model = self._model_name("text"), self._model_name("clip")
+        keys: List[Optional[Dict[str, Hashable]]] = []
+        for text, image in zip(texts, images):
+            try:
+                digest = image_digest(image) if image is not None and fields != ("text_embedding",) else None
+            except OSError:
+                keys.append(None)
+                continue
+            row = {}
+            for field in fields:
+                if field == "text_embedding":
+                    row[field] = ("text", text_model, normalize_text(text))
+                elif field == "image_embedding":
+                    row[field] = ("image", clip_model, digest)
+                else:
+                    row[field] = ("multimodal", clip_model, normalize_text(text), digest)
+            keys.append(row)
+        return keys
+
+    def lookup(self, keys: List[Optional[Dict[str, Hashable]]]) -> List[Optional[Dict[str, np.ndarray]]]:
+        # Per row of row_keys(): every field from the cache, or None if any is missing. Lets
+        # callers skip decoding and the model for rows that were embedded before. Hits and
+        # misses count rows, not fields.
+        present = [i for i, row in enumerate(keys) if row is not None]
+        flat = [(i, field, key) for i in present for field, key in keys[i].items()]
+        values = self.cache.get_many([key for _, _, key in flat], count=False)
+        found: Dict[int, Dict[str, np.ndarray]] = {i: {} for i in present}
+        for (i, field, _), value in zip(flat, values):
+            if value is not None:
+                found[i][field] = value
+        rows = [
+            found[i] if row is not None and len(found[i]) == len(row) else None
+            for i, row in enumerate(keys)
+        ]
+        hits = sum(row is not None for row in rows)
+        self.cache.record(hits, len(rows) - hits)
+        return rows
+
+    def store(self, keys: List[Optional[Dict[str, Hashable]]], embeddings: Dict[str, np.ndarray]) -> None:
+        # `keys` from row_keys(), one per row of `embeddings`
+        items = [
+            (row[field], vectors[i])
+            for field, vectors in embeddings.items()
+            for i, row in enumerate(keys) if row is not None and field in row
+        ]
+        self.cache.put_many(items)
+
+    def embed_text(self, texts: Union[str, List[str]]) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        keys = self.field_keys("text_embedding", texts, [None] * len(texts))
+        return self._cached(keys, lambda missing: self.embedder.embed_text([texts[i] for i in missing]))
+
+    def embed_image(self, images: Union[ImageSource, List[ImageSource]]) -> np.ndarray:
+        images = as_image_list(images)
+        keys = self.field_keys("image_embedding", [None] * len(images), images)
+        return self._cached(keys, lambda missing: self.embedder.embed_image([images[i] for i in missing]))
+
+    def embed_multimodal(self, texts: Union[str, List[str]],
+                         images: Union[ImageSource, List[ImageSource]]) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        images = as_image_list(images)
+        model = self._model_name("clip")
+        keys = [
+            ("multimodal", model, normalize_text(text), image_digest(image))
+            for text, image in zip(texts, images)
+        ]
+        return self._cached(keys, lambda missing: self.embedder.embed_multimodal(
+            [texts[i] for i in missing], [images[i] for i in missing]
+        ))
+
+    def embed_document(self, texts: Union[str, List[str]],
+                       images: Union[ImageSource, List[ImageSource]]) -> Dict[str, np.ndarray]:
+        if isinstance(texts, str):
+            texts = [texts]
+        images = as_image_list(images)
+        fields = ("text_embedding", "image_embedding", "multimodal_embedding")
+        keys = self.row_keys(fields, texts, images)
+        rows = self.lookup(keys)
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            computed = self.embedder.embed_document([texts[i] for i in missing], [images[i] for i in missing])
+            self.store([keys[i] for i in missing], computed)
+            for row, i in enumerate(missing):
+                rows[i] = {field: computed[field][row] for field in fields}
+        return {field: np.vstack([row[field] for row in rows]) for field in fields}
+
+
+def ingest_cache_from_env(db_client) -> Optional[PersistentEmbeddingCache]:
+    # INGEST_EMBEDDING_CACHE=false re-embeds every ingested copy
+    if os.getenv('INGEST_EMBEDDING_CACHE', 'true').lower() != 'true':
+        return None
+    return PersistentEmbeddingCache(
+        db_client.get_collection(os.getenv('INGEST_CACHE_COLLECTION', 'embedding_cache')),
+        float(os.getenv('INGEST_CACHE_TTL', str(30 * 24 * 3600)))
+    )
+
+
+def query_cache_from_env() -> Optional[EmbeddingCache]:
+    # QUERY_CACHE_SIZE=0 disables the query embedding cache
+    size = int(os.getenv('QUERY_CACHE_SIZE', '1024'))
+    if size <= 0:
+        return None
+    return EmbeddingCache(size, float(os.getenv('QUERY_CACHE_TTL', '3600')))
@@ -1,58 +1,62 @@
-import torch
 import numpy as np
 from PIL import Image
-from typing import List, Union, Optional
-from transformers import CLIPProcessor, CLIPModel
-from sentence_transformers import SentenceTransformer
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 import logging
-import os
-from dotenv import load_dotenv
 
-load_dotenv()
+from .preprocessing import (
+    ImageSource, PreprocessConfig, as_image_list, draft_decoding_enabled, get_image_preprocessor, open_image
+)
+from .registry import ModelRegistry, get_registry
 
 logger = logging.getLogger(__name__)
 
 
 class MultimodalEmbedder:
-    def __init__(self):
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        
-        # CLIP model for image and multimodal embeddings
-        clip_model_name = os.getenv('CLIP_MODEL_NAME', 'openai/clip-vit-base-patch32')
-        self.clip_model = CLIPModel.from_pretrained(clip_model_name).to(self.device)
-        self.clip_processor = CLIPProcessor.from_pretrained(clip_model_name)
-        
-        # Sentence transformer for text embeddings
-        text_model_name = os.getenv('TEXT_MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2')
-        self.text_model = SentenceTransformer(text_model_name)
-        
-        logger.info(f"Initialized models on {self.device}")
+    # Models come from the process-wide ModelRegistry and load on first use;
+    # prefer registry.get_embedder() over constructing new instances
+    def __init__(self, registry: Optional[ModelRegistry] = None):
+        self.registry = registry or get_registry()
+    
+    @property
+    def device(self):
+        return self.registry.device
+    
+    @property
+    def clip_model(self):
+        # Backend (torch, int8 or ONNX) with image_features/text_features over numpy arrays
+        return self.registry.get("clip")[0]
+    
+    @property
+    def clip_processor(self):
+        return self.registry.get("clip")[1]
+    
+    @property
+    def text_model(self):
+        # Backend with encode(texts)
+        return self.registry.get("text")
     
     def embed_text(self, texts: Union[str, List[str]]) -> np.ndarray:
         if isinstance(texts, str):
             texts = [texts]
         
-        embeddings = self.text_model.encode(texts, convert_to_numpy=True)
+        embeddings = self.text_model.encode(texts)
         return embeddings
     
-    def embed_image(self, images: Union[Image.Image, List[Image.Image], str, List[str]]) -> np.ndarray:
-        if isinstance(images, (str, Image.Image)):
-            images = [images]
+    def embed_image(self, images: Union[ImageSource, List[ImageSource]]) -> np.ndarray:
+        images = as_image_list(images)
         
-        # Load images if paths are provided
-        loaded_images = []
-        for img in images:
-            if isinstance(img, str):
-                loaded_images.append(Image.open(img).convert('RGB'))
-            else:
-                loaded_images.append(img)
-        
-        # Process images with CLIP
-        inputs = self.clip_processor(images=loaded_images, return_tensors="pt").to(self.device)
-        
-        with torch.no_grad():
-            image_features = self.clip_model.get_image_features(**inputs)
-            image_embeddings = image_features.cpu().numpy()
+        pixel_batches = self._pixel_batches(images)
+        if pixel_batches is not None:
+            # Preprocessed in the worker pool (or by the caller), overlapping with inference
+            image_embeddings = np.concatenate([
+                self.clip_model.image_features(pixel_values) for pixel_values in pixel_batches
+            ])
+        else:
+            loaded_images = self._load_images(images)
+            
+            # Process images with CLIP
+            inputs = self.clip_processor(images=loaded_images, return_tensors="np")
+            image_embeddings = self.clip_model.image_features(inputs["pixel_values"])
         
         # Normalize embeddings
         image_embeddings = image_embeddings / np.linalg.norm(image_embeddings, axis=1, keepdims=True)
@@ -60,33 +64,89 @@ class MultimodalEmbedder:
         return image_embeddings
     
     def embed_multimodal(self, texts: Union[str, List[str]], 
-                        images: Union[Image.Image, List[Image.Image], str, List[str]]) -> np.ndarray:
+                        images: Union[ImageSource, List[ImageSource]]) -> np.ndarray:
         if isinstance(texts, str):
             texts = [texts]
-        if isinstance(images, (str, Image.Image)):
-            images = [images]
+        images = as_image_list(images)
         
-        # Load images if paths are provided
+        image_embeds, text_embeds = self._clip_pair(texts, images)
+        return self._combine(image_embeds, text_embeds)
+    
+    def embed_document(self, texts: Union[str, List[str]],
+                       images: Union[ImageSource, List[ImageSource]]) -> Dict[str, np.ndarray]:
+        # All three embeddings of a multimodal document: each image is decoded once and the
+        # CLIP towers run once; image_embedding and multimodal_embedding come from the same
+        # features embed_image/embed_multimodal would compute, MiniLM only produces text_embedding
+        if isinstance(texts, str):
+            texts = [texts]
+        images = as_image_list(images)
+        
+        image_embeds, text_embeds = self._clip_pair(texts, images)
+        return {
+            "text_embedding": self.embed_text(texts),
+            "image_embedding": image_embeds / np.linalg.norm(image_embeds, axis=1, keepdims=True),
+            "multimodal_embedding": self._combine(image_embeds, text_embeds),
+        }
+    
+    def preprocess_images(self, images: List[ImageSource]) -> List[Union[Image.Image, np.ndarray, Exception]]:
+        # Decode ahead of embed_*: CLIP pixel arrays from the worker pool when one is configured
+        # (IMAGE_PREPROCESS_WORKERS), otherwise RGB images; failures are returned per item
+        preprocessor = get_image_preprocessor()
+        if preprocessor is not None:
+            return preprocessor.map(images, self._preprocess_config())
+        results = []
+        for img in images:
+            try:
+                results.append(self._load_images([img])[0])
+            except Exception as e:
+                results.append(e)
+        return results
+    
+    def _preprocess_config(self) -> PreprocessConfig:
+        return PreprocessConfig.from_image_processor(self.clip_processor.image_processor, draft_decoding_enabled())
+    
+    def _pixel_batches(self, images: List[Union[ImageSource, np.ndarray]]) -> Optional[Iterator[np.ndarray]]:
+        # None means "use CLIPProcessor in this thread"
+        arrays = sum(isinstance(img, np.ndarray) for img in images)
+        if arrays == len(images):
+            return iter([np.stack(images)])
+        if arrays:
+            raise ValueError("Cannot mix preprocessed pixel arrays with images or paths")
+        preprocessor = get_image_preprocessor()
+        if preprocessor is None:
+            return None
+        return preprocessor.iter_batches(images, self._preprocess_config())
+    
+    def _load_images(self, images: List[ImageSource]) -> List[Image.Image]:
+        # Decode paths, bytes and file objects; decoded images pass through
         loaded_images = []
         for img in images:
-            if isinstance(img, str):
-                loaded_images.append(Image.open(img).convert('RGB'))
-            else:
+            if isinstance(img, Image.Image):
                 loaded_images.append(img)
+            else:
+                loaded_images.append(open_image(img).convert('RGB'))
+        return loaded_images
+    
+    def _clip_pair(self, texts: List[str],
+                   images: List[Union[ImageSource, np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+        # Process with CLIP; both outputs are L2-normalized projections
+        pixel_batches = self._pixel_batches(images)
+        if pixel_batches is not None:
+            inputs = self.clip_processor.tokenizer(texts, return_tensors="np", padding=True)
+            pixel_values = np.concatenate(list(pixel_batches))
+        else:
+            inputs = self.clip_processor(text=texts, images=self._load_images(images), 
+                                       return_tensors="np", padding=True)
+            pixel_values = inputs["pixel_values"]
         
-        # Process with CLIP
-        inputs = self.clip_processor(text=texts, images=loaded_images, 
-                                   return_tensors="pt", padding=True).to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.clip_model(**inputs)
-            # Combine image and text features
-            image_embeds = outputs.image_embeds
-            text_embeds = outputs.text_embeds
-            
-            # Average pooling of image and text embeddings
-            multimodal_embeds = (image_embeds + text_embeds) / 2
-            multimodal_embeds = multimodal_embeds.cpu().numpy()
+        image_embeds = self.clip_model.image_features(pixel_values)
+        text_embeds = self.clip_model.text_features(inputs["input_ids"], inputs["attention_mask"])
+        return (image_embeds / np.linalg.norm(image_embeds, axis=1, keepdims=True),
+                text_embeds / np.linalg.norm(text_embeds, axis=1, keepdims=True))
+    
+    def _combine(self, image_embeds: np.ndarray, text_embeds: np.ndarray) -> np.ndarray:
+        # Average pooling of image and text embeddings
+        multimodal_embeds = (image_embeds + text_embeds) / 2
         
         # Normalize
         multimodal_embeds = multimodal_embeds / np.linalg.norm(multimodal_embeds, axis=1, keepdims=True)
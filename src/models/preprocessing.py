@@ -0,0 +1,151 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# A path, encoded image bytes (e.g. an upload body), a binary file object or a decoded image
+ImageSource = Union[str, bytes, BinaryIO, Image.Image]
+
+
+def as_image_list(images: Union[ImageSource, Sequence[ImageSource]]) -> List[ImageSource]:
+    return list(images) if isinstance(images, (list, tuple)) else [images]
+
+
+def open_image(source: ImageSource) -> Image.Image:
+    # Lazy like Image.open: pixels are decoded on first access
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+
+def _picklable(source: ImageSource) -> ImageSource:
+    # File objects cannot cross into the worker processes; their bytes can
+    if hasattr(source, "read"):
+        return source.read()
+    return source
+
+
+class PreprocessConfig(NamedTuple):
+    # The subset of CLIPImageProcessor settings needed to reproduce its pixel_values
+    shortest_edge: int
+    crop: Tuple[int, int]
+    mean: Tuple[float, ...]
+    std: Tuple[float, ...]
+    rescale: float
+    resample: int
+    draft: bool
+
+    @classmethod
+    def from_image_processor(cls, image_processor, draft: bool = True) -> "PreprocessConfig":
+        size = image_processor.size
+        crop = image_processor.crop_size
+        return cls(
+            shortest_edge=size["shortest_edge"] if isinstance(size, dict) else int(size),
+            crop=(crop["height"], crop["width"]) if isinstance(crop, dict) else (int(crop), int(crop)),
+            mean=tuple(image_processor.image_mean),
+            std=tuple(image_processor.image_std),
+            rescale=float(image_processor.rescale_factor),
+            resample=int(image_processor.resample),
+            draft=draft,
+        )
+
+
+def preprocess_image(source: ImageSource, config: PreprocessConfig) -> np.ndarray:
+    # Decode, resize the shortest edge, center crop, rescale and normalize: (3, H, W) float32
+    image = open_image(source)
+    if config.draft and image.format == "JPEG":
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale while staying >= the target size
+        image.draft("RGB", (config.shortest_edge, config.shortest_edge))
+    image = image.convert("RGB")
+
+    width, height = image.size
+    short = config.shortest_edge
+    if width <= height:
+        new_size = (short, int(short * height / width))
+    else:
+        new_size = (int(short * width / height), short)
+    image = image.resize(new_size, resample=config.resample)
+
+    crop_height, crop_width = config.crop
+    top = (new_size[1] - crop_height) // 2
+    left = (new_size[0] - crop_width) // 2
+    image = image.crop((left, top, left + crop_width, top + crop_height))
+
+    pixels = np.asarray(image, dtype=np.float32) * config.rescale
+    pixels = (pixels - np.asarray(config.mean, dtype=np.float32)) / np.asarray(config.std, dtype=np.float32)
+    return np.ascontiguousarray(pixels.transpose(2, 0, 1))
+
+
+def _preprocess_or_error(source: ImageSource, config: PreprocessConfig) -> Union[np.ndarray, Exception]:
+    # Runs in the worker process; failures travel back as values so one bad file
+    # does not poison the rest of the batch
+    try:
+        return preprocess_image(source, config)
+    except Exception as e:
+        return e
+
+
+class ImagePreprocessor:
+    # Process pool that turns image paths into CLIP pixel arrays off the inference thread
+    def __init__(self, workers: int, chunk_size: int = 16):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        # Spawned, not forked: a fork would copy the parent's loaded models and inherit the
+        # state of its inference and executor threads
+        self._pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, sources: Sequence[ImageSource], config: PreprocessConfig) -> List[Future]:
+        return [self._pool.submit(_preprocess_or_error, _picklable(source), config) for source in sources]
+
+    def map(self, sources: Sequence[ImageSource], config: PreprocessConfig) -> List[Union[np.ndarray, Exception]]:
+        return [future.result() for future in self.submit(sources, config)]
+
+    def iter_batches(self, sources: Sequence[ImageSource], config: PreprocessConfig) -> Iterator[np.ndarray]:
+        # Yields stacked pixel_values chunk by chunk while the next chunk is already being
+        # decoded, so preprocessing overlaps with the forward pass on the previous one
+        chunks = [sources[i:i + self.chunk_size] for i in range(0, len(sources), self.chunk_size)]
+        pending = self.submit(chunks[0], config) if chunks else []
+        for index in range(len(chunks)):
+            current = pending
+            if index + 1 < len(chunks):
+                pending = self.submit(chunks[index + 1], config)
+            results = [future.result() for future in current]
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+            yield np.stack(results)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_preprocessor: Optional[ImagePreprocessor] = None
+_preprocessor_lock = threading.Lock()
+
+
+def get_image_preprocessor() -> Optional[ImagePreprocessor]:
+    # IMAGE_PREPROCESS_WORKERS > 0 enables the pool (one per process, created on first use)
+    global _preprocessor
+    workers = int(os.getenv('IMAGE_PREPROCESS_WORKERS', '0'))
+    if workers <= 0:
+        return None
+    if _preprocessor is None:
+        with _preprocessor_lock:
+            if _preprocessor is None:
+                _preprocessor = ImagePreprocessor(workers, int(os.getenv('IMAGE_PREPROCESS_CHUNK', '16')))
+                logger.info(f"Started image preprocessing pool with {workers} workers")
+    return _preprocessor
+
+
+def draft_decoding_enabled() -> bool:
+    return os.getenv('IMAGE_DECODE_DRAFT', 'true').lower() == 'true'
@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+
+from .backends import backend_from_env, load_clip, load_text, model_id
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    # Process-wide home for the heavy models: each one is loaded once, on first use,
+    # and shared by every embedder in the process. torch/transformers are only
+    # imported by the loaders, so importing the package stays cheap.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Any] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self.model_names: Dict[str, str] = {
+            "clip": os.getenv('CLIP_MODEL_NAME', 'openai/clip-vit-base-patch32'),
+            "text": os.getenv('TEXT_MODEL_NAME', 'sentence-transformers/all-MiniLM-L6-v2'),
+        }
+        # Inference backend per model (CLIP_BACKEND / TEXT_BACKEND)
+        self.backends: Dict[str, str] = {name: backend_from_env(name) for name in self.model_names}
+        self._loaders: Dict[str, Callable[[], Any]] = {
+            "clip": self._load_clip,
+            "text": self._load_text,
+        }
+        self._device = None
+
+    @property
+    def device(self):
+        if self._device is None:
+            import torch
+            self._device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        return self._device
+
+    def device_for(self, name: str):
+        # Quantized and ONNX backends run on the CPU (and do not need torch for that)
+        return self.device if self.backends[name] == "torch" else "cpu"
+
+    def get(self, name: str) -> Any:
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            # Another thread may have finished loading while we waited
+            if name not in self._models:
+                started = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                self._load_seconds[name] = time.perf_counter() - started
+                logger.info(f"Loaded {name} model ({self.backends[name]}) on {self.device_for(name)} "
+                            f"in {self._load_seconds[name]:.1f}s")
+            return self._models[name]
+
+    def _load_clip(self):
+        # CLIP towers for image and multimodal embeddings, plus the processor
+        return load_clip(self.model_names["clip"], self.backends["clip"], self.device_for("clip"))
+
+    def _load_text(self):
+        # Sentence transformer for text embeddings
+        return load_text(self.model_names["text"], self.backends["text"])
+
+    def model_id(self, name: str) -> str:
+        return model_id(self.model_names[name], self.backends[name])
+
+    def warmup(self) -> None:
+        for name in self._loaders:
+            self.get(name)
+
+    def is_ready(self) -> bool:
+        return all(name in self._models for name in self._loaders)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.is_ready(),
+            "models": {
+                name: {
+                    "loaded": name in self._models,
+                    "backend": self.backends[name],
+                    "load_seconds": self._load_seconds.get(name),
+                }
+                for name in self._loaders
+            },
+        }
+
+
+_registry: Optional[ModelRegistry] = None
+_embedder = None
+_singleton_lock = threading.RLock()
+
+
+def get_registry() -> ModelRegistry:
+    global _registry
+    if _registry is None:
+        with _singleton_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
+
+
+def get_embedder():
+    # The MultimodalEmbedder shared by DataIngestion and MultimodalRetriever, behind the
+    # micro-batching scheduler unless EMBED_BATCHING=false
+    global _embedder
+    if _embedder is None:
+        from .batching import scheduler_from_env
+        from .embeddings import MultimodalEmbedder
+        with _singleton_lock:
+            if _embedder is None:
+                _embedder = scheduler_from_env(MultimodalEmbedder())
+    return _embedder
@@ -0,0 +1,248 @@
+import logging
+import os
+import tempfile
+import threading
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+from .vector_index import FieldIndex, FieldSnapshot, normalize_rows, top_k_indices
+
+logger = logging.getLogger(__name__)
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    # Nearest centroid by inner product, chunked so the n x nlist score block stays small
+    lists = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        block = vectors[start:start + chunk_size]
+        lists[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return lists
+
+
+def _train_centroids(vectors: np.ndarray, nlist: int, iterations: int,
+                     rng: np.random.Generator) -> np.ndarray:
+    # Spherical k-means: centroids stay unit length so scoring is a plain dot product
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        lists = _assign(vectors, centroids)
+        order = np.argsort(lists, kind="stable")
+        counts = np.bincount(lists, minlength=nlist)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        sums = np.zeros_like(centroids)
+        non_empty = counts > 0
+        sums[non_empty] = np.add.reduceat(vectors[order], starts[non_empty], axis=0)
+
+        # Reseed empty lists from random points
+        empty = np.flatnonzero(~non_empty)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFFlatIndex:
+    # Inverted-file index over a FieldIndex: rows are bucketed by nearest centroid and a
+    # query scores only the nprobe closest buckets. Vectors stay in the FieldIndex matrix.
+    def __init__(self, field: str,
+                 nlist: Optional[int] = None,
+                 nprobe: int = 8,
+                 min_train_size: int = 50000,
+                 retrain_growth: float = 4.0,
+                 train_iterations: int = 15,
+                 sample_per_list: int = 64,
+                 path: Optional[str] = None,
+                 seed: int = 0):
+        self.field = field
+        self.nlist = nlist
+        self.nprobe = nprobe
+        # Below this many live rows exact search is both faster and exact
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.train_iterations = train_iterations
+        self.sample_per_list = sample_per_list
+        self.path = path
+        self.seed = seed
+
+        self.trained_size = 0
+        self._version = 0
+        self._state: Optional[Tuple[np.ndarray, str]] = None
+        self._lists_cache: Optional[Tuple[Any, ...]] = None
+        self._train_lock = threading.Lock()
+
+    @property
+    def is_trained(self) -> bool:
+        return self._state is not None
+
+    @property
+    def centroids(self) -> Optional[np.ndarray]:
+        return self._state[0] if self._state else None
+
+    def maintain(self, field_index: FieldIndex) -> None:
+        size = len(field_index)
+        if size < self.min_train_size:
+            return
+        with self._train_lock:
+            if not self.is_trained and self.path and os.path.exists(self.path):
+                self.load(field_index)
+            if not self.is_trained or size > self.trained_size * self.retrain_growth:
+                self.train(field_index)
+
+    def train(self, field_index: FieldIndex) -> None:
+        snapshot = field_index.snapshot()
+        live = np.flatnonzero(snapshot.alive)
+        nlist = self.nlist or int(np.clip(4 * np.sqrt(len(live)), 16, 65536))
+        nlist = min(nlist, len(live))
+
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(live), nlist * self.sample_per_list)
+        sample = field_index.vectors(np.sort(rng.choice(live, sample_size, replace=False)))
+        centroids = _train_centroids(sample, nlist, self.train_iterations, rng)
+
+        self._install(field_index, centroids)
+        self.trained_size = len(live)
+        logger.info(f"Trained IVF index for {self.field}: nlist={nlist}, rows={len(live)}")
+
+        if self.path:
+            self.save(field_index)
+
+    def _install(self, field_index: FieldIndex, centroids: np.ndarray,
+                 codes: Optional[np.ndarray] = None) -> None:
+        # Codes are attached under a fresh name before the centroids swap, so a
+        # concurrent search always sees centroids and list ids from the same training
+        previous = self._state
+        self._version += 1
+        code_name = f"ivf:{self._version}"
+        field_index.attach_codes(code_name, lambda vectors: _assign(vectors, centroids), codes)
+        self._state = (centroids, code_name)
+        self._lists_cache = None
+        if previous is not None:
+            field_index.detach_codes(previous[1])
+
+    def should_search(self, snapshot: FieldSnapshot, rows: Optional[np.ndarray],
+                      nprobe: Optional[int]) -> bool:
+        state = self._state
+        if state is None or state[1] not in snapshot.codes:
+            return False
+        live = len(snapshot.ids) - snapshot.dead
+        if live < self.min_train_size:
+            return False
+        if rows is not None:
+            # A filtered set smaller than what the probed lists would hold is cheaper to scan exactly
+            nprobe = min(nprobe or self.nprobe, len(state[0]))
+            if len(rows) <= live * nprobe / len(state[0]):
+                return False
+        return True
+
+    def _inverted_lists(self, snapshot: FieldSnapshot, code_name: str,
+                        nlist: int) -> Tuple[int, np.ndarray, np.ndarray]:
+        # Rows sorted by list id plus list offsets; rows appended since the last build are
+        # scanned as a tail until the tail is large enough to justify re-sorting
+        size = len(snapshot.ids)
+        cache = self._lists_cache
+        if cache is not None:
+            generation, name, built_size, order, offsets = cache
+            if generation == snapshot.generation and name == code_name and \
+                    built_size <= size and size - built_size <= max(1024, built_size // 10):
+                return built_size, order, offsets
+
+        lists = snapshot.codes[code_name]
+        order = np.argsort(lists, kind="stable")
+        offsets = np.searchsorted(lists[order], np.arange(nlist + 1))
+        self._lists_cache = (snapshot.generation, code_name, size, order, offsets)
+        return size, order, offsets
+
+    def candidates(self, snapshot: FieldSnapshot, query: np.ndarray,
+                   nprobe: Optional[int] = None,
+                   rows: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        centroids, code_name = self._state
+        if code_name not in snapshot.codes:
+            # Retrained after this snapshot was taken; let the caller scan exactly
+            return None
+        nprobe = min(nprobe or self.nprobe, len(centroids))
+        probe = top_k_indices(centroids @ query, nprobe)
+
+        built_size, order, offsets = self._inverted_lists(snapshot, code_name, len(centroids))
+        parts = [order[offsets[i]:offsets[i + 1]] for i in probe]
+        tail = snapshot.codes[code_name][built_size:]
+        if len(tail):
+            parts.append(built_size + np.flatnonzero(np.isin(tail, probe)))
+        candidates = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+        if rows is not None:
+            candidates = candidates[np.isin(candidates, rows, assume_unique=True)]
+        return np.sort(candidates[snapshot.alive[candidates]])
+
+    def save(self, field_index: FieldIndex) -> None:
+        state = self._state
+        if state is None or not self.path:
+            return
+        centroids, code_name = state
+        snapshot = field_index.snapshot()
+        live = np.flatnonzero(snapshot.alive)
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        # A private temp file per writer: API workers sharing ANN_INDEX_DIR save concurrently
+        with tempfile.NamedTemporaryFile(dir=directory, prefix=os.path.basename(self.path),
+                                         suffix=".tmp", delete=False) as handle:
+            np.savez(
+                handle,
+                centroids=centroids,
+                trained_size=np.int64(self.trained_size),
+                ids=np.array([str(doc_id) for doc_id in snapshot.ids[live]]),
+                lists=snapshot.codes[code_name][live]
+            )
+        os.replace(handle.name, self.path)
+        logger.info(f"Saved IVF index for {self.field} to {self.path}")
+
+    def load(self, field_index: FieldIndex) -> None:
+        with np.load(self.path) as data:
+            centroids = data["centroids"]
+            trained_size = int(data["trained_size"])
+            saved = dict(zip(data["ids"].tolist(), data["lists"].tolist()))
+
+        if centroids.shape[1] != field_index.dim:
+            logger.warning(f"Ignoring IVF index at {self.path}: dimension mismatch")
+            return
+
+        # Reuse saved list ids; only rows added since the save are assigned again
+        snapshot = field_index.snapshot()
+        codes = np.empty(len(snapshot.ids), dtype=np.int32)
+        missing = []
+        for row, doc_id in enumerate(snapshot.ids):
+            list_id = saved.get(str(doc_id))
+            if list_id is None:
+                missing.append(row)
+            else:
+                codes[row] = list_id
+        if missing:
+            codes[missing] = _assign(field_index.vectors(np.asarray(missing)), centroids)
+
+        self._install(field_index, centroids, codes)
+        self.trained_size = trained_size
+        logger.info(f"Loaded IVF index for {self.field} from {self.path}")
+
+
+def ivf_factory_from_env() -> Optional[Any]:
+    # Approximate search trades recall for latency, so it is opt-in
+    if os.getenv('ANN_INDEX', 'none').lower() != 'ivf':
+        logger.info("ANN index disabled; index search is exact")
+        return None
+
+    index_dir = os.getenv('ANN_INDEX_DIR', 'data/index')
+    nlist = os.getenv('ANN_NLIST')
+    nprobe = int(os.getenv('ANN_NPROBE', '8'))
+    min_train_size = int(os.getenv('ANN_MIN_SIZE', '50000'))
+    logger.info(f"IVF ANN index: nprobe={nprobe} above {min_train_size} documents per field")
+
+    def factory(field: str) -> IVFFlatIndex:
+        return IVFFlatIndex(
+            field,
+            nlist=int(nlist) if nlist else None,
+            nprobe=nprobe,
+            min_train_size=min_train_size,
+            path=os.path.join(index_dir, f"{field}.ivf.npz") if index_dir else None
+        )
+
+    return factory
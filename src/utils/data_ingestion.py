@@ -4,34 +4,85 @@ from typing import List, Dict, Any, Optional
 from datetime import datetime
 from PIL import Image
 import numpy as np
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
 
 from ..database.mongodb_client import MongoDBClient
 from ..database.schemas import Document, ContentType
+from ..database.vector_codec import encode_embedding, storage_mode_from_env
+from ..models.embedding_cache import CachedEmbedder, ingest_cache_from_env
 from ..models.embeddings import MultimodalEmbedder
+from ..models.registry import get_embedder
+from .vector_index import EMBEDDING_FIELDS
+from .vector_store import vector_store_from_env
 
 logger = logging.getLogger(__name__)
 
+# Tombstones only need to outlive the slowest index sync
+TOMBSTONE_TTL_SECONDS = 7 * 24 * 3600
+
+DEFAULT_INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '32'))
+
+# Embedding fields each content type stores
+CONTENT_FIELDS = {
+    ContentType.TEXT: ("text_embedding",),
+    ContentType.IMAGE: ("image_embedding",),
+    ContentType.MULTIMODAL: ("text_embedding", "image_embedding", "multimodal_embedding"),
+}
+
 
 class DataIngestion:
-    def __init__(self):
+    def __init__(self, embedder: Optional[MultimodalEmbedder] = None):
         self.db_client = MongoDBClient()
         self.db_client.connect()
         self.collection = self.db_client.get_collection("multimodal_documents")
-        self.embedder = MultimodalEmbedder()
+        # Deleted ids, so in-memory indexes can drop them incrementally
+        self.tombstones = self.db_client.get_collection("multimodal_tombstones")
+        # Shared per process; models load on first use
+        self.model_embedder = embedder or get_embedder()
+        # Persistent content-hash cache, so re-sent images and captions skip the model
+        self.embedding_cache = ingest_cache_from_env(self.db_client)
+        self.embedder = (
+            CachedEmbedder(self.model_embedder, self.embedding_cache)
+            if self.embedding_cache is not None else self.model_embedder
+        )
+        # list (BSON doubles) or packed float32/float16 Binary
+        self.storage_mode = storage_mode_from_env()
+        # Shared on-disk vector store (VECTOR_STORE_DIR); new rows are visible to retrievers at once
+        self.vector_store = vector_store_from_env()
         
         # Create indexes for efficient retrieval
         self._create_indexes()
     
+    def _to_mongo(self, document: Document) -> Dict[str, Any]:
+        # _id 필드를 제외하고 MongoDB에 저장
+        doc_dict = document.dict(by_alias=True, exclude={"id"})
+        for field in EMBEDDING_FIELDS:
+            if doc_dict.get(field) is not None:
+                doc_dict[field] = encode_embedding(doc_dict[field], self.storage_mode)
+        return doc_dict
+    
+    def _insert(self, doc_dict: Dict[str, Any]):
+        result = self.collection.insert_one(doc_dict)
+        if self.vector_store is not None:
+            self.vector_store.append_documents([doc_dict])
+        return result
+    
     def _create_indexes(self):
         # Create indexes for vector search
         self.collection.create_index("content_type")
         self.collection.create_index("created_at")
+        self.collection.create_index("updated_at")
         self.collection.create_index([("metadata.category", 1)])
+        self.tombstones.create_index("deleted_at", expireAfterSeconds=TOMBSTONE_TTL_SECONDS)
         logger.info("Created database indexes")
     
-    def ingest_text(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> str:
-        # Generate text embedding
-        text_embedding = self.embedder.embed_text(text)[0].tolist()
+    def ingest_text(self, text: str, metadata: Optional[Dict[str, Any]] = None,
+                    text_embedding: Optional[np.ndarray] = None) -> str:
+        # Generate text embedding (unless the caller already ran the model)
+        if text_embedding is None:
+            text_embedding = self.embedder.embed_text(text)
+        text_embedding = text_embedding[0].tolist()
         
         document = Document(
             content_type=ContentType.TEXT,
@@ -42,19 +93,21 @@ class DataIngestion:
             updated_at=datetime.utcnow()
         )
         
-        # _id 필드를 제외하고 MongoDB에 저장
-        doc_dict = document.dict(by_alias=True, exclude={"_id"})
-        result = self.collection.insert_one(doc_dict)
+        doc_dict = self._to_mongo(document)
+        result = self._insert(doc_dict)
         logger.info(f"Ingested text document with ID: {result.inserted_id}")
         return str(result.inserted_id)
     
-    def ingest_image(self, image_path: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+    def ingest_image(self, image_path: str, metadata: Optional[Dict[str, Any]] = None,
+                     image_embedding: Optional[np.ndarray] = None) -> str:
         # Verify image exists
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Image not found: {image_path}")
         
-        # Generate image embedding
-        image_embedding = self.embedder.embed_image(image_path)[0].tolist()
+        # Generate image embedding (unless the caller already ran the model)
+        if image_embedding is None:
+            image_embedding = self.embedder.embed_image(image_path)
+        image_embedding = image_embedding[0].tolist()
         
         document = Document(
             content_type=ContentType.IMAGE,
@@ -65,22 +118,24 @@ class DataIngestion:
             updated_at=datetime.utcnow()
         )
         
-        # _id 필드를 제외하고 MongoDB에 저장
-        doc_dict = document.dict(by_alias=True, exclude={"_id"})
-        result = self.collection.insert_one(doc_dict)
+        doc_dict = self._to_mongo(document)
+        result = self._insert(doc_dict)
         logger.info(f"Ingested image document with ID: {result.inserted_id}")
         return str(result.inserted_id)
     
     def ingest_multimodal(self, text: str, image_path: str, 
-                         metadata: Optional[Dict[str, Any]] = None) -> str:
+                         metadata: Optional[Dict[str, Any]] = None,
+                         embeddings: Optional[Dict[str, np.ndarray]] = None) -> str:
         # Verify image exists
         if not os.path.exists(image_path):
             raise FileNotFoundError(f"Image not found: {image_path}")
         
-        # Generate embeddings
-        text_embedding = self.embedder.embed_text(text)[0].tolist()
-        image_embedding = self.embedder.embed_image(image_path)[0].tolist()
-        multimodal_embedding = self.embedder.embed_multimodal(text, image_path)[0].tolist()
+        # Generate embeddings (one image decode, one CLIP pass) unless precomputed
+        if embeddings is None:
+            embeddings = self.embedder.embed_document(text, image_path)
+        text_embedding = embeddings["text_embedding"][0].tolist()
+        image_embedding = embeddings["image_embedding"][0].tolist()
+        multimodal_embedding = embeddings["multimodal_embedding"][0].tolist()
         
         document = Document(
             content_type=ContentType.MULTIMODAL,
@@ -94,9 +149,8 @@ class DataIngestion:
             updated_at=datetime.utcnow()
         )
         
-        # _id 필드를 제외하고 MongoDB에 저장
-        doc_dict = document.dict(by_alias=True, exclude={"_id"})
-        result = self.collection.insert_one(doc_dict)
+        doc_dict = self._to_mongo(document)
+        result = self._insert(doc_dict)
         logger.info(f"Ingested multimodal document with ID: {result.inserted_id}")
         return str(result.inserted_id)
     
@@ -119,17 +173,174 @@ class DataIngestion:
                 created_at=datetime.utcnow(),
                 updated_at=datetime.utcnow()
             )
-            # _id 필드를 제외하고 추가
-            doc_dict = document.dict(by_alias=True, exclude={"_id"})
+            doc_dict = self._to_mongo(document)
             documents.append(doc_dict)
         
         result = self.collection.insert_many(documents)
+        if self.vector_store is not None:
+            self.vector_store.append_documents(documents)
         logger.info(f"Batch ingested {len(result.inserted_ids)} text documents")
         return [str(id) for id in result.inserted_ids]
     
+    def batch_ingest_images(self, image_paths: List[str],
+                            metadata_list: Optional[List[Dict[str, Any]]] = None,
+                            batch_size: Optional[int] = None) -> Dict[str, Any]:
+        # One CLIP pass and one unordered insert_many per batch; failed items are reported
+        # in "errors" and leave None in "document_ids" instead of aborting the batch
+        if metadata_list and len(metadata_list) != len(image_paths):
+            raise ValueError("Length of metadata_list must match length of image_paths")
+        
+        def embed(items):
+            return {"image_embedding": self.model_embedder.embed_image([image for _, image in items])}
+        
+        return self._batch_ingest(
+            ContentType.IMAGE, [(None, path) for path in image_paths], metadata_list, batch_size, embed
+        )
+    
+    def batch_ingest_multimodal(self, texts: List[str], image_paths: List[str],
+                                metadata_list: Optional[List[Dict[str, Any]]] = None,
+                                batch_size: Optional[int] = None) -> Dict[str, Any]:
+        if len(texts) != len(image_paths):
+            raise ValueError("Length of texts must match length of image_paths")
+        if metadata_list and len(metadata_list) != len(texts):
+            raise ValueError("Length of metadata_list must match length of texts")
+        
+        def embed(items):
+            return self.model_embedder.embed_document([text for text, _ in items], [image for _, image in items])
+        
+        return self._batch_ingest(
+            ContentType.MULTIMODAL, list(zip(texts, image_paths)), metadata_list, batch_size, embed
+        )
+    
+    def _batch_ingest(self, content_type: ContentType, items: List[tuple],
+                      metadata_list: Optional[List[Dict[str, Any]]],
+                      batch_size: Optional[int], embed) -> Dict[str, Any]:
+        batch_size = batch_size or DEFAULT_INGEST_BATCH_SIZE
+        document_ids: List[Optional[str]] = [None] * len(items)
+        errors: List[Dict[str, Any]] = []
+        cached = lookups = 0
+        
+        for start in range(0, len(items), batch_size):
+            # Decode each image once (in the preprocessing pool when configured);
+            # unreadable ones are reported and skipped
+            candidates = []
+            for position in range(start, min(start + batch_size, len(items))):
+                image_path = items[position][1]
+                if os.path.exists(image_path):
+                    candidates.append(position)
+                else:
+                    errors.append({"index": position, "image_path": image_path,
+                                   "error": f"Image not found: {image_path}"})
+            
+            # Content seen before is taken from the cache without decoding the image; the keys
+            # (one read and hash per image) are kept for storing what the model computes
+            vectors: Dict[int, Dict[str, np.ndarray]] = {}
+            keys: Dict[int, Optional[Dict[str, Any]]] = {}
+            if self.embedding_cache is not None and candidates:
+                keys = dict(zip(candidates, self.embedder.row_keys(
+                    CONTENT_FIELDS[content_type],
+                    [items[position][0] for position in candidates],
+                    [items[position][1] for position in candidates]
+                )))
+                found = self.embedder.lookup([keys[position] for position in candidates])
+                vectors = {position: row for position, row in zip(candidates, found) if row is not None}
+                cached += len(vectors)
+                lookups += len(candidates)
+            
+            positions, loaded = [], []
+            pending = [position for position in candidates if position not in vectors]
+            decoded = self.model_embedder.preprocess_images([items[position][1] for position in pending])
+            for position, image in zip(pending, decoded):
+                if isinstance(image, Exception):
+                    errors.append({"index": position, "image_path": items[position][1], "error": str(image)})
+                else:
+                    positions.append(position)
+                    loaded.append((items[position][0], image))
+            
+            if positions:
+                try:
+                    embeddings = embed(loaded)
+                except Exception as e:
+                    for position in positions:
+                        errors.append({"index": position, "image_path": items[position][1], "error": str(e)})
+                else:
+                    for row, position in enumerate(positions):
+                        vectors[position] = {field: rows[row] for field, rows in embeddings.items()}
+                    if self.embedding_cache is not None:
+                        self.embedder.store([keys[position] for position in positions], embeddings)
+            positions = [position for position in candidates if position in vectors]
+            if not positions:
+                continue
+            
+            now = datetime.utcnow()
+            documents = [
+                self.build_document(
+                    content_type, items[position][0], items[position][1],
+                    metadata_list[position] if metadata_list else {}, vectors[position], now
+                )
+                for position in positions
+            ]
+            
+            write_errors = self.insert_documents(documents)
+            for row, position in enumerate(positions):
+                if row in write_errors:
+                    errors.append({"index": position, "image_path": items[position][1],
+                                   "error": write_errors[row].get("errmsg", "write failed")})
+                else:
+                    document_ids[position] = str(documents[row]["_id"])
+        
+        errors.sort(key=lambda error: error["index"])
+        logger.info(f"Batch ingested {len(items) - len(errors)} {content_type.value} documents "
+                    f"({len(errors)} failed, {cached} from cache)")
+        return {
+            "document_ids": document_ids,
+            "errors": errors,
+            "cached": cached,
+            "cache_hit_rate": cached / lookups if lookups else 0.0,
+        }
+    
+    def build_document(self, content_type: ContentType, text: Optional[str], image_path: Optional[str],
+                       metadata: Dict[str, Any], embeddings: Dict[str, np.ndarray],
+                       now: Optional[datetime] = None) -> Dict[str, Any]:
+        # Same fields Document.dict() produces, without building a model per item
+        now = now or datetime.utcnow()
+        doc_dict = {
+            "content_type": content_type.value,
+            "text_content": text,
+            "image_path": image_path,
+            "image_url": None,
+            "text_embedding": None,
+            "image_embedding": None,
+            "multimodal_embedding": None,
+            "metadata": metadata or {},
+            "created_at": now,
+            "updated_at": now,
+        }
+        for field, vector in embeddings.items():
+            doc_dict[field] = encode_embedding(vector, self.storage_mode)
+        return doc_dict
+    
+    def insert_documents(self, documents: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        # Unordered insert_many; returns the write error of each failed position
+        write_errors = {}
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            write_errors = {error["index"]: error for error in e.details.get("writeErrors", [])}
+        
+        inserted = [doc for row, doc in enumerate(documents) if row not in write_errors]
+        if self.vector_store is not None and inserted:
+            self.vector_store.append_documents(inserted)
+        return write_errors
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "embedding_cache": self.embedding_cache.stats() if self.embedding_cache is not None else None,
+        }
+    
     def update_document_metadata(self, document_id: str, metadata: Dict[str, Any]) -> bool:
         result = self.collection.update_one(
-            {"_id": document_id},
+            {"_id": _as_object_id(document_id)},
             {
                 "$set": {
                     "metadata": metadata,
@@ -140,5 +351,17 @@ class DataIngestion:
         return result.modified_count > 0
     
     def delete_document(self, document_id: str) -> bool:
-        result = self.collection.delete_one({"_id": document_id})
-        return result.deleted_count > 0
\ No newline at end of file
+        doc_id = _as_object_id(document_id)
+        result = self.collection.delete_one({"_id": doc_id})
+        if result.deleted_count > 0:
+            self.tombstones.insert_one({"document_id": doc_id, "deleted_at": datetime.utcnow()})
+            if self.vector_store is not None:
+                self.vector_store.delete_ids([doc_id])
+        return result.deleted_count > 0
+
+
+def _as_object_id(document_id: str):
+    # API callers pass the string form of the ObjectId
+    if ObjectId.is_valid(document_id):
+        return ObjectId(document_id)
+    return document_id
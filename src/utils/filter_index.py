@@ -0,0 +1,276 @@
+import logging
+import os
+import threading
+from enum import Enum
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Densest a sparse bitmap gets: past 1 set bit in 32 a uint32 array outgrows packed bits
+SPARSE_RATIO = 32
+
+_NO_KEY = object()
+
+
+class Bitmap:
+    # Set of document slots, kept as a sorted uint32 array while sparse and as packed bits
+    # once dense (the two container kinds of a Roaring bitmap, chosen per value here)
+    __slots__ = ("_sparse", "_bits", "_count")
+
+    def __init__(self):
+        self._sparse: Optional[np.ndarray] = np.empty(0, dtype=np.uint32)
+        self._bits: Optional[np.ndarray] = None
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        return self._sparse.nbytes if self._sparse is not None else self._bits.nbytes
+
+    def add(self, slots: np.ndarray, universe: int) -> None:
+        slots = np.unique(np.asarray(slots, dtype=np.uint32))
+        if self._sparse is not None:
+            self._sparse = np.union1d(self._sparse, slots)
+            self._count = len(self._sparse)
+            if self._count * SPARSE_RATIO > universe:
+                self._to_dense(universe)
+            return
+        self._reserve(int(slots[-1]) + 1 if len(slots) else 0)
+        byte, bit = slots >> 3, (0x80 >> (slots & 7)).astype(np.uint8)
+        self._count += int(np.count_nonzero((self._bits[byte] & bit) == 0))
+        np.bitwise_or.at(self._bits, byte, bit)
+
+    def discard(self, slots: np.ndarray, universe: int) -> None:
+        slots = np.unique(np.asarray(slots, dtype=np.uint32))
+        if self._sparse is not None:
+            self._sparse = np.setdiff1d(self._sparse, slots, assume_unique=True)
+            self._count = len(self._sparse)
+            return
+        slots = slots[(slots >> 3) < len(self._bits)]
+        byte, bit = slots >> 3, (0x80 >> (slots & 7)).astype(np.uint8)
+        self._count -= int(np.count_nonzero(self._bits[byte] & bit))
+        np.bitwise_and.at(self._bits, byte, ~bit)
+        # Hysteresis so a value hovering around the threshold does not flip back and forth
+        if self._count * SPARSE_RATIO * 2 < universe:
+            self._sparse = np.flatnonzero(self.to_mask(universe)).astype(np.uint32)
+            self._bits = None
+
+    def to_mask(self, size: int) -> np.ndarray:
+        if self._sparse is not None:
+            mask = np.zeros(size, dtype=bool)
+            mask[self._sparse[self._sparse < size]] = True
+            return mask
+        mask = np.unpackbits(self._bits, count=min(size, len(self._bits) * 8)).astype(bool)
+        if len(mask) < size:
+            mask = np.concatenate([mask, np.zeros(size - len(mask), dtype=bool)])
+        return mask
+
+    def _to_dense(self, universe: int) -> None:
+        self._bits = np.packbits(self.to_mask(max(universe, 1)))
+        self._sparse = None
+
+    def _reserve(self, bits: int) -> None:
+        needed = (bits + 7) >> 3
+        if needed > len(self._bits):
+            grown = np.zeros(max(needed, len(self._bits) * 2), dtype=np.uint8)
+            grown[:len(self._bits)] = self._bits
+            self._bits = grown
+
+
+def _value_key(value: Any) -> Any:
+    # Dictionary key for a scalar the way MongoDB equality sees it: 1 == 1.0, but True != 1.
+    # Lists, documents and null have match rules of their own and are not indexed.
+    if isinstance(value, Enum):
+        value = value.value
+    if value is None or isinstance(value, (list, tuple, dict)):
+        return _NO_KEY
+    if isinstance(value, bool):
+        return (bool, value)
+    try:
+        hash(value)
+    except TypeError:
+        return _NO_KEY
+    return value
+
+
+def _field_keys(doc: Dict[str, Any], path: str) -> Tuple[Hashable, ...]:
+    value: Any = doc
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    # An array field matches any of its elements
+    values = value if isinstance(value, list) else [value]
+    keys = (_value_key(item) for item in values)
+    return tuple(dict.fromkeys(key for key in keys if key is not _NO_KEY))
+
+
+class FilterIndex:
+    # Columnar copy of a few filterable document fields (content_type, metadata.*) with one
+    # Bitmap per (field, value) over document slots. FieldIndex rows are mapped to their
+    # document's slot, so equality and $in filters become a row mask for the vector search
+    # instead of a MongoDB query.
+    def __init__(self, fields: Tuple[str, ...]):
+        self.fields = fields
+        self._lock = threading.Lock()
+        self._slot_of: Dict[Any, int] = {}
+        self._doc_keys: List[Optional[Tuple[Tuple[Hashable, ...], ...]]] = []
+        self._bitmaps: Dict[str, Dict[Hashable, Bitmap]] = {field: {} for field in fields}
+        # Per embedding field: (FieldIndex generation, slot of each row; -1 while unknown)
+        self._row_slots: Dict[str, Tuple[int, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def projection(self) -> Dict[str, int]:
+        return {field: 1 for field in self.fields}
+
+    def build(self, collection, batch_size: int = 1000) -> None:
+        # Only the filter fields cross the wire
+        batch = []
+        for doc in collection.find({}, self.projection(), batch_size=batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                self.upsert(batch)
+                batch = []
+        self.upsert(batch)
+        logger.info(f"Built filter index over {len(self)} documents")
+
+    def upsert(self, documents: List[Dict[str, Any]]) -> None:
+        if not documents:
+            return
+        # Sync batches can re-read a document; only its last version counts, otherwise a
+        # key dropped by one copy and re-added by another would keep a stale bit
+        latest = list({doc["_id"]: doc for doc in documents}.values())
+        with self._lock:
+            added: Dict[Tuple[str, Hashable], List[int]] = {}
+            dropped: Dict[Tuple[str, Hashable], List[int]] = {}
+            for doc in latest:
+                slot = self._slot_of.get(doc["_id"])
+                if slot is None:
+                    slot = self._slot_of[doc["_id"]] = len(self._doc_keys)
+                    self._doc_keys.append(None)
+                old = self._doc_keys[slot] or ((),) * len(self.fields)
+                new = tuple(_field_keys(doc, field) for field in self.fields)
+                for field, old_keys, new_keys in zip(self.fields, old, new):
+                    for key in set(old_keys) - set(new_keys):
+                        dropped.setdefault((field, key), []).append(slot)
+                    for key in set(new_keys) - set(old_keys):
+                        added.setdefault((field, key), []).append(slot)
+                self._doc_keys[slot] = new
+            self._apply(added, dropped)
+
+    def remove(self, doc_ids: Iterable[Any]) -> None:
+        # Slots stay assigned (a re-ingested document takes its old one back), only emptied
+        with self._lock:
+            dropped: Dict[Tuple[str, Hashable], List[int]] = {}
+            for doc_id in doc_ids:
+                slot = self._slot_of.get(doc_id)
+                if slot is None or self._doc_keys[slot] is None:
+                    continue
+                for field, keys in zip(self.fields, self._doc_keys[slot]):
+                    for key in keys:
+                        dropped.setdefault((field, key), []).append(slot)
+                self._doc_keys[slot] = None
+            self._apply({}, dropped)
+
+    def _apply(self, added: Dict[Tuple[str, Hashable], List[int]],
+               dropped: Dict[Tuple[str, Hashable], List[int]]) -> None:
+        universe = len(self._doc_keys)
+        for (field, key), slots in dropped.items():
+            bitmap = self._bitmaps[field].get(key)
+            if bitmap is not None:
+                bitmap.discard(np.asarray(slots), universe)
+                if not len(bitmap):
+                    del self._bitmaps[field][key]
+        for (field, key), slots in added.items():
+            self._bitmaps[field].setdefault(key, Bitmap()).add(np.asarray(slots), universe)
+
+    def can_filter(self, mongo_query: Dict[str, Any]) -> bool:
+        return self._terms(mongo_query) is not None
+
+    def _terms(self, mongo_query: Dict[str, Any]) -> Optional[List[Tuple[str, List[Hashable]]]]:
+        # {field: value} and {field: {"$in": [...]}} over indexed fields; None for anything else
+        terms = []
+        for field, condition in mongo_query.items():
+            if field not in self._bitmaps:
+                return None
+            if isinstance(condition, dict):
+                if set(condition) != {"$in"} or not isinstance(condition["$in"], (list, tuple)):
+                    return None
+                values = condition["$in"]
+            else:
+                values = [condition]
+            keys = [_value_key(value) for value in values]
+            if any(key is _NO_KEY for key in keys):
+                return None
+            terms.append((field, keys))
+        return terms
+
+    def mask(self, mongo_query: Dict[str, Any]) -> Optional[np.ndarray]:
+        # AND across fields, OR across $in values; one bool per document slot
+        terms = self._terms(mongo_query)
+        if terms is None:
+            return None
+        with self._lock:
+            size = len(self._doc_keys)
+            result = np.ones(size, dtype=bool)
+            for field, keys in terms:
+                term = np.zeros(size, dtype=bool)
+                for key in keys:
+                    bitmap = self._bitmaps[field].get(key)
+                    if bitmap is not None:
+                        term |= bitmap.to_mask(size)
+                result &= term
+            return result
+
+    def rows(self, index, mongo_query: Dict[str, Any], snapshot=None) -> Optional[np.ndarray]:
+        # Live rows of a FieldIndex (of `snapshot` when given) whose documents match, None if
+        # the filter is not indexable
+        mask = self.mask(mongo_query)
+        if mask is None:
+            return None
+        snapshot = index.snapshot() if snapshot is None else snapshot
+        slots = self._slots_for(index.field, snapshot)
+        known = (slots >= 0) & (slots < len(mask))
+        hit = np.zeros(len(slots), dtype=bool)
+        hit[known] = mask[slots[known]]
+        return np.flatnonzero(hit & snapshot.alive)
+
+    def _slots_for(self, field: str, snapshot) -> np.ndarray:
+        # Row -> slot is extended as rows are appended and rebuilt after a compaction
+        with self._lock:
+            size = len(snapshot.ids)
+            generation, slots = self._row_slots.get(field, (None, None))
+            if generation != snapshot.generation or slots is None or len(slots) > size:
+                slots = np.empty(0, dtype=np.int64)
+            if len(slots) < size:
+                slot_of = self._slot_of
+                tail = np.fromiter(
+                    (slot_of.get(doc_id, -1) for doc_id in snapshot.ids[len(slots):size]),
+                    dtype=np.int64, count=size - len(slots)
+                )
+                slots = np.concatenate([slots, tail])
+            unknown = np.flatnonzero((slots < 0) & snapshot.alive[:size])
+            if len(unknown):
+                # Rows that arrived through the store before their document reached the filter
+                slots = slots.copy()
+                slots[unknown] = [self._slot_of.get(snapshot.ids[row], -1) for row in unknown]
+            self._row_slots[field] = (snapshot.generation, slots)
+            return slots
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "documents": len(self._slot_of),
+                "values": {field: len(bitmaps) for field, bitmaps in self._bitmaps.items()},
+                "bytes": sum(bitmap.nbytes for bitmaps in self._bitmaps.values() for bitmap in bitmaps.values()),
+            }
+
+
+def filter_fields_from_env() -> Tuple[str, ...]:
+    # FILTER_INDEX_FIELDS= (empty) keeps every filter in MongoDB
+    fields = os.getenv('FILTER_INDEX_FIELDS', 'content_type,metadata.category,metadata.keyword,metadata.source')
+    return tuple(field.strip() for field in fields.split(",") if field.strip())
@@ -0,0 +1,181 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from .vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+
+class IndexSynchronizer:
+    # Keeps a VectorIndex current by polling for documents and tombstones newer than a watermark
+    def __init__(self, index: VectorIndex, collection, tombstones,
+                 interval: float = 2.0,
+                 compact_ratio: float = 0.2,
+                 overlap: timedelta = timedelta(seconds=5),
+                 batch_size: int = 1000):
+        self.index = index
+        self.collection = collection
+        self.tombstones = tombstones
+        self.interval = interval
+        self.compact_ratio = compact_ratio
+        # Re-read a short window behind the watermark so writers with skewed clocks are not missed
+        self.overlap = overlap
+        self.batch_size = batch_size
+
+        self.watermark: Optional[datetime] = None
+        self.tombstone_watermark: Optional[datetime] = None
+        self._versions: Dict[Any, datetime] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def rebuild(self, force: bool = True) -> None:
+        # Full load; the watermark starts from the newest document seen. A shared VectorStore
+        # stays locked throughout, so workers starting on an empty store rebuild one at a time;
+        # without `force` a worker that waited resumes from the store another one just built.
+        store = self.index.store
+        if store is None:
+            self._rebuild()
+            return
+        with store.locked():
+            if not force and self.warm_start():
+                logger.info("Vector store was built by another process; warm started from it")
+                return
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        started_at = datetime.utcnow()
+        self.index.build(self.collection)
+        self._versions = {}
+        self.watermark = self._latest_timestamp()
+        self.tombstone_watermark = started_at
+
+        # Documents inside the overlap window are already indexed; remember their versions
+        if self.watermark is not None:
+            recent = self.collection.find(
+                {"updated_at": {"$gt": self.watermark - self.overlap}},
+                {"updated_at": 1}
+            )
+            self._versions = {doc["_id"]: doc["updated_at"] for doc in recent}
+        self._save_watermarks()
+
+    def warm_start(self) -> bool:
+        # Resume from the index's VectorStore and its saved watermarks, then catch up.
+        # False when there is no usable store state and a full rebuild is needed.
+        store = self.index.store
+        if store is None:
+            return False
+        watermark, tombstone_watermark = store.watermarks()
+        if watermark is None or not self.index.load(self.collection):
+            return False
+        self.watermark = watermark
+        self.tombstone_watermark = tombstone_watermark
+        # Re-read rows inside the overlap window are skipped by their stored versions
+        self._versions = {}
+        self.sync_once()
+        return True
+
+    def _save_watermarks(self) -> None:
+        if self.index.store is not None:
+            self.index.store.update_watermarks(self.watermark, self.tombstone_watermark)
+
+    def _latest_timestamp(self) -> Optional[datetime]:
+        latest = None
+        for field in ("updated_at", "created_at"):
+            doc = self.collection.find_one({field: {"$ne": None}}, {field: 1}, sort=[(field, -1)])
+            if doc and (latest is None or doc[field] > latest):
+                latest = doc[field]
+        return latest
+
+    def sync_once(self) -> Tuple[int, int]:
+        self.index.refresh()
+        upserted = self._pull_documents()
+        removed = self._pull_tombstones()
+        self._save_watermarks()
+
+        compacted = self.index.maintain(self.compact_ratio)
+        if compacted:
+            logger.info(f"Compacted vector index fields: {', '.join(compacted)}")
+        return upserted, removed
+
+    def _pull_documents(self) -> int:
+        if self.watermark is None:
+            mongo_query = {}
+        else:
+            since = self.watermark - self.overlap
+            mongo_query = {"$or": [
+                {"updated_at": {"$gt": since}},
+                {"created_at": {"$gt": since}},
+            ]}
+
+        batch = []
+        upserted = 0
+        cursor = self.collection.find(mongo_query, self.index.projection(), batch_size=self.batch_size)
+        for doc in cursor:
+            version = doc.get("updated_at") or doc.get("created_at")
+            if version is not None and self._versions.get(doc["_id"]) == version:
+                # Already indexed during the overlap window
+                continue
+
+            batch.append(doc)
+            if version is not None:
+                self._versions[doc["_id"]] = version
+                if self.watermark is None or version > self.watermark:
+                    self.watermark = version
+
+            if len(batch) >= self.batch_size:
+                self.index.upsert_documents(batch)
+                upserted += len(batch)
+                batch = []
+
+        if batch:
+            self.index.upsert_documents(batch)
+            upserted += len(batch)
+
+        # Only versions inside the overlap window can be seen again
+        if self.watermark is not None:
+            since = self.watermark - self.overlap
+            self._versions = {
+                doc_id: version for doc_id, version in self._versions.items() if version > since
+            }
+        return upserted
+
+    def _pull_tombstones(self) -> int:
+        mongo_query = {}
+        if self.tombstone_watermark is not None:
+            mongo_query["deleted_at"] = {"$gt": self.tombstone_watermark - self.overlap}
+
+        doc_ids = []
+        for tombstone in self.tombstones.find(mongo_query, {"document_id": 1, "deleted_at": 1}):
+            doc_ids.append(tombstone["document_id"])
+            self._versions.pop(tombstone["document_id"], None)
+            if self.tombstone_watermark is None or tombstone["deleted_at"] > self.tombstone_watermark:
+                self.tombstone_watermark = tombstone["deleted_at"]
+
+        if not doc_ids:
+            return 0
+        return self.index.remove(doc_ids)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="index-sync", daemon=True)
+        self._thread.start()
+        logger.info(f"Started index sync every {self.interval}s")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                upserted, removed = self.sync_once()
+                if upserted or removed:
+                    logger.info(f"Index sync: {upserted} upserted, {removed} removed")
+            except Exception as e:
+                logger.error(f"Index sync failed: {e}")
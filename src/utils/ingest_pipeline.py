@@ -0,0 +1,372 @@
+import argparse
+import codecs
+import json
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+from ..database.schemas import ContentType
+from ..models.preprocessing import get_image_preprocessor
+from .data_ingestion import CONTENT_FIELDS, DataIngestion
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+def iter_records(path: str, offset: int = 0, chunk_size: int = 1 << 20) -> Iterator[Tuple[Dict[str, Any], int]]:
+    # Yields (record, byte offset just past it) from a JSON array or JSONL file without
+    # loading the whole file; `offset` must be a value previously yielded (or 0)
+    with open(path, "rb") as f:
+        head = f.read(1024).lstrip()
+        is_array = head.startswith(b"[")
+        f.seek(offset)
+        if is_array:
+            yield from _iter_array(f, offset, chunk_size)
+        else:
+            yield from _iter_lines(f, offset)
+
+
+def _iter_lines(f, offset: int) -> Iterator[Tuple[Dict[str, Any], int]]:
+    for line in f:
+        offset += len(line)
+        if line.strip():
+            yield json.loads(line), offset
+
+
+def _iter_array(f, offset: int, chunk_size: int) -> Iterator[Tuple[Dict[str, Any], int]]:
+    decoder = json.JSONDecoder()
+    # Incremental so a UTF-8 sequence split across reads is completed by the next read
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+    started = offset > 0
+    while True:
+        # Skip the opening bracket, separators and whitespace between elements
+        skip = pos
+        while skip < len(buffer) and (buffer[skip] in " \t\r\n," or (not started and buffer[skip] == "[")):
+            started = started or buffer[skip] == "["
+            skip += 1
+        offset += len(buffer[pos:skip].encode("utf-8"))
+        pos = skip
+
+        if buffer.startswith("]", pos):
+            return
+        if pos < len(buffer):
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                offset += len(buffer[pos:end].encode("utf-8"))
+                pos = end
+                yield record, offset
+                continue
+        if eof:
+            return
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+
+class _Batch:
+    __slots__ = ("start", "end", "records", "keys", "images", "embeddings", "errors", "cached",
+                 "cache_keys", "lookups")
+
+    def __init__(self, start: int, end: int, records: List[Dict[str, Any]], keys: List[str]):
+        self.start = start
+        self.end = end
+        self.records = records
+        self.keys = keys
+        self.images: List[Optional[Image.Image]] = [None] * len(records)
+        self.embeddings: List[Optional[Dict[str, Any]]] = [None] * len(records)
+        self.errors: Dict[int, str] = {}
+        self.cached = 0
+        self.lookups = 0
+        # Per record: embedding cache keys from the lookup, reused to store computed rows
+        self.cache_keys: List[Optional[Dict[str, Any]]] = [None] * len(records)
+
+
+def _hit_rate(stats: Dict[str, Any]) -> float:
+    # Records found in the embedding cache per record looked up
+    return stats["cached"] / stats["cache_lookups"] if stats["cache_lookups"] else 0.0
+
+
+def _content_type(record: Dict[str, Any]) -> Optional[ContentType]:
+    if record.get("image_path"):
+        return ContentType.MULTIMODAL if record.get("text") else ContentType.IMAGE
+    return ContentType.TEXT if record.get("text") else None
+
+
+class IngestionPipeline:
+    # read records -> decode images -> embed in batches -> bulk write, one thread per stage
+    # joined by bounded queues, so a slow stage blocks the ones before it and memory stays
+    # at roughly queue_size batches. The byte offset after each written batch is checkpointed;
+    # every document carries an ingest_key so a batch replayed after a crash is not duplicated.
+    def __init__(self, ingestion: DataIngestion, batch_size: int = 32,
+                 queue_size: int = 4, decode_workers: int = 4):
+        self.ingestion = ingestion
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.decode_workers = decode_workers
+        self.checkpoints = ingestion.db_client.get_collection("ingest_checkpoints")
+        ingestion.collection.create_index(
+            "ingest_key", unique=True, partialFilterExpression={"ingest_key": {"$exists": True}}
+        )
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def run(self, path: str, restart: bool = False) -> Dict[str, Any]:
+        source = os.path.abspath(path)
+        checkpoint = None if restart else self.checkpoints.find_one({"_id": source})
+        offset = checkpoint["offset"] if checkpoint else 0
+        stats = {
+            key: checkpoint.get(key, 0) if checkpoint else 0
+            for key in ("records", "inserted", "duplicates", "failed", "cached", "cache_lookups")
+        }
+        stats["cache_hit_rate"] = _hit_rate(stats)
+        if offset:
+            logger.info(f"Resuming ingestion of {source} at byte {offset} ({stats['records']} records done)")
+
+        self._stop.clear()
+        self._error = None
+        decode_queue: queue.Queue = queue.Queue(self.queue_size)
+        embed_queue: queue.Queue = queue.Queue(self.queue_size)
+        write_queue: queue.Queue = queue.Queue(self.queue_size)
+
+        with ThreadPoolExecutor(self.decode_workers, thread_name_prefix="ingest-decode") as decode_pool:
+            stages = [
+                threading.Thread(target=self._read, args=(source, offset, stats["records"], decode_queue),
+                                 name="ingest-read", daemon=True),
+                threading.Thread(target=self._stage, args=(lambda b: self._decode(b, decode_pool),
+                                                           decode_queue, embed_queue),
+                                 name="ingest-decode", daemon=True),
+                threading.Thread(target=self._stage, args=(self._embed, embed_queue, write_queue),
+                                 name="ingest-embed", daemon=True),
+            ]
+            for stage in stages:
+                stage.start()
+            try:
+                while True:
+                    batch = self._get(write_queue)
+                    if batch is _DONE:
+                        break
+                    self._write(batch, source, stats)
+            except BaseException as e:
+                self._error = self._error or e
+                self._stop.set()
+            for stage in stages:
+                stage.join()
+
+        if self._error is not None:
+            raise self._error
+        self.checkpoints.update_one(
+            {"_id": source}, {"$set": {"completed_at": datetime.utcnow()}}, upsert=True
+        )
+        return stats
+
+    def _put(self, outbox: queue.Queue, item: Any) -> bool:
+        # Blocks while the next stage is behind (backpressure); gives up if the run is aborting
+        while not self._stop.is_set():
+            try:
+                outbox.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, inbox: queue.Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _stage(self, fn, inbox: queue.Queue, outbox: queue.Queue) -> None:
+        try:
+            while True:
+                batch = self._get(inbox)
+                if batch is _DONE or not self._put(outbox, fn(batch)):
+                    break
+        except BaseException as e:
+            self._error = e
+            self._stop.set()
+        finally:
+            self._put(outbox, _DONE)
+
+    def _read(self, source: str, offset: int, done: int, outbox: queue.Queue) -> None:
+        try:
+            records, keys = [], []
+            start = offset
+            for record, end in iter_records(source, offset):
+                records.append(record)
+                keys.append(f"{source}:{record.get('id', done + len(keys))}")
+                if len(records) >= self.batch_size:
+                    if not self._put(outbox, _Batch(start, end, records, keys)):
+                        return
+                    done += len(records)
+                    records, keys, start = [], [], end
+            if records:
+                self._put(outbox, _Batch(start, end, records, keys))
+        except BaseException as e:
+            self._error = e
+            self._stop.set()
+        finally:
+            self._put(outbox, _DONE)
+
+    def _lookup(self, batch: _Batch) -> None:
+        # Records embedded before (same text / image bytes, same model) skip decode and embed
+        groups: Dict[ContentType, List[int]] = {}
+        for i, record in enumerate(batch.records):
+            kind = _content_type(record)
+            if kind is not None:
+                groups.setdefault(kind, []).append(i)
+        embedder = self.ingestion.embedder
+        for kind, rows in groups.items():
+            keys = embedder.row_keys(
+                CONTENT_FIELDS[kind],
+                [batch.records[i].get("text") for i in rows],
+                [batch.records[i].get("image_path") for i in rows]
+            )
+            batch.lookups += len(rows)
+            for i, row_keys, embeddings in zip(rows, keys, embedder.lookup(keys)):
+                batch.cache_keys[i] = row_keys
+                if embeddings is not None:
+                    batch.embeddings[i] = (kind, embeddings)
+                    batch.cached += 1
+
+    def _decode(self, batch: _Batch, pool: ThreadPoolExecutor) -> _Batch:
+        if self.ingestion.embedding_cache is not None:
+            self._lookup(batch)
+        pending = [i for i in range(len(batch.records)) if batch.embeddings[i] is None]
+        if get_image_preprocessor() is not None:
+            # Straight to CLIP pixel arrays in the process pool
+            rows = [i for i in pending if batch.records[i].get("image_path")]
+            decoded = self.ingestion.model_embedder.preprocess_images(
+                [batch.records[i]["image_path"] for i in rows]
+            )
+            for i, result in zip(rows, decoded):
+                if isinstance(result, Exception):
+                    batch.errors[i] = str(result)
+                else:
+                    batch.images[i] = result
+            return batch
+
+        def load(image_path: Optional[str]) -> Optional[Image.Image]:
+            if not image_path:
+                return None
+            with Image.open(image_path) as image:
+                return image.convert('RGB')
+
+        futures = {i: pool.submit(load, batch.records[i].get("image_path")) for i in pending}
+        for i, future in futures.items():
+            try:
+                batch.images[i] = future.result()
+            except Exception as e:
+                batch.errors[i] = str(e)
+        return batch
+
+    def _embed(self, batch: _Batch) -> _Batch:
+        # Decoded pixels go to the model directly; the cache is keyed by file content
+        embedder = self.ingestion.model_embedder
+        groups: Dict[ContentType, List[int]] = {kind: [] for kind in ContentType}
+        for i, record in enumerate(batch.records):
+            if i in batch.errors or batch.embeddings[i] is not None:
+                continue
+            if batch.images[i] is not None:
+                groups[ContentType.MULTIMODAL if record.get("text") else ContentType.IMAGE].append(i)
+            elif record.get("text"):
+                groups[ContentType.TEXT].append(i)
+            else:
+                batch.errors[i] = "record has neither text nor image_path"
+
+        for kind, rows in groups.items():
+            if not rows:
+                continue
+            texts = [batch.records[i].get("text") for i in rows]
+            images = [batch.images[i] for i in rows]
+            try:
+                if kind == ContentType.MULTIMODAL:
+                    embeddings = embedder.embed_document(texts, images)
+                elif kind == ContentType.IMAGE:
+                    embeddings = {"image_embedding": embedder.embed_image(images)}
+                else:
+                    embeddings = {"text_embedding": embedder.embed_text(texts)}
+            except Exception as e:
+                for i in rows:
+                    batch.errors[i] = str(e)
+                continue
+            if self.ingestion.embedding_cache is not None:
+                self.ingestion.embedder.store([batch.cache_keys[i] for i in rows], embeddings)
+            for row, i in enumerate(rows):
+                batch.embeddings[i] = (kind, {field: vectors[row] for field, vectors in embeddings.items()})
+        # Decoded pixels are no longer needed; keep queued batches small
+        batch.images = []
+        return batch
+
+    def _write(self, batch: _Batch, source: str, stats: Dict[str, Any]) -> None:
+        now = datetime.utcnow()
+        documents, positions = [], []
+        for i, record in enumerate(batch.records):
+            if batch.embeddings[i] is None:
+                continue
+            kind, embeddings = batch.embeddings[i]
+            doc_dict = self.ingestion.build_document(
+                kind, record.get("text"), record.get("image_path"), record.get("metadata") or {},
+                embeddings, now
+            )
+            doc_dict["ingest_key"] = batch.keys[i]
+            documents.append(doc_dict)
+            positions.append(i)
+
+        write_errors = self.ingestion.insert_documents(documents) if documents else {}
+        duplicates = sum(1 for error in write_errors.values() if error.get("code") == 11000)
+        for row, error in write_errors.items():
+            if error.get("code") != 11000:
+                batch.errors[positions[row]] = error.get("errmsg", "write failed")
+        for i, message in batch.errors.items():
+            logger.warning(f"Skipped record {batch.keys[i]}: {message}")
+
+        stats["records"] += len(batch.records)
+        stats["inserted"] += len(documents) - len(write_errors)
+        stats["duplicates"] += duplicates
+        stats["failed"] += len(batch.errors)
+        stats["cached"] += batch.cached
+        stats["cache_lookups"] += batch.lookups
+        stats["cache_hit_rate"] = _hit_rate(stats)
+        self.checkpoints.update_one(
+            {"_id": source},
+            {"$set": {"offset": batch.end, "updated_at": now, **stats}},
+            upsert=True
+        )
+        logger.info(f"Ingested {stats['records']} records ({stats['inserted']} inserted, "
+                    f"{stats['cached']} from cache ({stats['cache_hit_rate']:.0%}), {stats['failed']} failed)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a JSON array or JSONL dataset into MongoDB")
+    parser.add_argument("path", nargs="?", default="data/web_dataset.json")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--queue-size", type=int, default=4)
+    parser.add_argument("--decode-workers", type=int, default=4)
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pipeline = IngestionPipeline(DataIngestion(), args.batch_size, args.queue_size, args.decode_workers)
+    stats = pipeline.run(args.path, restart=args.restart)
+    logger.info(f"Ingestion complete: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import copy
+import logging
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+import numpy as np
+
+from .vector_index import FieldIndex, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    # Plain (Euclidean) k-means; argmax(x.c - |c|^2 / 2) is the nearest centroid
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T - 0.5 * np.sum(centroids ** 2, axis=1), axis=1)
+        counts = np.bincount(assign, minlength=k)
+        # Sub-vectors are narrow, so one bincount per dimension beats np.add.at
+        sums = np.stack([
+            np.bincount(assign, weights=vectors[:, d], minlength=k) for d in range(vectors.shape[1])
+        ], axis=1)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        empty = np.flatnonzero(~non_empty)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+
+class _Quantizer(ABC):
+    # Shared lifecycle: train once enough rows exist, attach a code column to the FieldIndex,
+    # then optionally let the FieldIndex drop its float32 matrix. Like the IVF index, a copy is
+    # retrained whenever the live rows have grown retrain_growth-fold since the last training
+    # and swapped in with its codes, so the codes follow the data as the corpus grows.
+    name = "quantized"
+
+    def __init__(self, field: str, min_train_size: int, keep_vectors: bool,
+                 sample_size: int = 100000, seed: int = 0, retrain_growth: float = 4.0,
+                 chunk_rows: int = 65536):
+        self.field = field
+        self.min_train_size = min_train_size
+        self.keep_vectors = keep_vectors
+        self.sample_size = sample_size
+        self.seed = seed
+        self.retrain_growth = retrain_growth
+        # Rows re-encoded per step of a (re)training
+        self.chunk_rows = chunk_rows
+        self.is_trained = False
+        self.trained_size = 0
+        self._train_lock = threading.Lock()
+
+    def _due(self, size: int) -> bool:
+        if size < self.min_train_size:
+            return False
+        return not self.is_trained or size > self.trained_size * self.retrain_growth
+
+    def maintain(self, field_index: FieldIndex) -> None:
+        if not self._due(len(field_index)):
+            return
+        with self._train_lock:
+            # Another thread may have trained (and replaced this quantizer) meanwhile
+            if field_index.quantizer is not self or not self._due(len(field_index)):
+                return
+            snapshot = field_index.snapshot()
+            live = np.flatnonzero(snapshot.alive)
+            rng = np.random.default_rng(self.seed)
+            sample = np.sort(rng.choice(live, min(len(live), self.sample_size), replace=False))
+
+            # The first training happens in place; a retraining builds a copy so searches keep
+            # scoring the current codes with the parameters that produced them
+            quantizer = copy.copy(self) if self.is_trained else self
+            vectors = self._float_rows(field_index, snapshot, sample)
+            quantizer.train(vectors[~np.isnan(vectors).any(axis=1)], rng)
+            rows = np.arange(len(snapshot.ids))
+            codes = np.concatenate([
+                quantizer.encode(self._float_rows(field_index, snapshot, rows[start:start + self.chunk_rows]))
+                for start in range(0, len(rows), self.chunk_rows)
+            ])
+            if not field_index.attach_quantizer(quantizer, codes, snapshot.generation):
+                # Compacted meanwhile; the next maintain() starts over on the new rows
+                return
+            quantizer.is_trained = True
+            quantizer.trained_size = len(live)
+            logger.info(f"{'Retrained' if quantizer is not self else 'Trained'} {self.name} quantizer "
+                        f"for {self.field} on {len(sample)} of {len(live)} rows")
+            if not self.keep_vectors:
+                field_index.drop_vectors()
+
+    def _float_rows(self, field_index: FieldIndex, snapshot, rows: np.ndarray) -> np.ndarray:
+        # Float32 rows to train on and encode; once the matrix is dropped they come from
+        # MongoDB, and rows it no longer has keep what their current codes decode to
+        vectors = field_index.exact_vectors(snapshot, rows)
+        missing = np.isnan(vectors).any(axis=1)
+        if missing.any():
+            vectors[missing] = self.decode(snapshot.codes[self.name][rows[missing]]) if self.is_trained else 0.0
+        return vectors
+
+    @abstractmethod
+    def train(self, vectors: np.ndarray, rng: np.random.Generator) -> None:
+        ...
+
+    @abstractmethod
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        ...
+
+    @abstractmethod
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        ...
+
+    @abstractmethod
+    def score(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        ...
+
+
+class ScalarQuantizer(_Quantizer):
+    # int8 per-dimension affine quantization: 4x smaller than float32
+    name = "sq8"
+
+    def __init__(self, field: str, min_train_size: int = 1000, keep_vectors: bool = False,
+                 chunk_size: int = 65536, **kwargs):
+        super().__init__(field, min_train_size, keep_vectors, **kwargs)
+        self.chunk_size = chunk_size
+        self.offset: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    def train(self, vectors: np.ndarray, rng: np.random.Generator) -> None:
+        low = vectors.min(axis=0)
+        high = vectors.max(axis=0)
+        self.scale = np.maximum(high - low, 1e-8).astype(np.float32) / 255.0
+        # code = round((x - low) / scale) - 128, so offset maps code -128 back to low
+        self.offset = (low + 128.0 * self.scale).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.offset) / self.scale)
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def score(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # Asymmetric: q . x ~= codes @ (q * scale) + q . offset, query stays float32
+        weights = (query * self.scale).astype(np.float32)
+        bias = float(query @ self.offset)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.chunk_size):
+            block = codes[start:start + self.chunk_size]
+            scores[start:start + len(block)] = block.astype(np.float32) @ weights
+        return scores + bias
+
+
+class ProductQuantizer(_Quantizer):
+    # m sub-quantizers with 256 centroids each: one byte per sub-vector (32x for dim/8 bytes)
+    name = "pq"
+
+    def __init__(self, field: str, subvectors: Optional[int] = None,
+                 min_train_size: int = 10000, keep_vectors: bool = False,
+                 train_iterations: int = 15, chunk_size: int = 65536, **kwargs):
+        super().__init__(field, min_train_size, keep_vectors, **kwargs)
+        self.subvectors = subvectors
+        self.train_iterations = train_iterations
+        self.chunk_size = chunk_size
+        self.codebooks: Optional[np.ndarray] = None
+
+    def train(self, vectors: np.ndarray, rng: np.random.Generator) -> None:
+        dim = vectors.shape[1]
+        m = self.subvectors or (dim // 8 if dim % 8 == 0 else dim)
+        if dim % m != 0:
+            raise ValueError(f"PQ subvectors ({m}) must divide the embedding dimension ({dim})")
+        dsub = dim // m
+        ks = min(256, len(vectors))
+
+        codebooks = np.empty((m, ks, dsub), dtype=np.float32)
+        for j in range(m):
+            sub = np.ascontiguousarray(vectors[:, j * dsub:(j + 1) * dsub])
+            codebooks[j] = _kmeans(sub, ks, self.train_iterations, rng)
+        self.subvectors = m
+        self.codebooks = codebooks
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        m, ks, dsub = self.codebooks.shape
+        codes = np.empty((len(vectors), m), dtype=np.uint8)
+        for j in range(m):
+            sub = vectors[:, j * dsub:(j + 1) * dsub]
+            centroids = self.codebooks[j]
+            codes[:, j] = np.argmax(sub @ centroids.T - 0.5 * np.sum(centroids ** 2, axis=1), axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        m = self.codebooks.shape[0]
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(m)], axis=1)
+
+    def score(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # Asymmetric distance computation: one m x 256 table of query/centroid inner products,
+        # then each row's score is m table lookups
+        m, ks, dsub = self.codebooks.shape
+        table = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(m, dsub))
+        flat = table.ravel()
+        offsets = (np.arange(m) * ks).astype(np.int64)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.chunk_size):
+            block = codes[start:start + self.chunk_size]
+            scores[start:start + len(block)] = flat[block + offsets].sum(axis=1)
+        return scores
+
+
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _hamming(codes: np.ndarray, query_code: np.ndarray) -> np.ndarray:
+    # Popcount of XOR, 64 bits at a time when the code width allows
+    if codes.shape[1] % 8 == 0:
+        codes = np.ascontiguousarray(codes).view(np.uint64)
+        query_code = query_code.view(np.uint64)
+    diff = np.bitwise_xor(codes, query_code)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(diff).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[diff.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+class BinaryQuantizer(_Quantizer):
+    # One sign bit per dimension, taken around the training mean: 32x smaller than float32.
+    # Scores are Hamming distances (XOR + popcount) mapped to the angle estimate
+    # cos(pi * h / dim); coarse on their own, meant to pick candidates for the float32 rerank
+    name = "binary"
+
+    def __init__(self, field: str, min_train_size: int = 1000, keep_vectors: bool = False,
+                 chunk_size: int = 262144, **kwargs):
+        super().__init__(field, min_train_size, keep_vectors, **kwargs)
+        self.chunk_size = chunk_size
+        self.center: Optional[np.ndarray] = None
+        self.spread: Optional[np.ndarray] = None
+        self._cosines: Optional[np.ndarray] = None
+
+    def train(self, vectors: np.ndarray, rng: np.random.Generator) -> None:
+        dim = vectors.shape[1]
+        self.center = vectors.mean(axis=0).astype(np.float32)
+        # Mean distance from the center per dimension, only used by decode()
+        self.spread = np.abs(vectors - self.center).mean(axis=0).astype(np.float32)
+        self._cosines = np.cos(np.pi * np.arange(dim + 1) / dim).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.packbits(vectors > self.center, axis=1)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        signs = np.unpackbits(codes, axis=1, count=len(self.center)).astype(np.float32) * 2 - 1
+        return normalize_rows(self.center + signs * self.spread)
+
+    def score(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        query_code = self.encode(query.reshape(1, -1))[0]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.chunk_size):
+            block = codes[start:start + self.chunk_size]
+            scores[start:start + len(block)] = self._cosines[_hamming(block, query_code)]
+        return scores
+
+
+def rerank_from_env() -> int:
+    # Float32 rescoring candidates per requested result; sign bits rank too coarsely for 4
+    binary = os.getenv('INDEX_QUANTIZATION', 'none').lower() == 'binary'
+    return int(os.getenv('INDEX_RERANK', '20' if binary else '4'))
+
+
+def quantizer_factory_from_env() -> Optional[Any]:
+    # Opt-in: INDEX_QUANTIZATION=int8, pq or binary
+    kind = os.getenv('INDEX_QUANTIZATION', 'none').lower()
+    if kind in ('', 'none'):
+        return None
+
+    keep_vectors = os.getenv('INDEX_KEEP_VECTORS', 'false').lower() == 'true'
+    subvectors = os.getenv('PQ_SUBVECTORS')
+
+    def factory(field: str) -> _Quantizer:
+        if kind == 'int8':
+            return ScalarQuantizer(field, keep_vectors=keep_vectors)
+        if kind == 'pq':
+            return ProductQuantizer(
+                field,
+                subvectors=int(subvectors) if subvectors else None,
+                keep_vectors=keep_vectors
+            )
+        if kind == 'binary':
+            return BinaryQuantizer(field, keep_vectors=keep_vectors)
+        raise ValueError(f"Unknown INDEX_QUANTIZATION: {kind}")
+
+    return factory
@@ -1,42 +1,176 @@
+import os
+import time
 import numpy as np
-from typing import List, Optional, Dict, Any, Union
+from typing import List, Optional, Dict, Any, Tuple, Union
 from PIL import Image
 import logging
 
 from ..database.mongodb_client import MongoDBClient
 from ..database.schemas import SearchQuery, SearchResult, Document, ContentType
 from ..models.embeddings import MultimodalEmbedder
+from ..models.registry import get_embedder
+from ..models.embedding_cache import CachedEmbedder, query_cache_from_env
+from ..database.vector_codec import EMBEDDING_FIELDS, decode_vector, storage_mode_from_env
+from .vector_index import VectorIndex, batched, normalize_rows, scanner_from_env, top_k_indices
+from .index_sync import IndexSynchronizer
+from .ann_index import ivf_factory_from_env
+from .quantization import quantizer_factory_from_env, rerank_from_env
+from .vector_store import vector_store_from_env
+from .filter_index import filter_fields_from_env
 
 logger = logging.getLogger(__name__)
 
 
+RETRIEVAL_MODES = ("index", "scan", "server")
+
+# Results carry the document without its embeddings; scoring never needs them from here
+HYDRATE_PROJECTION = {field: 0 for field in EMBEDDING_FIELDS}
+
+
+def _image_query(image: Union[str, bytes]) -> Dict[str, Any]:
+    # Image arguments are a path or the encoded bytes of an upload
+    if isinstance(image, (bytes, bytearray)):
+        return {"query_image": bytes(image)}
+    return {"query_image_path": image}
+
+
 class MultimodalRetriever:
-    def __init__(self):
+    def __init__(self, mode: Optional[str] = None, sync_interval: Optional[float] = None,
+                 embedder: Optional[MultimodalEmbedder] = None):
         self.db_client = MongoDBClient()
         self.db_client.connect()
         self.collection = self.db_client.get_collection("multimodal_documents")
-        self.embedder = MultimodalEmbedder()
+        # Shared per process; models load on first use
+        self.embedder = embedder or get_embedder()
+        # Repeated query text/images skip the model (QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+        self.query_cache = query_cache_from_env()
+        self.query_embedder = (
+            CachedEmbedder(self.embedder, self.query_cache) if self.query_cache is not None else self.embedder
+        )
+        
+        # index: resident embedding matrices scored in memory
+        # scan: stream one projected embedding field from MongoDB per query
+        # server: score inside a MongoDB aggregation pipeline; only the top_k ids come back
+        self.mode = (mode or os.getenv('RETRIEVAL_MODE', 'index')).lower()
+        if self.mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {self.mode} (expected one of {RETRIEVAL_MODES})")
+        # The aggregation language cannot read packed Binary embeddings; server mode would
+        # silently match nothing
+        if self.mode == "server" and storage_mode_from_env() != "list":
+            raise ValueError(
+                f"RETRIEVAL_MODE=server needs EMBEDDING_STORAGE=list, got {storage_mode_from_env()}"
+            )
+        self.scan_batch_size = int(os.getenv('SCAN_BATCH_SIZE', '2000'))
+        
+        self.index = None
+        self.synchronizer = None
+        if self.mode == "index":
+            self._init_index(sync_interval)
+    
+    def _init_index(self, sync_interval: Optional[float]):
+        self.index = VectorIndex(
+            ann_factory=ivf_factory_from_env(),
+            quantizer_factory=quantizer_factory_from_env(),
+            rerank=rerank_from_env(),
+            store=vector_store_from_env(),
+            filter_fields=filter_fields_from_env(),
+            scanner=scanner_from_env()
+        )
+        if sync_interval is None:
+            sync_interval = float(os.getenv('INDEX_SYNC_INTERVAL', '2.0'))
+        self.synchronizer = IndexSynchronizer(
+            self.index,
+            self.collection,
+            self.db_client.get_collection("multimodal_tombstones"),
+            interval=sync_interval,
+            compact_ratio=float(os.getenv('INDEX_COMPACT_RATIO', '0.2'))
+        )
+        # With VECTOR_STORE_DIR set, start from the memory-mapped store instead of a full scan
+        if not self.synchronizer.warm_start():
+            self.synchronizer.rebuild(force=False)
+        
+        # Pick up documents written by DataIngestion without a full reload
+        if sync_interval > 0:
+            self.synchronizer.start()
+    
+    def refresh_index(self):
+        if self.synchronizer is not None:
+            self.synchronizer.rebuild()
+    
+    def sync_index(self) -> Tuple[int, int]:
+        if self.synchronizer is None:
+            return 0, 0
+        return self.synchronizer.sync_once()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "indexed": len(self.index) if self.index is not None else None,
+            "query_cache": self.query_cache.stats() if self.query_cache is not None else None,
+            "filter_index": (
+                self.index.filters.stats() if self.index is not None and self.index.filters is not None else None
+            ),
+        }
+    
+    def close(self):
+        if self.synchronizer is not None:
+            self.synchronizer.stop()
+        if self.index is not None:
+            self.index.close()
+        self.db_client.close()
     
-    def search(self, query: SearchQuery) -> List[SearchResult]:
-        # Generate query embedding based on query type
-        if query.query_text and query.query_image_path:
+    def embed_query(self, query: SearchQuery) -> Tuple[np.ndarray, str]:
+        image = query.query_image if query.query_image is not None else query.query_image_path
+        if query.query_text and image:
             # Multimodal query
-            query_embedding = self.embedder.embed_multimodal(
-                query.query_text, query.query_image_path
-            )[0]
+            query_embedding = self.query_embedder.embed_multimodal(query.query_text, image)[0]
             embedding_field = "multimodal_embedding"
         elif query.query_text:
             # Text-only query
-            query_embedding = self.embedder.embed_text(query.query_text)[0]
+            query_embedding = self.query_embedder.embed_text(query.query_text)[0]
             embedding_field = "text_embedding"
-        elif query.query_image_path:
+        elif image:
             # Image-only query
-            query_embedding = self.embedder.embed_image(query.query_image_path)[0]
+            query_embedding = self.query_embedder.embed_image(image)[0]
             embedding_field = "image_embedding"
         else:
             raise ValueError("Either query_text or query_image_path must be provided")
         
-        # Build MongoDB query
+        return query_embedding, embedding_field
+    
+    def embed_queries(self, queries: List[SearchQuery]) -> List[Tuple[np.ndarray, str]]:
+        # embed_query() for many queries: one batched model call per query kind
+        kinds: Dict[str, List[int]] = {"text": [], "image": [], "multimodal": []}
+        images = []
+        for i, query in enumerate(queries):
+            image = query.query_image if query.query_image is not None else query.query_image_path
+            images.append(image)
+            if query.query_text and image:
+                kinds["multimodal"].append(i)
+            elif query.query_text:
+                kinds["text"].append(i)
+            elif image:
+                kinds["image"].append(i)
+            else:
+                raise ValueError(f"Query {i}: either query_text or query_image_path must be provided")
+        
+        embedded: List[Optional[Tuple[np.ndarray, str]]] = [None] * len(queries)
+        for kind, rows in kinds.items():
+            if not rows:
+                continue
+            if kind == "multimodal":
+                vectors = self.query_embedder.embed_multimodal(
+                    [queries[i].query_text for i in rows], [images[i] for i in rows]
+                )
+            elif kind == "text":
+                vectors = self.query_embedder.embed_text([queries[i].query_text for i in rows])
+            else:
+                vectors = self.query_embedder.embed_image([images[i] for i in rows])
+            for row, i in enumerate(rows):
+                embedded[i] = (vectors[row], f"{kind}_embedding")
+        return embedded
+    
+    def _build_filter(self, query: SearchQuery) -> Dict[str, Any]:
         mongo_query = {}
         
         # Add content type filter if specified
@@ -48,124 +182,314 @@ class MultimodalRetriever:
             for key, value in query.metadata_filter.items():
                 mongo_query[f"metadata.{key}"] = value
         
-        # Retrieve documents
-        documents = list(self.collection.find(mongo_query))
+        return mongo_query
+    
+    def _index_filter(self, mongo_query: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[List[Any]]]:
+        # (where, candidate_ids) for VectorIndex.search: conditions on indexed fields are
+        # answered by the in-memory bitmaps, only the rest needs a MongoDB _id query
+        where = {key: value for key, value in mongo_query.items() if self.index.can_filter({key: value})}
+        rest = {key: value for key, value in mongo_query.items() if key not in where}
+        candidate_ids = None
+        if rest:
+            candidate_ids = [doc["_id"] for doc in self.collection.find(rest, {"_id": 1})]
+        return where or None, candidate_ids
+    
+    def _hydrate(self, hits: List[Tuple[Any, float]]) -> List[SearchResult]:
+        return self._hydrate_many([hits])[0]
+    
+    def _hydrate_many(self, hit_lists: List[List[Tuple[Any, float]]]) -> List[List[SearchResult]]:
+        ids = list({doc_id for hits in hit_lists for doc_id, _ in hits})
+        if not ids:
+            return [[] for _ in hit_lists]
         
-        if not documents:
-            return []
+        # Fetch only the winning ids, once even if several queries share them. Stored documents
+        # were validated on the way in, so the models are built without re-validating them;
+        # only content_type comes back from MongoDB as a plain str and is made a ContentType
+        # again. Embeddings are not fetched: result documents carry them as None.
+        documents = {}
+        for doc in self.collection.find({"_id": {"$in": ids}}, HYDRATE_PROJECTION):
+            doc_id = doc.pop("_id")
+            doc["content_type"] = ContentType(doc["content_type"])
+            documents[doc_id] = Document.model_construct(id=str(doc_id), **doc)
         
-        # Calculate similarities
         results = []
-        for doc in documents:
-            doc_obj = Document(**doc)
-            
-            # Get appropriate embedding based on query type
-            if embedding_field == "multimodal_embedding" and doc_obj.multimodal_embedding:
-                doc_embedding = np.array(doc_obj.multimodal_embedding)
-            elif embedding_field == "text_embedding" and doc_obj.text_embedding:
-                doc_embedding = np.array(doc_obj.text_embedding)
-            elif embedding_field == "image_embedding" and doc_obj.image_embedding:
-                doc_embedding = np.array(doc_obj.image_embedding)
-            else:
-                continue
-            
-            # Calculate cosine similarity
-            similarity = self.embedder.compute_similarity(
-                query_embedding.reshape(1, -1), 
-                doc_embedding.reshape(1, -1)
-            )[0]
-            
-            # Calculate distance (1 - similarity for cosine)
-            distance = 1 - similarity
-            
-            # Apply threshold filter if specified
-            if query.threshold and similarity < query.threshold:
-                continue
+        for hits in hit_lists:
+            # Ids missing from documents were deleted since the index was built
+            results.append([
+                SearchResult.model_construct(document=documents[doc_id], score=score, distance=1 - score)
+                for doc_id, score in hits if doc_id in documents
+            ])
+        return results
+    
+    def _scan(self, parts: List[Tuple[str, np.ndarray, float]], mongo_query: Dict[str, Any],
+              top_k: int, threshold: Optional[float] = None) -> List[Tuple[Any, float]]:
+        # One pass over the collection scoring sum(weight * cosine) over (field, query, weight)
+        # parts; a document lacking a field gets 0 for it. Only _id and the scored fields
+        # cross the wire, and a running top-k is merged per batch.
+        queries = [(field, normalize_rows(embedding)[0], weight) for field, embedding, weight in parts]
+        mongo_query = dict(mongo_query)
+        # Ingestion stores a missing embedding as null, but documents written by older versions or
+        # other tools can hold an empty list; it has nothing to score
+        present = [{field: {"$nin": [None, []]}} for field, _, _ in queries]
+        if len(present) == 1:
+            mongo_query.update(present[0])
+        else:
+            mongo_query["$or"] = present
+        cursor = self.collection.find(
+            mongo_query, {field: 1 for field, _, _ in queries}, batch_size=self.scan_batch_size
+        )
+        
+        best_ids = np.empty(0, dtype=object)
+        best_scores = np.empty(0, dtype=np.float32)
+        for batch in batched(cursor, self.scan_batch_size):
+            ids = np.empty(len(batch), dtype=object)
+            ids[:] = [doc["_id"] for doc in batch]
+            scores = np.zeros(len(batch), dtype=np.float32)
+            scored = np.zeros(len(batch), dtype=bool)
+            for field, query, weight in queries:
+                decoded = [decode_vector(doc.get(field)) for doc in batch]
+                has = [i for i, vector in enumerate(decoded) if vector is not None and len(vector)]
+                if has:
+                    vectors = normalize_rows([decoded[i] for i in has])
+                    scores[has] += weight * (vectors @ query)
+                    scored[has] = True
+            # Zero-length packed vectors get past the query filter; such rows are not hits
+            ids, scores = ids[scored], scores[scored]
             
-            results.append(SearchResult(
-                document=doc_obj,
-                score=float(similarity),
-                distance=float(distance)
-            ))
+            ids = np.concatenate([best_ids, ids])
+            scores = np.concatenate([best_scores, scores])
+            keep = top_k_indices(scores, top_k)
+            best_ids, best_scores = ids[keep], scores[keep]
         
-        # Sort by score (descending)
-        results.sort(key=lambda x: x.score, reverse=True)
+        hits = [(doc_id, float(score)) for doc_id, score in zip(best_ids, best_scores)]
+        if threshold:
+            hits = [(doc_id, score) for doc_id, score in hits if score >= threshold]
+        return hits
+    
+    @staticmethod
+    def _cosine_expression(field: str, query: List[float]) -> Dict[str, Any]:
+        # Cosine similarity via $reduce over $zip(document, query): one pass accumulates the
+        # dot product and the document's squared norm
+        pair = {
+            "$reduce": {
+                "input": {"$zip": {"inputs": [f"${field}", {"$literal": query}]}},
+                "initialValue": {"dot": 0.0, "norm": 0.0},
+                "in": {
+                    "dot": {"$add": ["$$value.dot", {"$multiply": [
+                        {"$arrayElemAt": ["$$this", 0]}, {"$arrayElemAt": ["$$this", 1]}
+                    ]}]},
+                    "norm": {"$add": ["$$value.norm", {"$multiply": [
+                        {"$arrayElemAt": ["$$this", 0]}, {"$arrayElemAt": ["$$this", 0]}
+                    ]}]}
+                }
+            }
+        }
+        return {"$let": {"vars": {"pair": pair}, "in": {"$cond": [
+            {"$gt": ["$$pair.norm", 0]},
+            {"$divide": ["$$pair.dot", {"$sqrt": "$$pair.norm"}]},
+            0.0
+        ]}}}
+    
+    def _score_pipeline(self, parts: List[Tuple[str, np.ndarray, float]], mongo_query: Dict[str, Any],
+                        top_k: int, threshold: Optional[float] = None) -> List[Dict[str, Any]]:
+        # Same scoring as _scan, inside the server. Packed Binary embeddings cannot be read
+        # by the aggregation language (server mode requires EMBEDDING_STORAGE=list), so only
+        # array-typed fields are scored. Empty arrays are excluded as in _scan.
+        match = dict(mongo_query)
+        present = [{field: {"$type": "array", "$ne": []}} for field, _, _ in parts]
+        if len(present) == 1:
+            match.update(present[0])
+        else:
+            match["$or"] = present
         
-        # Return top_k results
-        return results[:query.top_k]
+        terms = []
+        for field, embedding, weight in parts:
+            query = normalize_rows(embedding)[0].astype(float).tolist()
+            terms.append({"$multiply": [float(weight), {"$cond": [
+                {"$isArray": f"${field}"}, self._cosine_expression(field, query), 0.0
+            ]}]})
+        pipeline = [
+            {"$match": match},
+            {"$project": {"score": {"$add": terms}}},
+        ]
+        if threshold:
+            pipeline.append({"$match": {"score": {"$gte": threshold}}})
+        pipeline.extend([
+            {"$sort": {"score": -1, "_id": 1}},
+            {"$limit": top_k},
+        ])
+        return pipeline
+    
+    def _server_search(self, parts: List[Tuple[str, np.ndarray, float]], mongo_query: Dict[str, Any],
+                       top_k: int, threshold: Optional[float] = None) -> List[Tuple[Any, float]]:
+        # $limit must be positive
+        if top_k <= 0:
+            return []
+        pipeline = self._score_pipeline(parts, mongo_query, top_k, threshold)
+        return [(doc["_id"], float(doc["score"])) for doc in self.collection.aggregate(pipeline)]
+    
+    def search(self, query: SearchQuery,
+               embedded: Optional[Tuple[np.ndarray, str]] = None) -> List[SearchResult]:
+        # `embedded` is a precomputed embed_query() result, so callers can run the model
+        # and the retrieval on different executors
+        query_embedding, embedding_field = embedded or self.embed_query(query)
+        
+        if self.mode == "scan":
+            hits = self._scan(
+                [(embedding_field, query_embedding, 1.0)], self._build_filter(query),
+                query.top_k, query.threshold
+            )
+            return self._hydrate(hits)
+        
+        if self.mode == "server":
+            hits = self._server_search(
+                [(embedding_field, query_embedding, 1.0)], self._build_filter(query),
+                query.top_k, query.threshold
+            )
+            return self._hydrate(hits)
+        
+        where, candidate_ids = self._index_filter(self._build_filter(query))
+        if candidate_ids is not None and not candidate_ids:
+            return []
+        
+        hits = self.index.search(
+            embedding_field, query_embedding, query.top_k,
+            threshold=query.threshold, candidate_ids=candidate_ids,
+            nprobe=query.nprobe, where=where, rerank=query.rerank
+        )
+        return self._hydrate(hits)
+    
+    def search_batch(self, queries: List[SearchQuery],
+                     embedded: Optional[List[Tuple[np.ndarray, str]]] = None) -> List[List[SearchResult]]:
+        # Results come back in request order. In index mode, queries that share an embedding
+        # field, filter, nprobe and rerank are scored with one matrix-matrix product and every hit
+        # is hydrated with a single $in lookup; scan and server modes run each query in turn.
+        embedded = embedded or self.embed_queries(queries)
+        if self.mode != "index":
+            return [self.search(query, pair) for query, pair in zip(queries, embedded)]
+        
+        groups: Dict[Tuple[str, str, Optional[int], Optional[int]], List[int]] = {}
+        filters: Dict[Tuple[str, str, Optional[int], Optional[int]], Dict[str, Any]] = {}
+        for i, (query, (_, field)) in enumerate(zip(queries, embedded)):
+            mongo_query = self._build_filter(query)
+            key = (field, repr(sorted(mongo_query.items())), query.nprobe, query.rerank)
+            groups.setdefault(key, []).append(i)
+            filters[key] = mongo_query
+        
+        hit_lists: List[List[Tuple[Any, float]]] = [[] for _ in queries]
+        for key, members in groups.items():
+            field, _, nprobe, rerank = key
+            where, candidate_ids = self._index_filter(filters[key])
+            if candidate_ids is not None and not candidate_ids:
+                continue
+            batch_hits = self.index.search_batch(
+                field,
+                np.vstack([embedded[i][0] for i in members]),
+                [queries[i].top_k for i in members],
+                [queries[i].threshold for i in members],
+                candidate_ids=candidate_ids,
+                nprobe=nprobe,
+                where=where,
+                rerank=rerank
+            )
+            for i, hits in zip(members, batch_hits):
+                hit_lists[i] = hits
+        return self._hydrate_many(hit_lists)
+    
+    def recall(self, queries: List[SearchQuery],
+               embedded: Optional[List[Tuple[np.ndarray, str]]] = None) -> Dict[str, Any]:
+        # recall@top_k of the index search as configured (IVF probes, quantized first stage and
+        # rerank, each query's nprobe/rerank) against exact float32 search under the same
+        # filters; thresholds are ignored
+        if self.mode != "index":
+            raise ValueError("Recall is measured on the in-memory index (RETRIEVAL_MODE=index)")
+        embedded = embedded or self.embed_queries(queries)
+        recalls = []
+        approximate_seconds = exact_seconds = 0.0
+        for query, (embedding, field) in zip(queries, embedded):
+            where, candidate_ids = self._index_filter(self._build_filter(query))
+            if candidate_ids is not None and not candidate_ids:
+                recalls.append(1.0)
+                continue
+            started = time.perf_counter()
+            approximate = self.index.search(
+                field, embedding, query.top_k, candidate_ids=candidate_ids,
+                nprobe=query.nprobe, where=where, rerank=query.rerank
+            )
+            finished = time.perf_counter()
+            exact = self.index.search(
+                field, embedding, query.top_k, candidate_ids=candidate_ids, where=where, exact=True
+            )
+            approximate_seconds += finished - started
+            exact_seconds += time.perf_counter() - finished
+            expected = {doc_id for doc_id, _ in exact}
+            found = {doc_id for doc_id, _ in approximate}
+            recalls.append(len(expected & found) / len(expected) if expected else 1.0)
+        return {
+            "queries": len(recalls),
+            "recall": float(np.mean(recalls)) if recalls else 1.0,
+            "min_recall": float(np.min(recalls)) if recalls else 1.0,
+            "approximate_ms": approximate_seconds * 1000 / max(len(recalls), 1),
+            "exact_ms": exact_seconds * 1000 / max(len(recalls), 1),
+        }
     
     def search_by_text(self, text: str, top_k: int = 10, 
-                      content_type: Optional[ContentType] = None) -> List[SearchResult]:
+                      content_type: Optional[ContentType] = None,
+                      embedded: Optional[Tuple[np.ndarray, str]] = None) -> List[SearchResult]:
         query = SearchQuery(
             query_text=text,
             top_k=top_k,
             content_type=content_type
         )
-        return self.search(query)
+        return self.search(query, embedded)
     
-    def search_by_image(self, image_path: str, top_k: int = 10,
-                       content_type: Optional[ContentType] = None) -> List[SearchResult]:
+    def search_by_image(self, image_path: Union[str, bytes], top_k: int = 10,
+                       content_type: Optional[ContentType] = None,
+                       embedded: Optional[Tuple[np.ndarray, str]] = None) -> List[SearchResult]:
         query = SearchQuery(
-            query_image_path=image_path,
             top_k=top_k,
-            content_type=content_type
+            content_type=content_type,
+            **_image_query(image_path)
         )
-        return self.search(query)
+        return self.search(query, embedded)
     
-    def search_multimodal(self, text: str, image_path: str, top_k: int = 10) -> List[SearchResult]:
+    def search_multimodal(self, text: str, image_path: Union[str, bytes], top_k: int = 10) -> List[SearchResult]:
         query = SearchQuery(
             query_text=text,
-            query_image_path=image_path,
             top_k=top_k,
-            content_type=ContentType.MULTIMODAL
+            content_type=ContentType.MULTIMODAL,
+            **_image_query(image_path)
         )
         return self.search(query)
     
     def hybrid_search(self, text: Optional[str] = None, 
-                     image_path: Optional[str] = None,
+                     image_path: Optional[Union[str, bytes]] = None,
                      text_weight: float = 0.5,
-                     top_k: int = 10) -> List[SearchResult]:
-        results_dict = {}
-        
-        # Text search
+                     top_k: int = 10,
+                     embeddings: Optional[Dict[str, Tuple[np.ndarray, str]]] = None) -> List[SearchResult]:
+        # score = text_weight * text similarity + (1 - text_weight) * image similarity, with 0
+        # for a modality the document lacks, ranked once over every document rather than by
+        # fusing two truncated per-modality result lists.
+        # `embeddings` may carry precomputed "text"/"image" embed_query() results.
+        if not 0 <= text_weight <= 1:
+            raise ValueError(f"text_weight must be between 0 and 1, got {text_weight}")
+        embeddings = embeddings or {}
+        parts = []
         if text:
-            text_results = self.search_by_text(text, top_k=top_k*2)
-            for result in text_results:
-                doc_id = str(result.document.id)
-                if doc_id not in results_dict:
-                    results_dict[doc_id] = {
-                        'document': result.document,
-                        'text_score': result.score * text_weight,
-                        'image_score': 0
-                    }
-                else:
-                    results_dict[doc_id]['text_score'] = result.score * text_weight
-        
-        # Image search
+            embedding, field = embeddings.get("text") or self.embed_query(SearchQuery(query_text=text))
+            parts.append((field, embedding, text_weight))
         if image_path:
-            image_weight = 1 - text_weight
-            image_results = self.search_by_image(image_path, top_k=top_k*2)
-            for result in image_results:
-                doc_id = str(result.document.id)
-                if doc_id not in results_dict:
-                    results_dict[doc_id] = {
-                        'document': result.document,
-                        'text_score': 0,
-                        'image_score': result.score * image_weight
-                    }
-                else:
-                    results_dict[doc_id]['image_score'] = result.score * image_weight
-        
-        # Combine scores
-        final_results = []
-        for doc_id, data in results_dict.items():
-            combined_score = data['text_score'] + data['image_score']
-            final_results.append(SearchResult(
-                document=data['document'],
-                score=combined_score,
-                distance=1 - combined_score
-            ))
-        
-        # Sort and return top_k
-        final_results.sort(key=lambda x: x.score, reverse=True)
-        return final_results[:top_k]
\ No newline at end of file
+            embedding, field = embeddings.get("image") or self.embed_query(
+                SearchQuery(**_image_query(image_path))
+            )
+            parts.append((field, embedding, 1 - text_weight))
+        if not parts:
+            return []
+        
+        if self.mode == "scan":
+            hits = self._scan(parts, {}, top_k)
+        elif self.mode == "server":
+            hits = self._server_search(parts, {}, top_k)
+        else:
+            hits = self.index.hybrid_search(parts, top_k)
+        return self._hydrate(hits)
@@ -0,0 +1,924 @@
+import calendar
+import heapq
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from ..database.vector_codec import EMBEDDING_FIELDS, decode_vector
+from .filter_index import FilterIndex
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def document_version(doc: Dict[str, Any]) -> int:
+    # updated_at (or created_at) in epoch milliseconds, the precision MongoDB keeps; 0 when unknown
+    timestamp: Optional[datetime] = doc.get("updated_at") or doc.get("created_at")
+    if timestamp is None:
+        return 0
+    return calendar.timegm(timestamp.utctimetuple()) * 1000 + timestamp.microsecond // 1000
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    # argpartition gives the k best in O(n); only those k get fully sorted
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.size)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class ShardedScanner:
+    # Splits one query's scan into contiguous row shards scored on a shared thread pool;
+    # numpy's matmul and the quantizers' kernels release the GIL, so the shards run on
+    # separate cores. Each shard keeps its own top-k and the sorted partial lists are merged
+    # with a heap, giving the same hits as a single-threaded scan (up to which of several
+    # equal scores at the cut-off are kept).
+    def __init__(self, shards: int, workers: int, min_shard_rows: int = 32768):
+        self.shards = shards
+        self.workers = workers
+        self.min_shard_rows = min_shard_rows
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="index-scan")
+
+    def shard_count(self, total: int) -> int:
+        # Small scans stay on the calling thread; a shard is not worth a task below min_shard_rows
+        return max(1, min(self.shards, total // self.min_shard_rows))
+
+    def top_k(self, score_range: Callable[[int, int], Tuple[np.ndarray, np.ndarray]],
+              total: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # score_range(start, stop) -> (rows, scores) of scan positions [start, stop)
+        bounds = np.linspace(0, total, self.shard_count(total) + 1).astype(np.int64)
+
+        def shard(start: int, stop: int) -> List[Tuple[float, int]]:
+            rows, scores = score_range(start, stop)
+            best = top_k_indices(scores, k)
+            best = best[np.isfinite(scores[best])]
+            return list(zip(scores[best].tolist(), rows[best].tolist()))
+
+        partials = list(self._pool.map(shard, bounds[:-1].tolist(), bounds[1:].tolist()))
+        merged = list(itertools.islice(heapq.merge(*partials, key=lambda hit: -hit[0]), k))
+        return (np.array([row for _, row in merged], dtype=np.int64),
+                np.array([score for score, _ in merged], dtype=np.float32))
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+
+def scanner_from_env() -> Optional[ShardedScanner]:
+    # Opt-in: INDEX_SCAN_WORKERS=<cores>; INDEX_SCAN_SHARDS defaults to the worker count
+    workers = int(os.getenv('INDEX_SCAN_WORKERS', '0'))
+    if workers <= 1:
+        return None
+    shards = int(os.getenv('INDEX_SCAN_SHARDS', str(workers)))
+    min_shard_rows = int(os.getenv('INDEX_SCAN_MIN_SHARD_ROWS', '32768'))
+    logger.info(f"Sharded index scan: {shards} shards on {workers} threads")
+    return ShardedScanner(shards, workers, min_shard_rows)
+
+
+class FieldSnapshot(NamedTuple):
+    matrix: np.ndarray
+    ids: np.ndarray
+    alive: np.ndarray
+    dead: int
+    generation: int
+    codes: Dict[str, np.ndarray]
+    # Quantizer whose training produced codes[quantizer.name]
+    quantizer: Any
+
+
+class FieldIndex:
+    # One contiguous, L2-normalized float32 matrix per embedding field plus its _id array.
+    # Rows are append-only; updates and deletes leave tombstoned rows until compact().
+    # Encoders attached with attach_codes() keep a per-row code column (ANN list ids,
+    # quantized codes, ...) in step with the matrix.
+    # With attach_store() the matrix is a read-only map of a VectorStore segment instead:
+    # appends go to disk first and rows keep the store's numbering.
+    def __init__(self, field: str, dim: int, capacity: int = 1024):
+        self.field = field
+        self.ann = None
+        self.quantizer = None
+        # Quantized scores are rescored in float32 for the best top_k * rerank candidates
+        self.rerank = 0
+        # Looks up float32 vectors by _id once the resident matrix has been dropped
+        self.vector_source: Optional[Callable[[List[Any]], np.ndarray]] = None
+        # Shared ShardedScanner for large scans; None scores on the calling thread
+        self.scanner: Optional[ShardedScanner] = None
+        self.store = None
+        self._store_generation: Optional[int] = None
+        self._dim = dim
+        self._has_vectors = True
+        self._lock = threading.Lock()
+        self._matrix = np.zeros((max(capacity, 1), dim), dtype=np.float32)
+        self._ids = np.empty(max(capacity, 1), dtype=object)
+        self._alive = np.zeros(max(capacity, 1), dtype=bool)
+        # Document version (updated_at, ms) each row was written for
+        self._versions = np.zeros(max(capacity, 1), dtype=np.int64)
+        self._size = 0
+        self._dead = 0
+        self._generation = 0
+        self._row_of: Dict[Any, int] = {}
+        self._encoders: Dict[str, Callable[[np.ndarray], np.ndarray]] = {}
+        self._codes: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    @property
+    def has_vectors(self) -> bool:
+        return self._has_vectors
+
+    @property
+    def dead_ratio(self) -> float:
+        return self._dead / self._size if self._size else 0.0
+
+    def snapshot(self) -> FieldSnapshot:
+        # Views are stable: growth and compaction swap in new buffers instead of mutating these
+        with self._lock:
+            return self._snapshot_locked()
+
+    def _snapshot_locked(self) -> FieldSnapshot:
+        size = self._size
+        return FieldSnapshot(
+            self._matrix[:size], self._ids[:size], self._alive[:size],
+            self._dead, self._generation,
+            {name: codes[:size] for name, codes in self._codes.items()},
+            self.quantizer
+        )
+
+    def attach_codes(self, name: str, encoder: Callable[[np.ndarray], np.ndarray],
+                     codes: Optional[np.ndarray] = None, chunk_size: int = 65536) -> None:
+        with self._lock:
+            if codes is None:
+                rows = np.arange(self._size)
+                codes = np.concatenate([
+                    encoder(self._vectors_locked(rows[start:start + chunk_size]))
+                    for start in range(0, self._size, chunk_size)
+                ]) if self._size else encoder(np.zeros((0, self._dim), dtype=np.float32))
+            buffer = np.zeros((len(self._ids),) + codes.shape[1:], dtype=codes.dtype)
+            buffer[:self._size] = codes
+            self._encoders[name] = encoder
+            self._codes[name] = buffer
+
+    def attach_quantizer(self, quantizer: Any, codes: np.ndarray, generation: int) -> bool:
+        # Swaps in a (re)trained quantizer together with its codes for rows [0, len(codes)) of
+        # `generation`; rows appended meanwhile are encoded here. False when a compaction has
+        # renumbered the rows since.
+        with self._lock:
+            if self._generation != generation:
+                return False
+            tail = np.arange(len(codes), self._size)
+            if len(tail):
+                codes = np.concatenate([codes, quantizer.encode(self._vectors_locked(tail))])
+            buffer = np.zeros((len(self._ids),) + codes.shape[1:], dtype=codes.dtype)
+            buffer[:self._size] = codes
+            self._encoders[quantizer.name] = quantizer.encode
+            self._codes[quantizer.name] = buffer
+            self.quantizer = quantizer
+            return True
+
+    def detach_codes(self, name: str) -> None:
+        with self._lock:
+            self._encoders.pop(name, None)
+            self._codes.pop(name, None)
+
+    def drop_vectors(self) -> None:
+        # Keep only the quantized codes resident; float32 rows come from vector_source.
+        # A store-backed matrix lives in the shared page cache, so it is kept.
+        with self._lock:
+            if self.store is not None:
+                return
+            self._has_vectors = False
+            self._matrix = np.zeros((len(self._ids), 0), dtype=np.float32)
+
+    def vectors(self, rows: np.ndarray) -> np.ndarray:
+        with self._lock:
+            return self._vectors_locked(rows)
+
+    def _vectors_locked(self, rows: np.ndarray) -> np.ndarray:
+        if self._has_vectors:
+            return self._matrix[rows]
+        # Reconstructed from the quantizer when the float32 matrix is gone
+        return self.quantizer.decode(self._codes[self.quantizer.name][rows])
+
+    def _grow(self, needed: int) -> None:
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        self._resize(np.arange(self._size), capacity)
+
+    def _resize(self, keep: np.ndarray, capacity: int) -> None:
+        count = len(keep)
+        if self.store is None:
+            matrix = np.zeros((capacity, self._dim if self._has_vectors else 0), dtype=np.float32)
+            matrix[:count] = self._matrix[keep]
+            self._matrix = matrix
+        ids = np.empty(capacity, dtype=object)
+        alive = np.zeros(capacity, dtype=bool)
+        versions = np.zeros(capacity, dtype=np.int64)
+        ids[:count] = self._ids[keep]
+        alive[:count] = self._alive[keep]
+        versions[:count] = self._versions[keep]
+        codes = {}
+        for name, column in self._codes.items():
+            codes[name] = np.zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+            codes[name][:count] = column[keep]
+        self._ids, self._alive, self._versions, self._codes = ids, alive, versions, codes
+
+    def attach_store(self, store) -> None:
+        # Adopt whatever the store already holds for this field (warm start)
+        with self._lock:
+            self.store = store
+            with store.locked():
+                self._load_store_locked()
+
+    def refresh(self) -> None:
+        # Pick up rows other processes appended (or a compaction they ran) since the last call
+        if self.store is None:
+            return
+        with self._lock, self.store.locked():
+            self._refresh_locked()
+
+    def _load_store_locked(self) -> None:
+        data = self.store.open_field(self.field)
+        capacity = max(data.rows * 2 if data is not None else 0, 1024)
+        self._matrix = np.zeros((0, self._dim), dtype=np.float32)
+        self._ids = np.empty(capacity, dtype=object)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._versions = np.zeros(capacity, dtype=np.int64)
+        self._codes = {
+            name: np.zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+            for name, column in self._codes.items()
+        }
+        self._size = 0
+        self._dead = 0
+        self._row_of = {}
+        self._generation += 1
+        self._store_generation = None
+        if data is None:
+            return
+        self._dim = data.matrix.shape[1]
+        self._store_generation = data.generation
+        self._matrix = data.matrix
+        self._append_locked(data.ids, data.matrix, data.versions, data.alive)
+
+    def _refresh_locked(self) -> None:
+        state = self.store.field_state(self.field)
+        if state is None:
+            return
+        if state["generation"] != self._store_generation:
+            self._load_store_locked()
+        elif state["rows"] > self._size:
+            data = self.store.open_field(self.field, start=self._size)
+            self._matrix = data.matrix
+            self._append_locked(data.ids, data.matrix[self._size:], data.versions, data.alive)
+
+    def _append_locked(self, doc_ids: Any, vectors: np.ndarray, versions: np.ndarray,
+                       alive: Optional[np.ndarray] = None, chunk_size: int = 65536) -> None:
+        # Later rows supersede earlier rows for the same _id
+        count = len(doc_ids)
+        start = self._size
+        end = start + count
+        self._grow(end)
+        if self.store is None and self._has_vectors:
+            self._matrix[start:end] = vectors
+        self._ids[start:end] = doc_ids
+        self._versions[start:end] = versions
+        self._alive[start:end] = True if alive is None else alive
+        for name, encoder in self._encoders.items():
+            for offset in range(0, count, chunk_size):
+                block = np.asarray(vectors[offset:offset + chunk_size])
+                self._codes[name][start + offset:start + offset + len(block)] = encoder(block)
+
+        dead = 0
+        for row, doc_id in enumerate(doc_ids, start):
+            if not self._alive[row]:
+                dead += 1
+                continue
+            previous = self._row_of.get(doc_id)
+            if previous is not None:
+                self._alive[previous] = False
+                dead += 1
+            self._row_of[doc_id] = row
+        self._dead += dead
+        self._size = end
+
+    def _is_current(self, doc_id: Any, version: int) -> bool:
+        row = self._row_of.get(doc_id)
+        return version != 0 and row is not None and self._versions[row] == version
+
+    def upsert(self, doc_ids: List[Any], vectors: np.ndarray,
+               versions: Optional[List[int]] = None) -> None:
+        if not doc_ids:
+            return
+        vectors = normalize_rows(vectors)
+        versions = np.zeros(len(doc_ids), dtype=np.int64) if versions is None else np.asarray(versions, dtype=np.int64)
+        with self._lock:
+            if self.store is None:
+                self._append_locked(doc_ids, vectors, versions)
+                return
+
+            with self.store.locked():
+                # Another process sharing the store may already have appended these versions
+                self._refresh_locked()
+                fresh = [i for i, doc_id in enumerate(doc_ids) if not self._is_current(doc_id, versions[i])]
+                if not fresh:
+                    return
+                doc_ids = [doc_ids[i] for i in fresh]
+                vectors, versions = vectors[fresh], versions[fresh]
+                self.store.mark_deleted(self.field, [self._row_of[d] for d in doc_ids if d in self._row_of])
+                self.store.append(self.field, doc_ids, vectors, versions)
+                self._store_generation = self.store.field_state(self.field)["generation"]
+                self._matrix = self.store.matrix(self.field)
+                self._append_locked(doc_ids, vectors, versions)
+
+    def remove(self, doc_ids: Iterable[Any]) -> int:
+        doc_ids = list(doc_ids)
+        with self._lock:
+            if self.store is None:
+                return self._remove_locked(doc_ids)
+            with self.store.locked():
+                # Row numbers are only meaningful against the store's current generation
+                self._refresh_locked()
+                rows = [self._row_of[doc_id] for doc_id in doc_ids if doc_id in self._row_of]
+                self.store.mark_deleted(self.field, rows)
+                return self._remove_locked(doc_ids)
+
+    def _remove_locked(self, doc_ids: Iterable[Any]) -> int:
+        removed = 0
+        for doc_id in doc_ids:
+            row = self._row_of.pop(doc_id, None)
+            if row is not None:
+                self._alive[row] = False
+                removed += 1
+        self._dead += removed
+        return removed
+
+    def compact(self) -> None:
+        with self._lock:
+            if self.store is not None:
+                with self.store.locked():
+                    self._refresh_locked()
+                    self.store.compact(self.field)
+                    self._load_store_locked()
+                return
+            keep = np.flatnonzero(self._alive[:self._size])
+            self._resize(keep, max(len(keep) * 2, 1024))
+            self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids[:len(keep)])}
+            self._size = len(keep)
+            self._dead = 0
+            self._generation += 1
+
+    def rows_for(self, doc_ids: Iterable[Any]) -> Tuple[FieldSnapshot, np.ndarray]:
+        # Sorted rows of doc_ids together with the snapshot they index, read under one lock so
+        # a concurrent remove() or compact() cannot drop or renumber them in between
+        with self._lock:
+            snapshot = self._snapshot_locked()
+            rows = [row for row in map(self._row_of.get, doc_ids) if row is not None]
+        return snapshot, np.unique(np.asarray(rows, dtype=np.int64))
+
+    def search(self, query_embedding: np.ndarray, top_k: int,
+               threshold: Optional[float] = None,
+               rows: Optional[np.ndarray] = None,
+               nprobe: Optional[int] = None,
+               exact: bool = False,
+               rerank: Optional[int] = None,
+               snapshot: Optional[FieldSnapshot] = None) -> List[Tuple[Any, float]]:
+        # `rerank` overrides self.rerank for this query; `exact` skips the ANN and scores a
+        # quantized field in float32 throughout (the reference for recall measurements).
+        # `rows` index `snapshot` when given (see rows_for), a fresh snapshot otherwise.
+        query = normalize_rows(query_embedding)[0]
+        snapshot = self.snapshot() if snapshot is None else snapshot
+
+        if rows is not None:
+            rows = rows[rows < len(snapshot.ids)]
+            rows = rows[snapshot.alive[rows]]
+
+        if not exact and self.ann is not None and self.ann.should_search(snapshot, rows, nprobe):
+            candidates = self.ann.candidates(snapshot, query, nprobe, rows)
+            if candidates is not None:
+                rows = candidates
+
+        rerank = self.rerank if rerank is None else rerank
+        if exact and snapshot.quantizer is not None and snapshot.quantizer.name in snapshot.codes:
+            rows, scores = self._exact(snapshot, query, rows)
+        else:
+            quantized = snapshot.quantizer is not None and snapshot.quantizer.name in snapshot.codes
+            candidates = top_k * rerank if quantized and rerank else top_k
+            rows, scores = self._score_top(snapshot, query, rows, candidates)
+            if quantized and rerank:
+                rows, scores = self._rerank(snapshot, query, rows)
+
+        best = top_k_indices(scores, top_k)
+        best = best[np.isfinite(scores[best])]
+        if threshold:
+            best = best[scores[best] >= threshold]
+
+        ids = snapshot.ids
+        return [(ids[rows[i]], float(scores[i])) for i in best]
+
+    def search_batch(self, queries: np.ndarray, top_k: List[int],
+                     threshold: List[Optional[float]],
+                     rows: Optional[np.ndarray] = None,
+                     nprobe: Optional[int] = None,
+                     block_elements: int = 1 << 24,
+                     rerank: Optional[int] = None,
+                     snapshot: Optional[FieldSnapshot] = None) -> List[List[Tuple[Any, float]]]:
+        # Exact float32 scoring of many queries over the same rows: one (Q, d) x (d, rows)
+        # product per block of rows, keeping a running top max(top_k) per query
+        queries = normalize_rows(queries)
+        snapshot = self.snapshot() if snapshot is None else snapshot
+
+        if rows is not None:
+            rows = rows[rows < len(snapshot.ids)]
+            rows = rows[snapshot.alive[rows]]
+
+        quantized = snapshot.quantizer is not None and snapshot.quantizer.name in snapshot.codes
+        if quantized or (self.ann is not None and self.ann.should_search(snapshot, rows, nprobe)):
+            # Candidate lists and rerank sets differ per query
+            return [
+                self.search(query, k, t, rows, nprobe=nprobe, rerank=rerank, snapshot=snapshot)
+                for query, k, t in zip(queries, top_k, threshold)
+            ]
+
+        k_max = max(top_k, default=0)
+        if k_max <= 0:
+            return [[] for _ in top_k]
+        total = len(snapshot.ids) if rows is None else len(rows)
+        block = max(block_elements // max(len(queries), 1), 1024)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, total, block):
+            stop = min(start + block, total)
+            if rows is None:
+                block_rows = np.arange(start, stop)
+                scores = queries @ snapshot.matrix[start:stop].T
+                if snapshot.dead:
+                    scores[:, ~snapshot.alive[start:stop]] = -np.inf
+            else:
+                block_rows = rows[start:stop]
+                scores = queries @ snapshot.matrix[block_rows].T
+
+            candidate_rows = np.concatenate(
+                [best_rows, np.broadcast_to(block_rows, (len(queries), len(block_rows)))], axis=1
+            )
+            candidate_scores = np.concatenate([best_scores, scores], axis=1)
+            if candidate_scores.shape[1] > k_max:
+                keep = np.argpartition(-candidate_scores, k_max - 1, axis=1)[:, :k_max]
+                candidate_rows = np.take_along_axis(candidate_rows, keep, axis=1)
+                candidate_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+            best_rows, best_scores = candidate_rows, candidate_scores
+
+        ids = snapshot.ids
+        results = []
+        for i, (k, t) in enumerate(zip(top_k, threshold)):
+            scores = best_scores[i]
+            best = np.argsort(-scores, kind="stable")[:k]
+            best = best[np.isfinite(scores[best])]
+            if t:
+                best = best[scores[best] >= t]
+            results.append([(ids[best_rows[i, j]], float(scores[j])) for j in best])
+        return results
+
+    def score_all(self, query_embedding: np.ndarray, top_k: int,
+                  rows: Optional[np.ndarray] = None,
+                  snapshot: Optional[FieldSnapshot] = None) -> Tuple[FieldSnapshot, np.ndarray, bool]:
+        # Float32 score of every snapshot row (-inf for dead or excluded rows), for fusing with
+        # other fields. A quantized field only scores its best top_k * rerank rows by code, in
+        # float32 like search() does; the rest stay -inf for the caller to rescore() on demand.
+        query = normalize_rows(query_embedding)[0]
+        snapshot = self.snapshot() if snapshot is None else snapshot
+        if rows is not None:
+            rows = rows[rows < len(snapshot.ids)]
+            rows = rows[snapshot.alive[rows]]
+        quantized = snapshot.quantizer is not None and snapshot.quantizer.name in snapshot.codes
+        if quantized:
+            rows, _ = self._score_top(snapshot, query, rows, top_k * max(self.rerank, 1))
+            rows, scores = self._rerank(snapshot, query, rows)
+        else:
+            rows, scores, _ = self._score(snapshot, query, rows)
+            if len(rows) == len(snapshot.ids):
+                return snapshot, scores, False
+        dense = np.full(len(snapshot.ids), -np.inf, dtype=np.float32)
+        dense[rows] = scores
+        return snapshot, dense, quantized
+
+    def rescore(self, snapshot: FieldSnapshot, query_embedding: np.ndarray,
+                rows: np.ndarray) -> np.ndarray:
+        # Float32 scores of `rows` of `snapshot`, wherever the vectors are kept
+        return self._rerank(snapshot, normalize_rows(query_embedding)[0], rows)[1]
+
+    def rows_in(self, snapshot: FieldSnapshot, doc_ids: List[Any]) -> np.ndarray:
+        # Row of each doc_id within `snapshot`, -1 if absent (or renumbered by a compaction since)
+        with self._lock:
+            row_of = self._row_of
+            rows = np.fromiter((row_of.get(doc_id, -1) for doc_id in doc_ids), dtype=np.int64, count=len(doc_ids))
+        ids = np.empty(len(doc_ids), dtype=object)
+        ids[:] = doc_ids
+        known = np.flatnonzero((rows >= 0) & (rows < len(snapshot.ids)))
+        stale = known[snapshot.ids[rows[known]] != ids[known]]
+        rows[rows >= len(snapshot.ids)] = -1
+        rows[stale] = -1
+        return rows
+
+    def _score(self, snapshot: FieldSnapshot, query: np.ndarray,
+               rows: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, bool]:
+        quantized = snapshot.quantizer is not None and snapshot.quantizer.name in snapshot.codes
+        total = len(snapshot.ids) if rows is None else len(rows)
+        rows, scores = self._score_range(snapshot, query, rows, 0, total, quantized)
+        return rows, scores, quantized
+
+    def _score_range(self, snapshot: FieldSnapshot, query: np.ndarray, rows: Optional[np.ndarray],
+                     start: int, stop: int, quantized: bool) -> Tuple[np.ndarray, np.ndarray]:
+        # Scan positions [start, stop): rows start..stop of the snapshot, or rows[start:stop]
+        quantizer = snapshot.quantizer
+        if rows is None:
+            if quantized:
+                scores = quantizer.score(query, snapshot.codes[quantizer.name][start:stop])
+            else:
+                scores = snapshot.matrix[start:stop] @ query
+            if snapshot.dead:
+                scores[~snapshot.alive[start:stop]] = -np.inf
+            return np.arange(start, stop), scores
+
+        rows = rows[start:stop]
+        if quantized:
+            return rows, quantizer.score(query, snapshot.codes[quantizer.name][rows])
+        return rows, snapshot.matrix[rows] @ query
+
+    def _score_top(self, snapshot: FieldSnapshot, query: np.ndarray, rows: Optional[np.ndarray],
+                   k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # The k best (rows, scores), best first and finite only; sharded across the scanner's
+        # threads when the scan is large enough
+        quantized = snapshot.quantizer is not None and snapshot.quantizer.name in snapshot.codes
+        total = len(snapshot.ids) if rows is None else len(rows)
+        scanner = self.scanner
+        if scanner is not None and scanner.shard_count(total) > 1:
+            return scanner.top_k(
+                lambda start, stop: self._score_range(snapshot, query, rows, start, stop, quantized), total, k
+            )
+        rows, scores = self._score_range(snapshot, query, rows, 0, total, quantized)
+        best = top_k_indices(scores, k)
+        best = best[np.isfinite(scores[best])]
+        return rows[best], scores[best]
+
+    def _exact(self, snapshot: FieldSnapshot, query: np.ndarray, rows: Optional[np.ndarray],
+               chunk_size: int = 65536) -> Tuple[np.ndarray, np.ndarray]:
+        # Float32 scores of every live candidate of a quantized field, in chunks so vectors
+        # fetched from MongoDB never all sit in memory at once
+        if rows is None:
+            rows = np.flatnonzero(snapshot.alive)
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), chunk_size):
+            _, scores[start:start + chunk_size] = self._rerank(snapshot, query, rows[start:start + chunk_size])
+        return rows, scores
+
+    def exact_vectors(self, snapshot: FieldSnapshot, rows: np.ndarray) -> np.ndarray:
+        # Float32 rows of `snapshot`: resident, fetched by _id once dropped (NaN for documents
+        # gone from MongoDB), or decoded from the codes as a last resort
+        if snapshot.matrix.shape[1]:
+            return snapshot.matrix[rows]
+        if self.vector_source is not None:
+            return self.vector_source(list(snapshot.ids[rows]))
+        return snapshot.quantizer.decode(snapshot.codes[snapshot.quantizer.name][rows])
+
+    def _rerank(self, snapshot: FieldSnapshot, query: np.ndarray,
+                rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        vectors = self.exact_vectors(snapshot, rows)
+        scores = vectors @ query
+        # Rows the source no longer has (deleted meanwhile) come back as NaN
+        scores[np.isnan(scores)] = -np.inf
+        return rows, scores
+
+
+class VectorIndex:
+    def __init__(self, fields: Tuple[str, ...] = EMBEDDING_FIELDS, batch_size: int = 1000,
+                 ann_factory: Optional[Callable[[str], Any]] = None,
+                 quantizer_factory: Optional[Callable[[str], Any]] = None,
+                 rerank: int = 0,
+                 store: Optional[Any] = None,
+                 filter_fields: Tuple[str, ...] = (),
+                 scanner: Optional[ShardedScanner] = None):
+        self.fields = fields
+        self.batch_size = batch_size
+        # Builds an approximate index per field; None keeps every search exact
+        self.ann_factory = ann_factory
+        # Builds a vector quantizer per field; None keeps float32 scoring
+        self.quantizer_factory = quantizer_factory
+        self.rerank = rerank
+        # Optional VectorStore: rows persist on disk and later processes start from them
+        self.store = store
+        # Document fields answered from in-memory bitmaps instead of a MongoDB filter query
+        self.filter_fields = filter_fields
+        self.filters: Optional[FilterIndex] = None
+        # Thread pool shared by every field for multi-core scans of one query
+        self.scanner = scanner
+        self.collection = None
+        self._field_indexes: Dict[str, FieldIndex] = {}
+
+    def build(self, collection) -> None:
+        self.collection = collection
+        if self.store is not None:
+            self.store.reset()
+        field_indexes: Dict[str, FieldIndex] = {}
+        filters = FilterIndex(self.filter_fields) if self.filter_fields else None
+        cursor = collection.find({}, self.projection(), batch_size=self.batch_size)
+        for batch in batched(cursor, self.batch_size):
+            if filters is not None:
+                filters.upsert(batch)
+            self._apply(field_indexes, batch)
+            # Quantize as soon as there is enough to train on, so a quantized build
+            # never holds the whole corpus in float32
+            for index in field_indexes.values():
+                self._attach_quantizer(index)
+
+        for index in field_indexes.values():
+            self._attach_ann(index)
+
+        self._field_indexes = field_indexes
+        self.filters = filters
+        logger.info("Built vector index: " + ", ".join(
+            f"{field}={len(index)}" for field, index in field_indexes.items()
+        ))
+
+    def load(self, collection) -> bool:
+        # Warm start from the store without scanning MongoDB; False when there is nothing to load
+        self.collection = collection
+        if self.store is None:
+            return False
+        field_indexes: Dict[str, FieldIndex] = {}
+        for field in self.store.fields():
+            if field in self.fields:
+                field_indexes[field] = self._new_field_index(field, self.store.field_state(field)["dim"])
+        for index in field_indexes.values():
+            self._attach_quantizer(index)
+            self._attach_ann(index)
+        # The store holds vectors only; the filter columns come from a projection scan
+        filters = None
+        if self.filter_fields and field_indexes:
+            filters = FilterIndex(self.filter_fields)
+            filters.build(collection, self.batch_size)
+
+        self._field_indexes = field_indexes
+        self.filters = filters
+        logger.info("Loaded vector index from store: " + ", ".join(
+            f"{field}={len(index)}" for field, index in field_indexes.items()
+        ))
+        return bool(field_indexes)
+
+    def refresh(self) -> None:
+        # Rows appended to the store by other processes (DataIngestion, other workers)
+        if self.store is None:
+            return
+        for field in self.store.fields():
+            if field in self.fields and field not in self._field_indexes:
+                self._field_indexes[field] = self._new_field_index(field, self.store.field_state(field)["dim"])
+        for index in self._field_indexes.values():
+            index.refresh()
+
+    def projection(self) -> Dict[str, int]:
+        projection = {field: 1 for field in self.fields}
+        projection["created_at"] = 1
+        projection["updated_at"] = 1
+        projection.update({field: 1 for field in self.filter_fields})
+        return projection
+
+    def upsert_documents(self, documents: List[Dict[str, Any]]) -> None:
+        if self.filters is not None:
+            self.filters.upsert(documents)
+        self._apply(self._field_indexes, documents)
+
+    def _apply(self, field_indexes: Dict[str, FieldIndex], documents: List[Dict[str, Any]]) -> None:
+        for field in self.fields:
+            ids, vectors, versions, missing = [], [], [], []
+            for doc in documents:
+                embedding = decode_vector(doc.get(field))
+                if embedding is not None and len(embedding):
+                    ids.append(doc["_id"])
+                    vectors.append(embedding)
+                    versions.append(document_version(doc))
+                else:
+                    missing.append(doc["_id"])
+
+            index = field_indexes.get(field)
+            if ids:
+                if index is None:
+                    index = self._new_field_index(field, len(vectors[0]), capacity=max(len(ids), 1024))
+                    field_indexes[field] = index
+                index.upsert(ids, np.asarray(vectors, dtype=np.float32), versions)
+            if missing and index is not None:
+                index.remove(missing)
+
+    def _new_field_index(self, field: str, dim: int, capacity: int = 1024) -> FieldIndex:
+        index = FieldIndex(field, dim, capacity=capacity)
+        index.rerank = self.rerank
+        index.scanner = self.scanner
+        index.vector_source = self._vector_source(field, dim)
+        if self.store is not None:
+            index.attach_store(self.store)
+        return index
+
+    def _attach_ann(self, index: FieldIndex) -> None:
+        if self.ann_factory is None:
+            return
+        if index.ann is None:
+            index.ann = self.ann_factory(index.field)
+        index.ann.maintain(index)
+
+    def _attach_quantizer(self, index: FieldIndex) -> None:
+        if self.quantizer_factory is None:
+            return
+        if index.quantizer is None:
+            index.quantizer = self.quantizer_factory(index.field)
+        index.quantizer.maintain(index)
+
+    def _vector_source(self, field: str, dim: int) -> Callable[[List[Any]], np.ndarray]:
+        # Float32 rerank vectors for a quantized field whose matrix is not resident
+        def fetch(doc_ids: List[Any]) -> np.ndarray:
+            vectors = np.full((len(doc_ids), dim), np.nan, dtype=np.float32)
+            if self.collection is None or not doc_ids:
+                return vectors
+            position = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+            for doc in self.collection.find({"_id": {"$in": doc_ids}}, {field: 1}):
+                embedding = decode_vector(doc.get(field))
+                if embedding is not None and len(embedding):
+                    vectors[position[doc["_id"]]] = normalize_rows(embedding)[0]
+            return vectors
+        return fetch
+
+    def remove(self, doc_ids: List[Any]) -> int:
+        if self.filters is not None:
+            self.filters.remove(doc_ids)
+        return max((index.remove(doc_ids) for index in self._field_indexes.values()), default=0)
+
+    def compact(self, min_dead_ratio: float = 0.0) -> List[str]:
+        compacted = []
+        for field, index in self._field_indexes.items():
+            if index.dead_ratio > min_dead_ratio:
+                index.compact()
+                compacted.append(field)
+        return compacted
+
+    def maintain(self, min_dead_ratio: float = 0.0) -> List[str]:
+        # Periodic housekeeping: compact tombstones and (re)train approximate indexes
+        compacted = self.compact(min_dead_ratio)
+        for index in self._field_indexes.values():
+            self._attach_ann(index)
+            self._attach_quantizer(index)
+        return compacted
+
+    def close(self) -> None:
+        if self.scanner is not None:
+            self.scanner.shutdown()
+
+    def get(self, field: str) -> Optional[FieldIndex]:
+        return self._field_indexes.get(field)
+
+    def __len__(self) -> int:
+        return sum(len(index) for index in self._field_indexes.values())
+
+    def can_filter(self, mongo_query: Dict[str, Any]) -> bool:
+        return self.filters is not None and self.filters.can_filter(mongo_query)
+
+    def _candidate_rows(self, index: FieldIndex, candidate_ids: Optional[Iterable[Any]],
+                        where: Optional[Dict[str, Any]]) -> Tuple[FieldSnapshot, Optional[np.ndarray]]:
+        # Rows allowed by an explicit id list and/or a can_filter() filter (None means all),
+        # with the one snapshot both are resolved against and the search must score
+        rows = None
+        if candidate_ids is not None:
+            snapshot, rows = index.rows_for(candidate_ids)
+        else:
+            snapshot = index.snapshot()
+        if where:
+            filter_rows = self.filters.rows(index, where, snapshot)
+            rows = filter_rows if rows is None else np.intersect1d(rows, filter_rows)
+        return snapshot, rows
+
+    def search(self, field: str, query_embedding: np.ndarray, top_k: int,
+               threshold: Optional[float] = None,
+               candidate_ids: Optional[Iterable[Any]] = None,
+               nprobe: Optional[int] = None,
+               exact: bool = False,
+               where: Optional[Dict[str, Any]] = None,
+               rerank: Optional[int] = None) -> List[Tuple[Any, float]]:
+        index = self._field_indexes.get(field)
+        if index is None:
+            return []
+
+        snapshot, rows = self._candidate_rows(index, candidate_ids, where)
+        if rows is not None and rows.size == 0:
+            return []
+
+        return index.search(query_embedding, top_k, threshold, rows, nprobe=nprobe, exact=exact,
+                            rerank=rerank, snapshot=snapshot)
+
+    def hybrid_search(self, parts: List[Tuple[str, np.ndarray, float]], top_k: int,
+                      candidate_ids: Optional[Iterable[Any]] = None) -> List[Tuple[Any, float]]:
+        # Exact top_k of sum(weight * similarity) over (field, query, weight) parts; a document
+        # lacking a field scores 0 for it, and weights must be non-negative (the bound below
+        # relies on it). Every field is
+        # scored in full, then candidates are drawn from the m best rows of each field: a
+        # document outside all of them scores at most sum(weight * max(m-th best, 0)), so m
+        # grows until the k-th candidate beats that bound (threshold-algorithm style).
+        # Quantized fields contribute their reranked float32 candidates (see score_all), and
+        # any candidate they did not keep is rescored in float32, so every returned score is
+        # an exact similarity sum.
+        if any(weight < 0 for _, _, weight in parts):
+            raise ValueError("hybrid_search weights must be non-negative")
+        if candidate_ids is not None:
+            candidate_ids = list(candidate_ids)
+        scored = []
+        for field, query, weight in parts:
+            index = self._field_indexes.get(field)
+            if index is None:
+                continue
+            snapshot, rows = index.rows_for(candidate_ids) if candidate_ids is not None else (None, None)
+            snapshot, scores, quantized = index.score_all(query, top_k, rows, snapshot)
+            scored.append((index, snapshot, query, scores, quantized, float(weight)))
+        if not scored or top_k <= 0:
+            return []
+
+        m = top_k * 2
+        while True:
+            candidates: Dict[Any, None] = {}
+            bound = 0.0
+            exhausted = True
+            for index, snapshot, query, scores, quantized, weight in scored:
+                top = top_k_indices(scores, m)
+                top = top[np.isfinite(scores[top])]
+                candidates.update(dict.fromkeys(snapshot.ids[top]))
+                if len(top) == m:
+                    exhausted = False
+                # Rows outside a quantized field's reranked pool are taken to score no better
+                # than the pool's last
+                if len(top) == m or (quantized and len(top)):
+                    bound += weight * max(float(scores[top[-1]]), 0.0)
+
+            fused = np.zeros(len(candidates), dtype=np.float64)
+            ids = list(candidates)
+            for index, snapshot, query, scores, quantized, weight in scored:
+                rows = index.rows_in(snapshot, ids)
+                present = np.flatnonzero(rows >= 0)
+                if quantized:
+                    missing = rows[present]
+                    missing = missing[snapshot.alive[missing] & ~np.isfinite(scores[missing])]
+                    if len(missing):
+                        scores[missing] = index.rescore(snapshot, query, missing)
+                field_scores = scores[rows[present]]
+                finite = np.isfinite(field_scores)
+                fused[present[finite]] += weight * field_scores[finite]
+
+            best = top_k_indices(fused, top_k)
+            if exhausted or (len(best) == top_k and fused[best[-1]] >= bound):
+                return [(ids[i], float(fused[i])) for i in best]
+            m *= 4
+
+    def search_batch(self, field: str, queries: np.ndarray, top_k: List[int],
+                     threshold: List[Optional[float]],
+                     candidate_ids: Optional[Iterable[Any]] = None,
+                     nprobe: Optional[int] = None,
+                     where: Optional[Dict[str, Any]] = None,
+                     rerank: Optional[int] = None) -> List[List[Tuple[Any, float]]]:
+        # Queries sharing a field and a candidate set, scored together
+        index = self._field_indexes.get(field)
+        if index is None:
+            return [[] for _ in top_k]
+
+        snapshot, rows = self._candidate_rows(index, candidate_ids, where)
+        if rows is not None and rows.size == 0:
+            return [[] for _ in top_k]
+
+        return index.search_batch(queries, top_k, threshold, rows, nprobe=nprobe, rerank=rerank,
+                                  snapshot=snapshot)
+
+
+def batched(iterable: Iterable[Any], size: int) -> Iterable[List[Any]]:
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,269 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from ..database.vector_codec import EMBEDDING_FIELDS, decode_vector
+from .vector_index import document_version, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+# ObjectIds are stored as their raw 12 bytes
+ID_DTYPE = np.dtype((np.void, 12))
+MANIFEST_VERSION = 1
+
+
+class StoreField(NamedTuple):
+    matrix: np.ndarray
+    ids: np.ndarray
+    alive: np.ndarray
+    versions: np.ndarray
+    rows: int
+    generation: int
+
+
+class VectorStore:
+    # On-disk, append-only vector segments per embedding field:
+    #   <root>/<field>/vectors.<gen>.f32   raw normalized float32 rows
+    #   <root>/<field>/ids.<gen>.bin       12-byte ObjectIds
+    #   <root>/<field>/alive.<gen>.u8      1 = live, 0 = superseded or deleted
+    #   <root>/<field>/versions.<gen>.i8   document updated_at (ms) the row was written for
+    #   <root>/manifest.json               committed row counts, generations and sync watermarks
+    # Readers np.memmap the vectors, so every process on a node shares one page-cache copy.
+    # Writers take an flock on <root>/.lock; bytes past the manifest's row count are ignored.
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self._lock_path = os.path.join(root, ".lock")
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        # Exclusive across processes and threads; re-entrant within a thread
+        with self._thread_lock:
+            if self._lock_depth == 0:
+                self._lock_file = open(self._lock_path, "a+")
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": MANIFEST_VERSION, "fields": {}, "watermark": None, "tombstone_watermark": None}
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def fields(self) -> List[str]:
+        return list(self.read_manifest()["fields"])
+
+    def field_state(self, field: str) -> Optional[Dict[str, Any]]:
+        return self.read_manifest()["fields"].get(field)
+
+    def watermarks(self) -> Tuple[Optional[datetime], Optional[datetime]]:
+        manifest = self.read_manifest()
+        return (
+            _parse_datetime(manifest.get("watermark")),
+            _parse_datetime(manifest.get("tombstone_watermark")),
+        )
+
+    def update_watermarks(self, watermark: Optional[datetime],
+                          tombstone_watermark: Optional[datetime]) -> None:
+        with self.locked():
+            manifest = self.read_manifest()
+            manifest["watermark"] = watermark.isoformat() if watermark else None
+            manifest["tombstone_watermark"] = tombstone_watermark.isoformat() if tombstone_watermark else None
+            self._write_manifest(manifest)
+
+    def reset(self) -> None:
+        # Start over (full rebuild). Generations keep increasing so readers notice the switch;
+        # old files are unlinked, maps already open on them stay valid
+        with self.locked():
+            manifest = self.read_manifest()
+            for field, state in manifest["fields"].items():
+                self._remove_generation(field, state["generation"])
+                manifest["fields"][field] = dict(state, rows=0, generation=state["generation"] + 1)
+            manifest["watermark"] = None
+            manifest["tombstone_watermark"] = None
+            self._write_manifest(manifest)
+
+    def _path(self, field: str, kind: str, generation: int) -> str:
+        suffix = {"vectors": "f32", "ids": "bin", "alive": "u8", "versions": "i8"}[kind]
+        return os.path.join(self.root, field, f"{kind}.{generation}.{suffix}")
+
+    def _remove_generation(self, field: str, generation: int) -> None:
+        for kind in ("vectors", "ids", "alive", "versions"):
+            try:
+                os.remove(self._path(field, kind, generation))
+            except FileNotFoundError:
+                pass
+
+    def open_field(self, field: str, start: int = 0) -> Optional[StoreField]:
+        # Vectors are memory-mapped (no copy); ids, alive flags and versions from `start` are read
+        state = self.field_state(field)
+        if state is None:
+            return None
+        rows, dim, generation = state["rows"], state["dim"], state["generation"]
+
+        matrix = _memmap(self._path(field, "vectors", generation), np.float32, (rows, dim))
+        raw_ids = _read(self._path(field, "ids", generation), ID_DTYPE, start, rows)
+        ids = np.empty(len(raw_ids), dtype=object)
+        ids[:] = [ObjectId(raw.tobytes()) for raw in raw_ids]
+        alive = _read(self._path(field, "alive", generation), np.uint8, start, rows).astype(bool)
+        versions = _read(self._path(field, "versions", generation), np.int64, start, rows)
+        return StoreField(matrix, ids, alive, versions, rows, generation)
+
+    def matrix(self, field: str) -> np.ndarray:
+        state = self.field_state(field)
+        return _memmap(self._path(field, "vectors", state["generation"]), np.float32,
+                       (state["rows"], state["dim"]))
+
+    def append(self, field: str, doc_ids: List[Any], vectors: np.ndarray,
+               versions: Optional[List[int]] = None) -> int:
+        # Returns the first row written
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if versions is None:
+            versions = [0] * len(doc_ids)
+        with self.locked():
+            manifest = self.read_manifest()
+            state = manifest["fields"].get(field)
+            if state is None:
+                state = {"rows": 0, "dim": int(vectors.shape[1]), "generation": 0}
+                manifest["fields"][field] = state
+                os.makedirs(os.path.join(self.root, field), exist_ok=True)
+            elif state["rows"] == 0:
+                state["dim"] = int(vectors.shape[1])
+            elif state["dim"] != vectors.shape[1]:
+                raise ValueError(f"{field} vectors have dimension {vectors.shape[1]}, store has {state['dim']}")
+            start = state["rows"]
+
+            raw_ids = b"".join(ObjectId(doc_id).binary for doc_id in doc_ids)
+            self._write_at(field, "vectors", state["generation"], start * state["dim"] * 4, vectors.tobytes())
+            self._write_at(field, "ids", state["generation"], start * 12, raw_ids)
+            self._write_at(field, "alive", state["generation"], start, b"\x01" * len(doc_ids))
+            self._write_at(field, "versions", state["generation"], start * 8,
+                           np.asarray(versions, dtype=np.int64).tobytes())
+
+            state["rows"] = start + len(doc_ids)
+            self._write_manifest(manifest)
+            return start
+
+    def _write_at(self, field: str, kind: str, generation: int, offset: int, data: bytes) -> None:
+        path = self._path(field, kind, generation)
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+            f.seek(offset)
+            f.write(data)
+            # Drop any uncommitted tail left by a crashed writer
+            f.truncate()
+
+    def mark_deleted(self, field: str, rows: List[int]) -> None:
+        if not rows:
+            return
+        with self.locked():
+            state = self.field_state(field)
+            if state is None:
+                return
+            with open(self._path(field, "alive", state["generation"]), "r+b") as f:
+                for row in rows:
+                    if row < state["rows"]:
+                        f.seek(row)
+                        f.write(b"\x00")
+
+    def compact(self, field: str) -> None:
+        # Rewrites live rows into the next generation
+        with self.locked():
+            manifest = self.read_manifest()
+            state = manifest["fields"].get(field)
+            if state is None:
+                return
+            data = self.open_field(field)
+            keep = np.flatnonzero(data.alive)
+            generation = state["generation"] + 1
+
+            with open(self._path(field, "vectors", generation), "wb") as f:
+                for start in range(0, len(keep), 65536):
+                    f.write(np.ascontiguousarray(data.matrix[keep[start:start + 65536]]).tobytes())
+            raw_ids = _read(self._path(field, "ids", state["generation"]), ID_DTYPE, 0, state["rows"])
+            with open(self._path(field, "ids", generation), "wb") as f:
+                f.write(raw_ids[keep].tobytes())
+            with open(self._path(field, "alive", generation), "wb") as f:
+                f.write(b"\x01" * len(keep))
+            with open(self._path(field, "versions", generation), "wb") as f:
+                f.write(data.versions[keep].tobytes())
+
+            previous = state["generation"]
+            manifest["fields"][field] = {"rows": int(len(keep)), "dim": state["dim"], "generation": generation}
+            self._write_manifest(manifest)
+            self._remove_generation(field, previous)
+            logger.info(f"Compacted vector store field {field}: {state['rows']} -> {len(keep)} rows")
+
+    def append_documents(self, documents: List[Dict[str, Any]]) -> None:
+        # Used by DataIngestion right after insert, so warm-started readers see new rows
+        for field in EMBEDDING_FIELDS:
+            ids, vectors, versions = [], [], []
+            for doc in documents:
+                embedding = decode_vector(doc.get(field))
+                if embedding is not None and len(embedding):
+                    ids.append(doc["_id"])
+                    vectors.append(embedding)
+                    versions.append(document_version(doc))
+            if ids:
+                self.append(field, ids, normalize_rows(vectors), versions)
+
+    def delete_ids(self, doc_ids: List[Any]) -> None:
+        targets = np.array([ObjectId(doc_id).binary for doc_id in doc_ids], dtype="S12").view(ID_DTYPE)
+        with self.locked():
+            for field, state in self.read_manifest()["fields"].items():
+                raw_ids = _read(self._path(field, "ids", state["generation"]), ID_DTYPE, 0, state["rows"])
+                rows = np.flatnonzero(np.isin(raw_ids, targets))
+                self.mark_deleted(field, rows.tolist())
+
+
+def _memmap(path: str, dtype: Any, shape: Tuple[int, int]) -> np.ndarray:
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+def _read(path: str, dtype: Any, start: int, stop: int) -> np.ndarray:
+    dtype = np.dtype(dtype)
+    if stop <= start:
+        return np.empty(0, dtype=dtype)
+    with open(path, "rb") as f:
+        f.seek(start * dtype.itemsize)
+        return np.frombuffer(f.read((stop - start) * dtype.itemsize), dtype=dtype)
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def vector_store_from_env() -> Optional[VectorStore]:
+    # Opt-in: VECTOR_STORE_DIR enables the memory-mapped warm-start store
+    root = os.getenv('VECTOR_STORE_DIR')
+    return VectorStore(root) if root else None
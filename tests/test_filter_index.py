@@ -0,0 +1,16 @@
+from src.utils.filter_index import FilterIndex
+
+
+def _matches(index, category):
+    return set(index.mask({"metadata.category": category}).nonzero()[0].tolist())
+
+
+def test_upsert_duplicate_id_in_batch_keeps_last_version():
+    index = FilterIndex(("metadata.category",))
+    index.upsert([{"_id": 1, "metadata": {"category": "a"}}])
+    index.upsert([{"_id": 1, "metadata": {"category": "b"}},
+                  {"_id": 1, "metadata": {"category": "a"}}])
+
+    assert _matches(index, "a") == {0}
+    assert _matches(index, "b") == set()
+    assert len(index) == 1
@@ -0,0 +1,112 @@
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from bson import ObjectId
+
+mongomock = pytest.importorskip("mongomock")
+
+from src.utils.index_sync import IndexSynchronizer
+from src.utils.vector_index import VectorIndex
+from src.utils.vector_store import VectorStore
+
+FIELD = "text_embedding"
+DOCUMENTS = 3000
+DIM = 16
+
+
+def _documents(count):
+    # The same documents in every process, as if each read one shared MongoDB
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(count, DIM)).astype(np.float32)
+    created = datetime(2024, 1, 1)
+    return [
+        {"_id": ObjectId(i.to_bytes(12, "big")), FIELD: vectors[i].tolist(),
+         "created_at": created, "updated_at": created + timedelta(seconds=i)}
+        for i in range(count)
+    ]
+
+
+def _start_worker(root, barrier, results, late):
+    # What MultimodalRetriever does on startup with VECTOR_STORE_DIR set; a `late` worker
+    # starts once the other one is part way through its build
+    client = mongomock.MongoClient()
+    collection = client.db.documents
+    collection.insert_many(_documents(DOCUMENTS))
+    index = VectorIndex(fields=(FIELD,), batch_size=250, store=VectorStore(root))
+    synchronizer = IndexSynchronizer(index, collection, client.db.tombstones, interval=0)
+    barrier.wait()
+    while late and not (index.store.field_state(FIELD) or {}).get("rows"):
+        time.sleep(0.001)
+    if not synchronizer.warm_start():
+        synchronizer.rebuild(force=False)
+    results.put(len(index))
+
+
+def _append_worker(root, barrier, documents):
+    # DataIngestion appending freshly inserted documents while another process rebuilds
+    store = VectorStore(root)
+    barrier.wait()
+    for start in range(0, len(documents), 10):
+        store.append_documents(documents[start:start + 10])
+
+
+def _run(processes):
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(120)
+        assert process.exitcode == 0
+
+
+def _live_ids(store):
+    data = store.open_field(FIELD)
+    return data, {doc_id for doc_id, alive in zip(data.ids, data.alive) if alive}
+
+
+def test_workers_on_empty_store_rebuild_once(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(2)
+    results = context.Queue()
+    _run([context.Process(target=_start_worker, args=(str(tmp_path), barrier, results, late))
+          for late in (False, True)])
+
+    assert sorted(results.get(timeout=5) for _ in range(2)) == [DOCUMENTS, DOCUMENTS]
+    store = VectorStore(str(tmp_path))
+    # A second rebuild would have reset the store into generation 1
+    assert store.field_state(FIELD)["generation"] == 0
+    data, live = _live_ids(store)
+    assert data.rows == DOCUMENTS
+    assert live == {doc["_id"] for doc in _documents(DOCUMENTS)}
+    assert store.watermarks()[0] is not None
+
+
+def test_rebuild_with_concurrent_appends(tmp_path):
+    store = VectorStore(str(tmp_path))
+    store.append_documents(_documents(100))
+
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(2)
+    client = mongomock.MongoClient()
+    collection = client.db.documents
+    collection.insert_many(_documents(DOCUMENTS))
+    index = VectorIndex(fields=(FIELD,), batch_size=50, store=store)
+    synchronizer = IndexSynchronizer(index, collection, client.db.tombstones, interval=0)
+
+    appender = context.Process(target=_append_worker, args=(str(tmp_path), barrier, _documents(DOCUMENTS)[-200:]))
+    appender.start()
+    barrier.wait()
+    synchronizer.rebuild()
+    appender.join(120)
+    assert appender.exitcode == 0
+
+    # Appends land either before the reset (and are rebuilt from MongoDB) or after the build,
+    # never in a generation the rebuild unlinks
+    data, live = _live_ids(store)
+    assert live == {doc["_id"] for doc in _documents(DOCUMENTS)}
+    assert DOCUMENTS <= data.rows <= DOCUMENTS + 200
+    reloaded = VectorIndex(fields=(FIELD,), store=VectorStore(str(tmp_path)))
+    assert reloaded.load(collection)
+    assert len(reloaded) == DOCUMENTS